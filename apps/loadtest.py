@@ -0,0 +1,366 @@
+"""Classroom load generator for the lab apps' static servers.
+
+Simulates N students opening `apps/<app>/index.html` at the same moment and
+replays the fetch pattern a browser follows: the page, then the scripts,
+styles, icons and media it references, then the local files those scripts
+and stylesheets pull in (JSON indexes, moderation lists, Python sources).
+When the page loads `coi-serviceworker.js`, the service worker registration
+and the reload it triggers are replayed too.
+
+Start the app's server first (or pass --start), then run from the repo root:
+
+    python apps/loadtest.py chat --clients 30
+    python apps/loadtest.py pychat --clients 30 --rounds 3 --json > before.json
+    python apps/loadtest.py pychat --clients 30 --rounds 3 --baseline before.json
+    python apps/loadtest.py pychat --clients 30 --rounds 3 --baseline before.json --json > after.json
+    python apps/loadtest.py chat --start --clients 30
+
+With --json, a --baseline comparison is included under "baseline".
+
+Only assets served from the app's own origin are fetched; CDN URLs are
+listed with --list but never requested.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+_APPS_DIR = os.path.dirname(os.path.abspath(__file__))
+_DEFAULT_URL = "http://127.0.0.1:8000/"
+# Browsers open at most six HTTP/1.1 connections per origin.
+_CONNECTIONS_PER_CLIENT = 6
+_SERVICE_WORKER = "coi-serviceworker.js"
+_ASSET_EXTENSIONS = (
+    ".js", ".mjs", ".css", ".json", ".py", ".txt", ".md", ".html", ".wasm", ".svg", ".png", ".jpg",
+    ".jpeg", ".gif", ".ico", ".webp", ".mp3", ".wav", ".ogg", ".mp4", ".webm", ".woff", ".woff2",
+)
+_CSS_URL_RE = re.compile(r"""url\(\s*['"]?([^'")]+)['"]?\s*\)""")
+_JS_PATH_RE = re.compile(
+    r"""["'`]((?:\./)?[\w\-./]+\.(?:%s)(?:\?[^"'`\s]*)?)["'`]""" % "|".join(ext[1:] for ext in _ASSET_EXTENSIONS)
+)
+
+
+class _AssetParser(HTMLParser):
+    """Collects the URLs a browser would fetch while parsing a page."""
+
+    _SRC_TAGS = {"script", "img", "audio", "video", "source", "track", "iframe", "embed"}
+    _LINK_RELS = {"stylesheet", "icon", "shortcut", "apple-touch-icon", "preload", "modulepreload", "manifest"}
+
+    def __init__(self):
+        super().__init__()
+        self.urls = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag in self._SRC_TAGS and attrs.get("src"):
+            self.urls.append(attrs["src"])
+        elif tag == "link" and attrs.get("href"):
+            if set((attrs.get("rel") or "").lower().split()) & self._LINK_RELS:
+                self.urls.append(attrs["href"])
+        elif tag in {"video", "object"} and (attrs.get("poster") or attrs.get("data")):
+            self.urls.append(attrs.get("poster") or attrs.get("data"))
+
+
+def _local_path(app_dir: str, url: str):
+    """Map a page-relative URL to an app-relative one (query kept), or None if it is not served locally."""
+    parts = urlsplit(url)
+    if parts.scheme or parts.netloc or not parts.path or parts.path.startswith("/"):
+        return None
+    path = os.path.normpath(os.path.join(app_dir, parts.path))
+    if not path.startswith(app_dir + os.sep) or not os.path.isfile(path):
+        return None
+    relative = os.path.relpath(path, app_dir).replace(os.sep, "/")
+    return f"{relative}?{parts.query}" if parts.query else relative
+
+
+def _file_of(url: str) -> str:
+    return urlsplit(url).path
+
+
+def _unique(items):
+    return list(dict.fromkeys(items))
+
+
+def fetch_plan(app_dir: str, coi_reload: bool = True):
+    """Return the page load as waves of app-relative paths, plus the skipped external URLs.
+
+    Each wave starts once the previous one has finished, the way a browser
+    only discovers script-fetched files after the scripts have run.
+    """
+    with open(os.path.join(app_dir, "index.html"), encoding="utf-8") as fh:
+        parser = _AssetParser()
+        parser.feed(fh.read())
+
+    external = [url for url in parser.urls if urlsplit(url).scheme in {"http", "https"}]
+    referenced = _unique(path for path in (_local_path(app_dir, url) for url in parser.urls) if path)
+
+    page = [["index.html"], referenced]
+    seen = {"index.html", *map(_file_of, referenced)}
+    while True:
+        discovered = []
+        for url in page[-1]:
+            path = _file_of(url)
+            if not path.endswith((".css", ".js", ".mjs")):
+                continue
+            with open(os.path.join(app_dir, path), encoding="utf-8", errors="replace") as fh:
+                text = fh.read()
+            pattern = _CSS_URL_RE if path.endswith(".css") else _JS_PATH_RE
+            base = os.path.dirname(path)
+            for candidate in pattern.findall(text):
+                local = _local_path(app_dir, os.path.join(base, candidate) if base else candidate)
+                if local and _file_of(local) not in seen:
+                    seen.add(_file_of(local))
+                    discovered.append(local)
+        if not discovered:
+            break
+        page.append(discovered)
+
+    waves = list(page)
+    if coi_reload and _SERVICE_WORKER in referenced:
+        # The service worker registers, then reloads the page once so COOP/COEP apply.
+        waves.append([_SERVICE_WORKER])
+        waves.extend(page)
+    return waves, external
+
+
+class _Client:
+    """One simulated student: a handful of keep-alive connections to the server."""
+
+    def __init__(self, host: str, port: int, prefix: str, timeout: float):
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def fetch(self, path: str):
+        """Fetch one path; returns (seconds, body bytes, status or error string)."""
+        started = time.perf_counter()
+        conn = self._connection()
+        try:
+            conn.request("GET", self.prefix + path, headers={"Connection": "keep-alive"})
+            response = conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as exc:
+            conn.close()
+            return time.perf_counter() - started, 0, type(exc).__name__
+        if response.will_close:
+            conn.close()
+        else:
+            with self._lock:
+                self._idle.append(conn)
+        return time.perf_counter() - started, len(body), response.status
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def _load_page(client: _Client, waves, pool: ThreadPoolExecutor, samples: list, lock: threading.Lock) -> float:
+    started = time.perf_counter()
+    for wave in waves:
+        results = list(pool.map(client.fetch, wave))
+        with lock:
+            samples.extend(zip(wave, results))
+    return time.perf_counter() - started
+
+
+def run(url: str, waves, clients: int, rounds: int, timeout: float = 30.0):
+    parts = urlsplit(url)
+    prefix = parts.path if parts.path.endswith("/") else parts.path + "/"
+    samples = []
+    page_times = []
+    lock = threading.Lock()
+    start_line = threading.Barrier(clients)
+
+    def student():
+        client = _Client(parts.hostname, parts.port or 80, prefix, timeout)
+        with ThreadPoolExecutor(_CONNECTIONS_PER_CLIENT) as pool:
+            start_line.wait()
+            for _ in range(rounds):
+                elapsed = _load_page(client, waves, pool, samples, lock)
+                with lock:
+                    page_times.append(elapsed)
+        client.close()
+
+    threads = [threading.Thread(target=student, daemon=True) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, page_times, time.perf_counter() - started
+
+
+def _percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples, page_times, wall: float, clients: int, rounds: int):
+    latencies = [seconds for _, (seconds, _, _) in samples]
+    total_bytes = sum(size for _, (_, size, _) in samples)
+    errors = {}
+    for path, (_, _, status) in samples:
+        if status != 200:
+            key = f"{path}: {status}"
+            errors[key] = errors.get(key, 0) + 1
+
+    return {
+        "clients": clients,
+        "rounds": rounds,
+        "requests": len(samples),
+        "errors": sum(errors.values()),
+        "error_detail": errors,
+        "wall_s": round(wall, 3),
+        "requests_per_s": round(len(samples) / wall, 1) if wall else 0.0,
+        "bytes": total_bytes,
+        "bytes_per_s": round(total_bytes / wall) if wall else 0,
+        "latency_ms": {
+            f"p{pct}": round(_percentile(latencies, pct) * 1000, 2) for pct in (50, 90, 95, 99)
+        } | {"max": round(max(latencies, default=0) * 1000, 2), "mean": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0},
+        "page_load_ms": {
+            f"p{pct}": round(_percentile(page_times, pct) * 1000, 2) for pct in (50, 95)
+        } | {"max": round(max(page_times, default=0) * 1000, 2)},
+    }
+
+
+def _print_report(app: str, url: str, summary):
+    print(f"[{app}] {url} - {summary['clients']} clients x {summary['rounds']} page loads")
+    print(f"  {'requests':<24} {summary['requests']:>12} ({summary['errors']} errors)")
+    print(f"  {'requests/sec':<24} {summary['requests_per_s']:>12.1f}")
+    print(f"  {'bytes/sec':<24} {summary['bytes_per_s'] / 1e6:>12.2f} MB/s")
+    for name, value in summary["latency_ms"].items():
+        print(f"  {'request latency ' + name:<24} {value:>12.2f} ms")
+    for name, value in summary["page_load_ms"].items():
+        print(f"  {'page load ' + name:<24} {value:>12.2f} ms")
+    for detail, count in sorted(summary["error_detail"].items()):
+        print(f"  ! {detail} x{count}")
+
+
+def compare(summary, baseline):
+    """Per-metric baseline, current value and percentage change (None when the baseline is 0)."""
+    rows = [("requests/sec", "requests_per_s"), ("bytes/sec", "bytes_per_s")]
+    rows += [(f"request latency {name}", ("latency_ms", name)) for name in ("p50", "p95", "p99")]
+    rows += [(f"page load {name}", ("page_load_ms", name)) for name in ("p50", "p95")]
+    comparison = []
+    for label, key in rows:
+        now, before = (summary[key[0]][key[1]], baseline[key[0]][key[1]]) if isinstance(key, tuple) else (summary[key], baseline[key])
+        change = round((now - before) / before * 100, 1) if before else None
+        comparison.append({"metric": label, "baseline": before, "current": now, "change_pct": change})
+    return comparison
+
+
+def _print_comparison(comparison):
+    print("  vs baseline:")
+    for row in comparison:
+        change = f"{row['change_pct']:+.1f}%" if row["change_pct"] is not None else "n/a"
+        print(f"    {row['metric']:<22} {row['baseline']:>12} -> {row['current']:<12} {change}")
+
+
+def _wait_for_port(host: str, port: int, server: subprocess.Popen, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            # The lab servers bind without SO_REUSEADDR, so a port still in TIME_WAIT fails here.
+            raise SystemExit(f"server.py exited with code {server.returncode}; is port {port} still in use?")
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f"server did not start listening on {host}:{port}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("app", help="folder under apps/ whose index.html is replayed (e.g. chat, pychat)")
+    parser.add_argument("--url", default=_DEFAULT_URL, help=f"where the app is served (default {_DEFAULT_URL})")
+    parser.add_argument("--clients", type=int, default=30, help="simulated students starting together (default 30)")
+    parser.add_argument("--rounds", type=int, default=1, help="page loads per student (default 1)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request socket timeout in seconds")
+    parser.add_argument("--no-coi-reload", action="store_true", help="skip the service worker registration and reload")
+    parser.add_argument("--start", action="store_true", help="run the app's server.py for the duration of the test")
+    parser.add_argument("--list", action="store_true", help="print the fetch plan and exit")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="compare against a summary saved with --json")
+    args = parser.parse_args(argv)
+
+    app_dir = os.path.join(_APPS_DIR, args.app)
+    if not os.path.isfile(os.path.join(app_dir, "index.html")):
+        parser.error(f"no index.html in {app_dir}")
+    if args.clients < 1 or args.rounds < 1:
+        parser.error("--clients and --rounds must be at least 1")
+
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline, encoding="utf-8") as fh:
+                baseline = json.load(fh)
+        except (OSError, ValueError) as exc:
+            parser.error(f"cannot read baseline {args.baseline}: {exc}")
+
+    waves, external = fetch_plan(app_dir, coi_reload=not args.no_coi_reload)
+    if args.list:
+        for number, wave in enumerate(waves):
+            print(f"wave {number}: {', '.join(wave)}")
+        for url in external:
+            print(f"skipped (external): {url}")
+        return 0
+
+    server = None
+    if args.start:
+        if not os.path.isfile(os.path.join(app_dir, "server.py")):
+            parser.error(f"{args.app} has no server.py to start")
+        server = subprocess.Popen(
+            [sys.executable, "server.py"], cwd=app_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        target = urlsplit(args.url)
+        _wait_for_port(target.hostname, target.port or 80, server)
+
+    try:
+        samples, page_times, wall = run(args.url, waves, args.clients, args.rounds, args.timeout)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    summary = summarize(samples, page_times, wall, args.clients, args.rounds)
+    comparison = compare(summary, baseline) if baseline is not None else None
+    if args.json:
+        report = dict(summary, app=args.app, url=args.url)
+        if comparison is not None:
+            report["baseline"] = {"file": args.baseline, "comparison": comparison}
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(args.app, args.url, summary)
+        if comparison is not None:
+            _print_comparison(comparison)
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,6 +21,8 @@ const HOSTNAME = String(window.location.hostname || "").toLowerCase();
 const IS_GITHUB_PAGES = HOSTNAME === "github.io" || HOSTNAME.endsWith(".github.io");
 
 const PY_PACKAGES = ["numpy", "pandas", "matplotlib", "scikit-learn"];
+// Sibling apps whose index.json is copied into the Pyodide filesystem for retrieval.py.
+const KNOWLEDGE_BASES = ["ask-andrew", "ask-anton", "ask-azure"];
 
 function shouldUseTerminalWorker() {
     // Terminal-style input requires worker mode in PyScript.
@@ -403,6 +405,11 @@ const state = {
     darkTheme: false,
     savedCode: "",
     nopenaiSource: "",
+    nopenaiBytecode: null,
+    moderationList: "",
+    retrievalSource: "",
+    knowledgeBases: {},
+    retrievalIndexes: {},
     selectedTemplate: templateSelect?.value || "",
     activeRunId: 0,
     aboutReturnFocus: null,
@@ -1161,11 +1168,68 @@ function markRuntimeReady() {
 }
 
 async function loadNopenaiSource() {
+    // Fetched once per page session; runs reuse the source and the bytecode compiled from it.
+    if (state.nopenaiSource) {
+        return;
+    }
+
     const response = await fetch("./nopenai.py", { cache: "no-store" });
     if (!response.ok) {
         throw new Error("Failed to load nopenai.py");
     }
     state.nopenaiSource = await response.text();
+    state.nopenaiBytecode = null;
+
+    // nopenai builds its moderation prefilter from the same list llm.js uses.
+    try {
+        const moderationResponse = await fetch("./moderation/mod.txt", { cache: "no-store" });
+        state.moderationList = moderationResponse.ok ? await moderationResponse.text() : "";
+    } catch (error) {
+        console.warn("Unable to load moderation list for nopenai.", error);
+        state.moderationList = "";
+    }
+
+    await loadRetrievalFiles();
+}
+
+// retrieval.py and the knowledge bases it indexes are written into the Pyodide filesystem
+// before each run (see buildExecutionCode), so lab code can `import retrieval`.
+async function loadRetrievalFiles() {
+    try {
+        const response = await fetch("./retrieval.py", { cache: "no-store" });
+        state.retrievalSource = response.ok ? await response.text() : "";
+    } catch (error) {
+        console.warn("Unable to load retrieval.py.", error);
+        state.retrievalSource = "";
+    }
+
+    const entries = await Promise.all(KNOWLEDGE_BASES.map(async (name) => {
+        try {
+            const response = await fetch(`../${name}/index.json`);
+            return response.ok ? [name, await response.text()] : null;
+        } catch (error) {
+            console.warn(`Unable to load the ${name} knowledge base.`, error);
+            return null;
+        }
+    }));
+    state.knowledgeBases = Object.fromEntries(entries.filter(Boolean));
+    state.retrievalIndexes = {};
+}
+
+// Built BM25 index blobs come back from the run that built them, so later runs (including
+// fresh worker interpreters) load the index instead of tokenising the knowledge base again.
+function cacheRetrievalIndex(name, data) {
+    if (typeof name !== "string" || typeof data !== "string" || !data || !(name in state.knowledgeBases)) {
+        return;
+    }
+    state.retrievalIndexes[name] = data;
+}
+
+function cacheNopenaiBytecode(magic, data) {
+    if (typeof magic !== "string" || typeof data !== "string" || !data) {
+        return;
+    }
+    state.nopenaiBytecode = { magic, data };
 }
 
 function setupEditorAsEditOnly() {
@@ -1261,7 +1325,15 @@ function enableEditorEscapeToTabOut() {
 }
 
 function buildExecutionCode(userCode, runId) {
-    const serializedNopenai = JSON.stringify(state.nopenaiSource || "");
+    // Once a run has compiled nopenai, later runs ship only its marshalled bytecode.
+    const cachedBytecode = state.nopenaiBytecode;
+    const serializedNopenai = JSON.stringify(cachedBytecode ? "" : state.nopenaiSource || "");
+    const serializedBytecode = JSON.stringify(cachedBytecode ? cachedBytecode.data : "");
+    const serializedMagic = JSON.stringify(cachedBytecode ? cachedBytecode.magic : "");
+    const serializedModerationList = JSON.stringify(state.moderationList || "");
+    const serializedRetrievalSource = JSON.stringify(state.retrievalSource || "");
+    const serializedKnowledgeBases = JSON.stringify(state.knowledgeBases || {});
+    const serializedRetrievalIndexes = JSON.stringify(state.retrievalIndexes || {});
     const serializedUserCode = JSON.stringify(String(userCode || ""));
     const serializedRunId = Number.isFinite(runId) ? runId : -1;
     return `
@@ -1269,14 +1341,73 @@ import sys
 import types
 import builtins
 import asyncio
+import base64
+import importlib.util
+import marshal
+import time
+
+__nopenai_load_started = time.perf_counter()
+__nopenai_magic = importlib.util.MAGIC_NUMBER.hex()
+__nopenai_bytecode = ${serializedBytecode}
+__nopenai_code = None
+if __nopenai_bytecode and ${serializedMagic} == __nopenai_magic:
+    __nopenai_code = marshal.loads(base64.b64decode(__nopenai_bytecode))
+if __nopenai_code is None:
+    __nopenai_source = ${serializedNopenai}
+    if not __nopenai_source:
+        raise RuntimeError("nopenai bytecode does not match this Python runtime. Reload the page and run again.")
+    __nopenai_code = compile(__nopenai_source, "nopenai.py", "exec")
+    try:
+        __nopenai_payload = base64.b64encode(marshal.dumps(__nopenai_code)).decode("ascii")
+        import js
+        __hosts = [js, getattr(js, "window", None)]
+        try:
+            from pyscript import window as __main_window
+            __hosts.append(__main_window)
+        except Exception:
+            pass
+        for __host in __hosts:
+            if __host is not None and hasattr(__host, "modelCoderCacheNopenaiBytecode"):
+                __host.modelCoderCacheNopenaiBytecode(__nopenai_magic, __nopenai_payload)
+                break
+    except Exception:
+        pass
 
 module = types.ModuleType("nopenai")
-__nopenai_source = ${serializedNopenai}
-exec(__nopenai_source, module.__dict__)
+exec(__nopenai_code, module.__dict__)
 module.__dict__["_MODELCODER_RUN_ID"] = ${serializedRunId}
+if ${serializedModerationList}:
+    module.__dict__["_MODELCODER_MODERATION_LIST"] = ${serializedModerationList}
+module.__dict__["_MODELCODER_LOAD_MS"] = (time.perf_counter() - __nopenai_load_started) * 1000
 sys.modules["nopenai"] = module
 sys.modules["openai"] = module
 
+import os
+
+def __modelcoder_write_file(path, data):
+    # Main-thread runs share one filesystem; leave unchanged files alone so their .pyc stays valid.
+    try:
+        with open(path, "rb") as fh:
+            if fh.read() == data:
+                return
+    except OSError:
+        pass
+    with open(path, "wb") as fh:
+        fh.write(data)
+
+__retrieval_source = ${serializedRetrievalSource}
+__knowledge_bases = ${serializedKnowledgeBases}
+__retrieval_indexes = ${serializedRetrievalIndexes}
+if __retrieval_source:
+    __modelcoder_write_file(os.path.join(os.getcwd(), "retrieval.py"), __retrieval_source.encode("utf-8"))
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    os.makedirs("knowledge", exist_ok=True)
+    for __name, __text in __knowledge_bases.items():
+        __modelcoder_write_file(os.path.join("knowledge", __name + ".json"), __text.encode("utf-8"))
+        if __name in __retrieval_indexes:
+            __modelcoder_write_file(os.path.join("knowledge", __name + ".bm25"), base64.b64decode(__retrieval_indexes[__name]))
+
 __original_input = builtins.input
 
 def __modelcoder_input(*args, **kwargs):
@@ -1320,6 +1451,25 @@ print("Model Coder ready. Running script...")
 try:
     exec(__user_code, globals())
 finally:
+    try:
+        __built_indexes = [
+            __name for __name in __knowledge_bases
+            if __name not in __retrieval_indexes and os.path.exists(os.path.join("knowledge", __name + ".bm25"))
+        ]
+        if __built_indexes:
+            import js
+            __hosts = [js, getattr(js, "window", None)]
+            try:
+                from pyscript import window as __main_window
+                __hosts.append(__main_window)
+            except Exception:
+                pass
+            __host = next((__host for __host in __hosts if __host is not None and hasattr(__host, "modelCoderCacheRetrievalIndex")), None)
+            for __name in __built_indexes if __host is not None else []:
+                with open(os.path.join("knowledge", __name + ".bm25"), "rb") as __fh:
+                    __host.modelCoderCacheRetrievalIndex(__name, base64.b64encode(__fh.read()).decode("ascii"))
+    except Exception:
+        pass
     try:
         import js
         if hasattr(js, "modelCoderMarkRunComplete"):
@@ -1409,6 +1559,9 @@ async function initializeApp() {
         setPill(statusModel, message);
     });
 
+    window.modelCoderCacheNopenaiBytecode = cacheNopenaiBytecode;
+    window.modelCoderCacheRetrievalIndex = cacheRetrievalIndex;
+
     window.modelCoderMarkRunComplete = (runId) => {
         const parsedRunId = Number(runId);
         completeActiveRun(Number.isFinite(parsedRunId) ? parsedRunId : state.activeRunId);
@@ -0,0 +1,222 @@
+"""Micro-benchmarks for nopenai hot paths.
+
+Run from this folder under CPython (or a Pyodide console with nopenai.py on the path):
+
+    python bench.py            # run every benchmark
+    python bench.py codec      # run selected benchmarks
+"""
+
+import argparse
+import base64
+import json
+import marshal
+import os
+import statistics
+import sys
+import time
+import types
+
+import nopenai
+
+_BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    def register(fn):
+        _BENCHMARKS[name] = fn
+        return fn
+
+    return register
+
+
+def _measure(fn, *, repeat: int = 5, number: int = 200) -> float:
+    """Return the median seconds per call of `fn` over `repeat` batches."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return statistics.median(samples)
+
+
+def _report(label: str, seconds: float):
+    print(f"  {label:<44} {seconds * 1e6:>10.1f} us")
+
+
+def _history_payload(turns: int):
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"Question {i}: " + "tell me more " * 20})
+        messages.append({"role": "assistant", "content": f"Answer {i}: " + "here is more detail " * 30})
+    return {"type": "chat.completions.create", "model": "smollm2", "messages": messages, "stream": True}
+
+
+def _stream_chunk():
+    return {
+        "done": False,
+        "chunk": {
+            "object": "chat.completion.chunk",
+            "choices": [{"index": 0, "delta": {"content": " token"}}],
+        },
+    }
+
+
+@benchmark("codec")
+def bench_codec():
+    """Bridge codec cost per request and per stream chunk.
+
+    The JSON codec pays four passes per crossing (Python dumps, JS parse,
+    JS stringify, Python loads); the JS half is approximated with the same
+    passes in Python. The object codec is only measurable inside Pyodide.
+    """
+    codecs = [nopenai._CODECS["json"]]
+    if nopenai._in_browser_runtime():
+        codecs.append(nopenai._CODECS["object"])
+    else:
+        print("  (object codec needs Pyodide's to_js; reporting the JSON cost it removes)")
+
+    cases = [(f"history {turns} turns", _history_payload(turns)) for turns in (1, 10, 100)]
+    cases.append(("stream chunk", _stream_chunk()))
+
+    for codec in codecs:
+        for label, payload in cases:
+            def round_trip(codec=codec, payload=payload):
+                encoded = codec.encode(payload)
+                if isinstance(encoded, str):
+                    encoded = json.dumps(json.loads(encoded))
+                codec.decode(encoded)
+
+            number = 20 if "100" in label else 200
+            _report(f"{codec.name}: {label}", _measure(round_trip, number=number))
+
+
+@benchmark("startup")
+def bench_startup():
+    """Cost of materialising the nopenai module at the start of a run.
+
+    "source" is the compile-and-exec path of a first run; "bytecode" is the
+    path app.js takes afterwards (base64 marshal payload, no compile).
+    """
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "nopenai.py"), encoding="utf-8") as fh:
+        source = fh.read()
+    payload = base64.b64encode(marshal.dumps(compile(source, "nopenai.py", "exec"))).decode("ascii")
+
+    def from_source():
+        module = types.ModuleType("nopenai")
+        exec(compile(source, "nopenai.py", "exec"), module.__dict__)
+
+    def from_bytecode():
+        module = types.ModuleType("nopenai")
+        exec(marshal.loads(base64.b64decode(payload)), module.__dict__)
+        module.__dict__["_MODELCODER_RUN_ID"] = 1
+
+    _report("source: compile + exec", _measure(from_source, number=20))
+    _report("bytecode: unmarshal + exec", _measure(from_bytecode, number=20))
+
+
+@benchmark("moderation")
+def bench_moderation():
+    """Moderation prefilter against the per-term scan llm.js performs."""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "moderation", "mod.txt"), encoding="utf-8") as fh:
+        text = fh.read()
+    matcher = nopenai._ModerationMatcher.from_text(text)
+    terms = [
+        "".join(chr(ord(ch) + 1) for ch in reversed(line.strip().lower()))
+        for line in text.splitlines()
+        if line.strip()
+    ]
+
+    for size in (200, 2000, 20000):
+        prompt = ("how do I write a python loop " * (size // 29 + 1))[:size]
+        _report(f"aho-corasick: {size} chars", _measure(lambda: matcher.matches(prompt), number=50))
+        _report(f"term scan: {size} chars", _measure(lambda: any(t in prompt.lower() for t in terms), number=50))
+
+
+@benchmark("retrieval")
+def bench_retrieval():
+    """BM25 index build, cached load and top-k query over an ask-* knowledge base."""
+    import retrieval
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ask-andrew", "index.json")
+    index = retrieval.BM25Index.from_knowledge_base(path)
+    blob = index.to_bytes()
+
+    _report("build from index.json", _measure(lambda: retrieval.BM25Index.from_knowledge_base(path), number=10))
+    _report("load serialized index", _measure(lambda: retrieval.BM25Index.from_bytes(blob), number=50))
+    for query in ("responsible ai", "how can I detect objects in images with computer vision"):
+        _report(f"top-3: {query[:32]}", _measure(lambda: index.search(query, 3), number=500))
+
+
+def _ring_producer(name: str, count: int):
+    ring, block = nopenai._StreamRing.attach_shared(name)
+    record = json.dumps(_stream_chunk()).encode("utf-8")
+    for _ in range(count):
+        ring.write(record)
+    ring.close()
+    ring.memory.release()
+    block.close()
+
+
+@benchmark("ring")
+def bench_ring():
+    """Stream chunks through the shared-memory ring against the JSON bridge codec.
+
+    Uses the CPython `multiprocessing.shared_memory` implementation of the
+    ring llm.js writes in the browser. "cross-process" runs a producer
+    process and reports wall time per chunk, including waits for the reader.
+    """
+    import multiprocessing
+
+    chunk = _stream_chunk()
+    record = json.dumps(chunk).encode("utf-8")
+    codec = nopenai._CODECS["json"]
+
+    ring, block = nopenai._StreamRing.create_shared()
+    try:
+        def ring_round_trip():
+            ring.write(record)
+            json.loads(ring.read())
+
+        _report("json codec: stream chunk", _measure(lambda: codec.decode(json.dumps(json.loads(codec.encode(chunk))))))
+        _report("ring: write + read in process", _measure(ring_round_trip, number=2000))
+
+        count = 20000
+        for capacity in (1 << 10, 1 << 16):
+            cross, cross_block = nopenai._StreamRing.create_shared(capacity)
+            producer = multiprocessing.Process(target=_ring_producer, args=(cross_block.name, count))
+            start = time.perf_counter()
+            producer.start()
+            received = 0
+            while cross.read(timeout=30) is not None:
+                received += 1
+            elapsed = time.perf_counter() - start
+            producer.join()
+            cross.memory.release()
+            cross_block.close()
+            cross_block.unlink()
+            _report(f"ring: cross-process, {capacity} B ({received} chunks)", elapsed / max(received, 1))
+    finally:
+        ring.memory.release()
+        block.close()
+        block.unlink()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run ({', '.join(_BENCHMARKS)})")
+    args = parser.parse_args(argv)
+
+    names = args.names or list(_BENCHMARKS)
+    unknown = [name for name in names if name not in _BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    for name in names:
+        print(f"[{name}]")
+        _BENCHMARKS[name]()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,9 +6,27 @@ const WASM_PATHS = {
     "multi-thread/wllama.wasm": "https://cdn.jsdelivr.net/npm/@wllama/wllama@2.3.7/esm/single-thread/wllama.wasm"
 };
 
-const MODEL_REPO = "ngxson/SmolLM2-360M-Instruct-Q8_0-GGUF";
-const MODEL_FILE = "smollm2-360m-instruct-q8_0.gguf";
+// Models the bridge may load, keyed by the name lab code passes as `model`.
+const MODEL_REGISTRY = {
+    smollm2: {
+        repo: "ngxson/SmolLM2-360M-Instruct-Q8_0-GGUF",
+        file: "smollm2-360m-instruct-q8_0.gguf",
+        contextWindow: 2048
+    }
+};
+const DEFAULT_MODEL_NAME = "smollm2";
+const WARMUP_MAX_TOKENS = 8;
+const MAX_CHOICES = 8;
 const MODERATION_LIST_PATH = "./moderation/mod.txt";
+const JSON_MODE_INSTRUCTION = "Respond only with a single valid JSON object. Do not add any text before or after it.";
+const TOOL_CALL_INSTRUCTION = "You can call the tools listed below. To call a tool, reply with <tool_call>{\"name\": \"tool_name\", \"arguments\": {...}}</tool_call>. Put each independent call in its own <tool_call> block in the same reply. Tool results come back inside <tool_response> blocks. Answer normally when no tool is needed.";
+// Stream ring layout, shared with nopenai._StreamRing: eight int32 header slots, then the data area.
+const RING_MAGIC = 0x31474e52;
+const RING_HEADER_BYTES = 32;
+const RING_SLOT = { magic: 0, capacity: 1, head: 2, tail: 3, closed: 4, seq: 5, ready: 6, ack: 7 };
+const RING_WRAP_MARKER = 0xffffffff;
+const RING_ACK_TIMEOUT_MS = 1000;
+const RING_WAIT_SLICE_MS = 250;
 const MODERATION_SAFE_RESPONSE = "I'm sorry. I can't help with that. Either your system instructions or user input included content that was flagged by the moderation system. If you think this was a mistake, please try rephrasing your input or instructions and try again.";
 
 function makeId(prefix) {
@@ -77,6 +95,195 @@ function contentToText(content) {
     return String(content ?? "");
 }
 
+function isJsonResponseFormat(format) {
+    return Boolean(format) && ["json_object", "json_schema"].includes(String(format.type || ""));
+}
+
+function withJsonModeInstruction(messages, format) {
+    if (!isJsonResponseFormat(format)) {
+        return messages;
+    }
+
+    let instruction = JSON_MODE_INSTRUCTION;
+    const schema = format.json_schema?.schema ?? format.schema;
+    if (schema) {
+        instruction += ` It must match this JSON schema: ${JSON.stringify(schema)}`;
+    }
+    return [{ role: "system", content: instruction }, ...messages];
+}
+
+// The main thread may not block in Atomics.wait, so the writer waits asynchronously.
+function waitForSlotChange(header, slot, value, timeoutMs) {
+    if (typeof Atomics.waitAsync === "function") {
+        const result = Atomics.waitAsync(header, slot, value, timeoutMs);
+        return result.async ? result.value : Promise.resolve(result.value);
+    }
+    return sleep(Math.min(timeoutMs, 5));
+}
+
+// Producer half of the single-producer, single-consumer stream ring. Records are a
+// little-endian uint32 length plus UTF-8 JSON, padded to 4 bytes; a record that would
+// cross the end of the data area is preceded by RING_WRAP_MARKER. `head` and `tail`
+// count bytes and wrap at 2^32; only the writer moves `head`, only the reader `tail`.
+class StreamRingWriter {
+    constructor(buffer) {
+        if (typeof SharedArrayBuffer === "undefined" || !(buffer instanceof SharedArrayBuffer)) {
+            throw new Error("Stream ring needs a SharedArrayBuffer.");
+        }
+
+        this.header = new Int32Array(buffer, 0, 8);
+        this.view = new DataView(buffer);
+        this.bytes = new Uint8Array(buffer);
+        this.capacity = Atomics.load(this.header, RING_SLOT.capacity);
+        this.encoder = new TextEncoder();
+
+        const validCapacity = this.capacity > 0 && (this.capacity & (this.capacity - 1)) === 0;
+        if (Atomics.load(this.header, RING_SLOT.magic) !== RING_MAGIC || !validCapacity
+            || RING_HEADER_BYTES + this.capacity > buffer.byteLength) {
+            throw new Error("Invalid stream ring header.");
+        }
+    }
+
+    markReady() {
+        Atomics.store(this.header, RING_SLOT.ready, 1);
+    }
+
+    async waitForAck(timeoutMs) {
+        const deadline = performance.now() + timeoutMs;
+        while (Atomics.load(this.header, RING_SLOT.ack) !== 1) {
+            const remaining = deadline - performance.now();
+            if (remaining <= 0) {
+                return false;
+            }
+            await waitForSlotChange(this.header, RING_SLOT.ack, 0, remaining);
+        }
+        return true;
+    }
+
+    _free() {
+        const used = (Atomics.load(this.header, RING_SLOT.head) - Atomics.load(this.header, RING_SLOT.tail)) >>> 0;
+        return this.capacity - used;
+    }
+
+    async _waitForSpace(size, shouldAbort) {
+        while (this._free() < size) {
+            if (shouldAbort()) {
+                return false;
+            }
+            const tail = Atomics.load(this.header, RING_SLOT.tail);
+            await waitForSlotChange(this.header, RING_SLOT.tail, tail, RING_WAIT_SLICE_MS);
+        }
+        return true;
+    }
+
+    _signal() {
+        Atomics.add(this.header, RING_SLOT.seq, 1);
+        Atomics.notify(this.header, RING_SLOT.seq);
+    }
+
+    async write(record, shouldAbort = () => false) {
+        const payload = this.encoder.encode(JSON.stringify(record));
+        const size = 4 + ((payload.length + 3) & ~3);
+        if (size > this.capacity) {
+            throw new Error(`Stream chunk of ${payload.length} bytes does not fit the ${this.capacity}-byte ring.`);
+        }
+
+        let head = Atomics.load(this.header, RING_SLOT.head) >>> 0;
+        let position = head % this.capacity;
+        const contiguous = this.capacity - position;
+        if (contiguous < size) {
+            if (!(await this._waitForSpace(contiguous, shouldAbort))) {
+                return false;
+            }
+            this.view.setUint32(RING_HEADER_BYTES + position, RING_WRAP_MARKER, true);
+            head = (head + contiguous) >>> 0;
+            Atomics.store(this.header, RING_SLOT.head, head | 0);
+            this._signal();
+            position = 0;
+        }
+
+        if (!(await this._waitForSpace(size, shouldAbort))) {
+            return false;
+        }
+        this.view.setUint32(RING_HEADER_BYTES + position, payload.length, true);
+        this.bytes.set(payload, RING_HEADER_BYTES + position + 4);
+        Atomics.store(this.header, RING_SLOT.head, (head + size) | 0);
+        this._signal();
+        return true;
+    }
+
+    close() {
+        Atomics.store(this.header, RING_SLOT.closed, 1);
+        this._signal();
+    }
+}
+
+function toolDefinition(tool) {
+    // Chat tools nest the definition under `function`; Responses tools are flat.
+    const definition = tool?.function ?? tool ?? {};
+    return {
+        name: String(definition.name || ""),
+        description: String(definition.description || ""),
+        parameters: definition.parameters ?? {}
+    };
+}
+
+function withToolInstruction(messages, tools, toolChoice) {
+    if (!Array.isArray(tools) || tools.length === 0 || toolChoice === "none") {
+        return messages;
+    }
+
+    let instruction = `${TOOL_CALL_INSTRUCTION}\nTools: ${JSON.stringify(tools.map(toolDefinition))}`;
+    const forcedName = toolChoice?.function?.name ?? toolChoice?.name;
+    if (forcedName) {
+        instruction += `\nYou must call the ${forcedName} tool.`;
+    } else if (toolChoice === "required") {
+        instruction += "\nYou must call at least one tool.";
+    }
+    return [{ role: "system", content: instruction }, ...messages];
+}
+
+function toolCallsToText(toolCalls) {
+    return toolCalls
+        .map((call) => {
+            const definition = call?.function ?? call ?? {};
+            let args = definition.arguments ?? {};
+            if (typeof args === "string") {
+                try {
+                    args = JSON.parse(args);
+                } catch {
+                    // Keep the raw string; the model still sees what it produced.
+                }
+            }
+            return `<tool_call>\n${JSON.stringify({ name: definition.name, arguments: args })}\n</tool_call>`;
+        })
+        .join("\n");
+}
+
+function messageToText(message) {
+    if (message.role === "tool") {
+        return `<tool_response>\n${contentToText(message.content)}\n</tool_response>`;
+    }
+
+    const content = message.content === null || message.content === undefined ? "" : contentToText(message.content);
+    if (message.role === "assistant" && Array.isArray(message.tool_calls) && message.tool_calls.length > 0) {
+        return [content, toolCallsToText(message.tool_calls)].filter((text) => text.length > 0).join("\n");
+    }
+    return content;
+}
+
+function normalizeChoiceCount(n) {
+    if (n === undefined || n === null) {
+        return 1;
+    }
+
+    const count = Number(n);
+    if (!Number.isInteger(count) || count < 1 || count > MAX_CHOICES) {
+        throw new Error(`n must be an integer between 1 and ${MAX_CHOICES}.`);
+    }
+    return count;
+}
+
 function validateMessageContent(content, label) {
     if (typeof content === "string") {
         return;
@@ -110,13 +317,16 @@ function validateMessages(messages, label = "messages") {
         throw new Error(`${label} must be an array.`);
     }
 
-    const allowedRoles = new Set(["developer", "system", "user", "assistant"]);
+    const allowedRoles = new Set(["developer", "system", "user", "assistant", "tool"]);
     for (const message of messages) {
         if (!message || typeof message !== "object") {
             throw new Error(`${label} must contain objects with role and content.`);
         }
         if (!allowedRoles.has(message.role)) {
-            throw new Error("Message role must be developer, user, assistant, or system.");
+            throw new Error("Message role must be developer, user, assistant, tool, or system.");
+        }
+        if (message.role === "assistant" && Array.isArray(message.tool_calls) && message.content == null) {
+            continue;
         }
         validateMessageContent(message.content, label);
     }
@@ -125,8 +335,10 @@ function validateMessages(messages, label = "messages") {
 class ModelCoderLLM {
     constructor() {
         this.wllama = null;
+        this.modelName = null;
         this.isReady = false;
         this.isLoading = false;
+        this.loadPromise = null;
         this.statusCallback = null;
         this.streamSessions = new Map();
         this.responsesById = new Map();
@@ -227,7 +439,7 @@ class ModelCoderLLM {
         return prompts;
     }
 
-    _createSafeResponseStream(streamType, requestedRunId = null) {
+    _createSafeResponseStream(streamType, requestedRunId = null, choiceCount = 1) {
         const streamId = makeId("stream");
         const responseId = makeId("resp");
         const createdAtVersion = this.sessionVersion;
@@ -242,27 +454,29 @@ class ModelCoderLLM {
         };
 
         if (streamType === "chat") {
-            session.queue.push({
-                object: "chat.completion.chunk",
-                choices: [
-                    {
-                        index: 0,
-                        delta: {
-                            content: MODERATION_SAFE_RESPONSE
+            for (let index = 0; index < choiceCount; index += 1) {
+                session.queue.push({
+                    object: "chat.completion.chunk",
+                    choices: [
+                        {
+                            index,
+                            delta: {
+                                content: MODERATION_SAFE_RESPONSE
+                            }
                         }
-                    }
-                ]
-            });
-            session.queue.push({
-                object: "chat.completion.chunk",
-                choices: [
-                    {
-                        index: 0,
-                        delta: {},
-                        finish_reason: "stop"
-                    }
-                ]
-            });
+                    ]
+                });
+                session.queue.push({
+                    object: "chat.completion.chunk",
+                    choices: [
+                        {
+                            index,
+                            delta: {},
+                            finish_reason: "stop"
+                        }
+                    ]
+                });
+            }
         } else {
             session.queue.push({
                 type: "response.output_text.delta",
@@ -283,22 +497,20 @@ class ModelCoderLLM {
         return { stream_id: streamId, response_id: responseId };
     }
 
-    _createSafeChatResponse() {
+    _createSafeChatResponse(choiceCount = 1) {
         const responseId = makeId("chatcmpl");
         this.responsesById.set(responseId, MODERATION_SAFE_RESPONSE);
         return {
             id: responseId,
             object: "chat.completion",
-            choices: [
-                {
-                    index: 0,
-                    finish_reason: "stop",
-                    message: {
-                        role: "assistant",
-                        content: MODERATION_SAFE_RESPONSE
-                    }
+            choices: Array.from({ length: choiceCount }, (_, index) => ({
+                index,
+                finish_reason: "stop",
+                message: {
+                    role: "assistant",
+                    content: MODERATION_SAFE_RESPONSE
                 }
-            ]
+            }))
         };
     }
 
@@ -365,8 +577,15 @@ class ModelCoderLLM {
     async hardResetSession() {
         await this.resetSession();
 
+        const modelName = this.modelName || DEFAULT_MODEL_NAME;
+        await this._disposeModel();
+        await this.initialize(2, modelName);
+    }
+
+    async _disposeModel() {
         const current = this.wllama;
         this.wllama = null;
+        this.modelName = null;
         this.isReady = false;
         this.isLoading = false;
 
@@ -378,8 +597,6 @@ class ModelCoderLLM {
                 }
             }
         }
-
-        await this.initialize(2);
     }
 
     _status(kind, message) {
@@ -388,24 +605,44 @@ class ModelCoderLLM {
         }
     }
 
-    async initialize(maxRetries = 3) {
-        if (this.isReady) {
-            return;
+    async initialize(maxRetries = 3, modelName = DEFAULT_MODEL_NAME) {
+        if (!MODEL_REGISTRY[modelName]) {
+            throw new Error(`Unknown model '${modelName}'. Available models: ${Object.keys(MODEL_REGISTRY).join(", ")}.`);
+        }
+
+        if (this.isLoading && this.loadPromise) {
+            // Callers that arrive mid-load (e.g. a Python preload during page startup) wait for it.
+            await this.loadPromise.catch(() => { });
         }
 
-        if (this.isLoading) {
+        if (this.isReady && this.modelName === modelName) {
             return;
         }
 
+        if (this.isReady) {
+            await this.resetSession();
+            await this._disposeModel();
+        }
+
+        this.loadPromise = this._initializeWithRetries(maxRetries, modelName);
+        try {
+            await this.loadPromise;
+        } finally {
+            this.loadPromise = null;
+        }
+    }
+
+    async _initializeWithRetries(maxRetries, modelName) {
         this.isLoading = true;
         let lastError = null;
 
         for (let attempt = 1; attempt <= maxRetries; attempt += 1) {
             try {
                 this._status("loading", `Loading local model (attempt ${attempt}/${maxRetries})...`);
-                await this._loadModel();
+                await this._loadModel(modelName);
+                this.modelName = modelName;
                 this.isReady = true;
-                this._status("ready", "Model ready: smollm2");
+                this._status("ready", `Model ready: ${modelName}`);
                 this.isLoading = false;
                 return;
             } catch (error) {
@@ -421,10 +658,11 @@ class ModelCoderLLM {
         throw lastError || new Error("Model initialization failed");
     }
 
-    async _loadModel() {
+    async _loadModel(modelName) {
+        const entry = MODEL_REGISTRY[modelName];
         this.wllama = new Wllama(WASM_PATHS);
-        await this.wllama.loadModelFromHF(MODEL_REPO, MODEL_FILE, {
-            n_ctx: 2048,
+        await this.wllama.loadModelFromHF(entry.repo, entry.file, {
+            n_ctx: entry.contextWindow,
             n_threads: 1,
             progressCallback: ({ loaded, total }) => {
                 if (!total) {
@@ -441,16 +679,34 @@ class ModelCoderLLM {
         if (!this.isReady || !this.wllama) {
             throw new Error("Model is not ready yet.");
         }
-        if (model !== "smollm2") {
-            throw new Error("The model parameter must be 'smollm2'.");
+        if (!MODEL_REGISTRY[model]) {
+            throw new Error(`The model parameter must be one of: ${Object.keys(MODEL_REGISTRY).join(", ")}.`);
         }
+        if (model !== this.modelName) {
+            throw new Error(`Model '${model}' is not loaded. Call client.models.preload("${model}") first.`);
+        }
+    }
+
+    async warmup(modelName, prompt, maxTokens = WARMUP_MAX_TOKENS) {
+        this._ensureClient(modelName);
+
+        // A short generation pays the first-prefill and allocation costs before real requests arrive.
+        const started = performance.now();
+        await this._complete(
+            this._toChatML([{ role: "user", content: String(prompt ?? "") }]),
+            null,
+            this.sessionVersion,
+            null,
+            { nPredict: Math.max(1, Number(maxTokens) || WARMUP_MAX_TOKENS) }
+        );
+        return performance.now() - started;
     }
 
     _toChatML(messages) {
         let prompt = "";
         for (const message of messages) {
             const role = roleToChatML(message.role);
-            const content = contentToText(message.content);
+            const content = messageToText(message);
             prompt += `<|im_start|>${role}\n${content}\n<|im_end|>\n\n`;
         }
         prompt += "<|im_start|>assistant\n";
@@ -469,6 +725,20 @@ class ModelCoderLLM {
 
         if (Array.isArray(input)) {
             for (const message of input) {
+                if (message?.type === "function_call") {
+                    // Consecutive calls belong to one assistant turn.
+                    const previous = messages[messages.length - 1];
+                    if (previous?.role === "assistant" && Array.isArray(previous.tool_calls) && previous.content === null) {
+                        previous.tool_calls.push(message);
+                    } else {
+                        messages.push({ role: "assistant", content: null, tool_calls: [message] });
+                    }
+                    continue;
+                }
+                if (message?.type === "function_call_output") {
+                    messages.push({ role: "tool", tool_call_id: message.call_id, content: contentToText(message.output) });
+                    continue;
+                }
                 messages.push({
                     role: String(message.role || "user"),
                     content: contentToText(message.content)
@@ -481,14 +751,45 @@ class ModelCoderLLM {
         return messages;
     }
 
-    async _complete(prompt, onDelta, expectedSessionVersion = this.sessionVersion) {
+    async _complete(prompt, onDelta, expectedSessionVersion = this.sessionVersion, shouldStop = null, options = {}) {
         await this.wllama.kvClear().catch(() => { });
+        const text = await this._generate(prompt, onDelta, expectedSessionVersion, shouldStop, options);
+        await this.wllama.kvClear().catch(() => { });
+        return text;
+    }
 
+    async _completeChoices(prompt, choiceCount, onDelta, onChoiceDone, expectedSessionVersion = this.sessionVersion, shouldStop = null) {
+        // The prompt is prefilled once; later candidates reuse its KV cache and only decode new tokens.
+        await this.wllama.kvClear().catch(() => { });
+
+        const texts = [];
+        for (let index = 0; index < choiceCount; index += 1) {
+            const text = await this._generate(
+                prompt,
+                typeof onDelta === "function" ? (delta) => onDelta(index, delta) : null,
+                expectedSessionVersion,
+                shouldStop
+            );
+            texts.push(text);
+            if (typeof onChoiceDone === "function") {
+                onChoiceDone(index, text);
+            }
+
+            if (expectedSessionVersion !== this.sessionVersion || (typeof shouldStop === "function" && shouldStop())) {
+                break;
+            }
+        }
+
+        await this.wllama.kvClear().catch(() => { });
+        return texts;
+    }
+
+    async _generate(prompt, onDelta, expectedSessionVersion, shouldStop, options = {}) {
         let previousText = "";
         let fullText = "";
 
         const stream = await this.wllama.createCompletion(prompt, {
-            nPredict: 320,
+            nPredict: options.nPredict ?? 320,
             seed: -1,
             sampling: {
                 temp: 0.6,
@@ -498,6 +799,7 @@ class ModelCoderLLM {
                 mirostat: 0
             },
             stopTokens: ["<|im_end|>", "<|im_start|>"],
+            useCache: true,
             stream: true
         });
 
@@ -506,6 +808,10 @@ class ModelCoderLLM {
                 break;
             }
 
+            if (typeof shouldStop === "function" && shouldStop()) {
+                break;
+            }
+
             if (!chunk.currentText) {
                 continue;
             }
@@ -518,11 +824,10 @@ class ModelCoderLLM {
             previousText = fullText;
         }
 
-        await this.wllama.kvClear().catch(() => { });
         return fullText.trim();
     }
 
-    async _createStreamSession(prompt, streamType = "responses", requestedRunId = null) {
+    async _createStreamSession(prompt, streamType = "responses", requestedRunId = null, choiceCount = 1) {
         const streamId = makeId("stream");
         const responseId = makeId("resp");
         const createdAtVersion = this.sessionVersion;
@@ -530,6 +835,7 @@ class ModelCoderLLM {
         const session = {
             queue: [],
             done: false,
+            cancelled: false,
             error: null,
             responseId,
             createdAtVersion,
@@ -538,18 +844,22 @@ class ModelCoderLLM {
 
         this.streamSessions.set(streamId, session);
 
-        let generationTask;
-        generationTask = this._complete(prompt, (delta) => {
+        const enqueue = (chunk) => {
+            session.queue.push(chunk);
+            session.wake?.();
+        };
+
+        const pushDelta = (index, delta) => {
             if (createdAtVersion !== this.sessionVersion) {
                 return;
             }
 
             if (streamType === "chat") {
-                session.queue.push({
+                enqueue({
                     object: "chat.completion.chunk",
                     choices: [
                         {
-                            index: 0,
+                            index,
                             delta: {
                                 content: delta
                             }
@@ -559,30 +869,45 @@ class ModelCoderLLM {
                 return;
             }
 
-            session.queue.push({
+            enqueue({
                 type: "response.output_text.delta",
                 delta
             });
-        }, createdAtVersion).then((finalText) => {
+        };
+
+        const pushChoiceDone = (index) => {
+            if (createdAtVersion !== this.sessionVersion) {
+                return;
+            }
+
+            enqueue({
+                object: "chat.completion.chunk",
+                choices: [
+                    {
+                        index,
+                        delta: {},
+                        finish_reason: "stop"
+                    }
+                ]
+            });
+        };
+
+        const shouldStop = () => session.cancelled;
+        const completion = streamType === "chat"
+            ? this._completeChoices(prompt, choiceCount, pushDelta, pushChoiceDone, createdAtVersion, shouldStop)
+            : this._complete(prompt, (delta) => pushDelta(0, delta), createdAtVersion, shouldStop).then((text) => [text]);
+
+        let generationTask;
+        generationTask = completion.then((finalTexts) => {
             if (createdAtVersion !== this.sessionVersion) {
                 session.done = true;
                 return;
             }
 
+            const finalText = finalTexts[0] ?? "";
             this.responsesById.set(responseId, finalText);
-            if (streamType === "chat") {
-                session.queue.push({
-                    object: "chat.completion.chunk",
-                    choices: [
-                        {
-                            index: 0,
-                            delta: {},
-                            finish_reason: "stop"
-                        }
-                    ]
-                });
-            } else {
-                session.queue.push({
+            if (streamType !== "chat") {
+                enqueue({
                     type: "response.completed",
                     response: {
                         id: responseId,
@@ -596,6 +921,7 @@ class ModelCoderLLM {
             session.done = true;
         }).finally(() => {
             this.activeGenerationTasks.delete(generationTask);
+            session.wake?.();
         });
 
         this.activeGenerationTasks.add(generationTask);
@@ -643,6 +969,106 @@ class ModelCoderLLM {
         return { done: false, chunk: null };
     }
 
+    attachStreamRing(streamId, buffer, runId = null) {
+        this._ensureActiveRun(runId, "stream ring");
+
+        const session = this.streamSessions.get(streamId);
+        if (!session || session.ring) {
+            return false;
+        }
+
+        const ring = new StreamRingWriter(buffer);
+        ring.markReady();
+        session.ring = ring;
+        this._pumpStreamRing(streamId, session).catch((error) => {
+            console.warn("Stream ring writer stopped:", error);
+        });
+        return true;
+    }
+
+    async _pumpStreamRing(streamId, session) {
+        const ring = session.ring;
+        // The reader acknowledges once it sees `ready`. A buffer that reached the worker as a
+        // copy never does; the session then stays on nextStreamChunk polling.
+        if (!(await ring.waitForAck(RING_ACK_TIMEOUT_MS))) {
+            session.ring = null;
+            return;
+        }
+
+        const isStale = () => session.cancelled
+            || this.streamSessions.get(streamId) !== session
+            || session.createdAtVersion !== this.sessionVersion
+            || (session.requestedRunId !== null && session.requestedRunId !== this.activeRunId);
+
+        // Closing the ring without a terminal record detaches it: the reader then polls
+        // nextStreamChunk, which serves whatever is still queued (or `done` for a stale session).
+        try {
+            while (!isStale()) {
+                if (session.queue.length > 0) {
+                    if (!(await ring.write({ done: false, chunk: session.queue[0] }, isStale))) {
+                        break;
+                    }
+                    session.queue.shift();
+                    continue;
+                }
+
+                if (session.done) {
+                    const message = session.error ? (session.error.message || "Unknown streaming error") : null;
+                    await ring.write(message ? { done: true, error: message } : { done: true, chunk: null }, isStale);
+                    this.streamSessions.delete(streamId);
+                    break;
+                }
+
+                await new Promise((resolve) => {
+                    session.wake = resolve;
+                    setTimeout(resolve, RING_WAIT_SLICE_MS);
+                });
+                session.wake = null;
+            }
+        } catch (error) {
+            // A chunk too large for the ring (or one that fails to serialize) stays queued and
+            // reaches the reader through polling instead of silently ending the stream here.
+            console.warn("Stream ring writer stopped; falling back to nextStreamChunk:", error);
+        } finally {
+            session.ring = null;
+            ring.close();
+        }
+    }
+
+    cancelStream(streamId, runId = null) {
+        const numericRunId = Number(runId);
+        if (Number.isFinite(numericRunId) && numericRunId !== this.activeRunId) {
+            return false;
+        }
+
+        const session = this.streamSessions.get(streamId);
+        if (!session) {
+            return false;
+        }
+
+        // The generation loop sees the flag on its next token, stops, and still records the response text.
+        session.cancelled = true;
+        this.streamSessions.delete(streamId);
+        return true;
+    }
+
+    stats() {
+        let queuedChunks = 0;
+        let ringSessions = 0;
+        for (const session of this.streamSessions.values()) {
+            queuedChunks += session.queue.length;
+            ringSessions += session.ring ? 1 : 0;
+        }
+
+        return {
+            stream_sessions: this.streamSessions.size,
+            queued_chunks: queuedChunks,
+            ring_sessions: ringSessions,
+            stored_responses: this.responsesById.size,
+            active_generations: this.activeGenerationTasks.size
+        };
+    }
+
     async _requestInternal(payload) {
         if (!payload || typeof payload !== "object") {
             throw new Error("Invalid request payload.");
@@ -654,11 +1080,12 @@ class ModelCoderLLM {
             this._ensureClient(payload.model);
             const messages = Array.isArray(payload.messages) ? payload.messages : [];
             validateMessages(messages, "messages");
+            const choiceCount = normalizeChoiceCount(payload.n);
 
             const moderatedChatPrompts = this._extractModeratedPromptsFromMessages(messages);
             if (await this._hasReversedModerationMatch(moderatedChatPrompts)) {
                 if (payload.stream) {
-                    const streamMeta = this._createSafeResponseStream("chat", payload.run_id);
+                    const streamMeta = this._createSafeResponseStream("chat", payload.run_id, choiceCount);
                     return {
                         stream: true,
                         stream_id: streamMeta.stream_id,
@@ -666,13 +1093,17 @@ class ModelCoderLLM {
                     };
                 }
 
-                return this._createSafeChatResponse();
+                return this._createSafeChatResponse(choiceCount);
             }
 
-            const prompt = this._toChatML(messages);
+            const prompt = this._toChatML(withToolInstruction(
+                withJsonModeInstruction(messages, payload.response_format),
+                payload.tools,
+                payload.tool_choice
+            ));
 
             if (payload.stream) {
-                const streamMeta = await this._createStreamSession(prompt, "chat", payload.run_id);
+                const streamMeta = await this._createStreamSession(prompt, "chat", payload.run_id, choiceCount);
                 return {
                     stream: true,
                     stream_id: streamMeta.stream_id,
@@ -680,23 +1111,21 @@ class ModelCoderLLM {
                 };
             }
 
-            const outputText = await this._complete(prompt);
+            const outputTexts = await this._completeChoices(prompt, choiceCount);
             const responseId = makeId("chatcmpl");
-            this.responsesById.set(responseId, outputText);
+            this.responsesById.set(responseId, outputTexts[0] ?? "");
 
             return {
                 id: responseId,
                 object: "chat.completion",
-                choices: [
-                    {
-                        index: 0,
-                        finish_reason: "stop",
-                        message: {
-                            role: "assistant",
-                            content: outputText
-                        }
+                choices: outputTexts.map((outputText, index) => ({
+                    index,
+                    finish_reason: "stop",
+                    message: {
+                        role: "assistant",
+                        content: outputText
                     }
-                ]
+                }))
             };
         }
 
@@ -725,7 +1154,11 @@ class ModelCoderLLM {
                 payload.previous_response_id
             );
             validateMessages(messages, "input");
-            const prompt = this._toChatML(messages);
+            const prompt = this._toChatML(withToolInstruction(
+                withJsonModeInstruction(messages, payload.text?.format),
+                payload.tools,
+                payload.tool_choice
+            ));
 
             if (payload.stream) {
                 const streamMeta = await this._createStreamSession(prompt, "responses", payload.run_id);
@@ -773,18 +1206,25 @@ const modelCoderSetStatusListener = (callback) => {
     llmRuntime.setStatusCallback(callback);
 };
 
-const modelCoderInit = async (maxRetries = 3) => {
-    await llmRuntime.initialize(maxRetries);
+const modelCoderInit = async (maxRetries = 3, modelName = DEFAULT_MODEL_NAME) => {
+    await llmRuntime.initialize(maxRetries, modelName);
+};
+
+const modelCoderWarmup = async (modelName, prompt, maxTokens = WARMUP_MAX_TOKENS) => {
+    return llmRuntime.warmup(modelName, prompt, maxTokens);
 };
 
 const modelCoderSetActiveRunId = (runId) => {
     llmRuntime.setActiveRunId(runId);
 };
 
-const modelCoderRequest = async (requestJson) => {
-    const payload = JSON.parse(requestJson);
+// Requests arrive either as JSON text or as a native object (nopenai "object" codec);
+// the response is returned in the same form.
+const modelCoderRequest = async (request) => {
+    const isObjectRequest = request !== null && typeof request === "object";
+    const payload = isObjectRequest ? request : JSON.parse(request);
     const response = await llmRuntime.request(payload);
-    return JSON.stringify(response);
+    return isObjectRequest ? response : JSON.stringify(response);
 };
 
 const modelCoderResetSession = async () => {
@@ -795,19 +1235,113 @@ const modelCoderHardResetSession = async () => {
     await llmRuntime.hardResetSession();
 };
 
-const modelCoderNextStreamChunk = async (streamId, runId = null) => {
+const modelCoderNextStreamChunk = async (streamId, runId = null, codec = "json") => {
     const next = await llmRuntime.nextStreamChunk(streamId, runId);
-    return JSON.stringify(next);
+    return codec === "object" ? next : JSON.stringify(next);
+};
+
+const modelCoderCancelStream = (streamId, runId = null) => {
+    return llmRuntime.cancelStream(streamId, runId);
+};
+
+// `buffer` is a SharedArrayBuffer from the Python worker, laid out as nopenai._StreamRing expects.
+const modelCoderAttachStreamRing = (streamId, buffer, runId = null) => {
+    return llmRuntime.attachStreamRing(streamId, buffer, runId);
+};
+
+// nopenai record= transcripts. The Pyodide filesystem is discarded with each run, so the
+// recorder mirrors every JSONL line here; lines are kept per path for the page's lifetime
+// and saved to localStorage (debounced) so a session can still be downloaded after a reload.
+const TRANSCRIPT_STORAGE_PREFIX = "modelCoderTranscript:";
+const TRANSCRIPT_SAVE_DELAY_MS = 500;
+const transcripts = new Map();
+let transcriptSaveTimer = null;
+
+function transcriptLines(path) {
+    const key = String(path);
+    if (!transcripts.has(key)) {
+        let stored = null;
+        try {
+            stored = localStorage.getItem(TRANSCRIPT_STORAGE_PREFIX + key);
+        } catch {
+            // Storage can be unavailable (private mode, sandboxed frames).
+        }
+        transcripts.set(key, stored ? stored.split("\n").filter((line) => line.length > 0) : []);
+    }
+    return transcripts.get(key);
+}
+
+function saveTranscripts() {
+    transcriptSaveTimer = null;
+    for (const [path, lines] of transcripts) {
+        try {
+            localStorage.setItem(TRANSCRIPT_STORAGE_PREFIX + path, lines.join("\n") + "\n");
+        } catch (error) {
+            console.warn(`Transcript ${path} is too large for localStorage; download it before reloading.`, error);
+        }
+    }
+}
+
+const modelCoderAppendTranscript = (path, line) => {
+    transcriptLines(path).push(String(line));
+    if (transcriptSaveTimer === null) {
+        transcriptSaveTimer = setTimeout(saveTranscripts, TRANSCRIPT_SAVE_DELAY_MS);
+    }
+    return true;
+};
+
+const modelCoderReadTranscript = (path) => {
+    const lines = transcriptLines(path);
+    return lines.length > 0 ? lines.join("\n") + "\n" : null;
+};
+
+const modelCoderDownloadTranscript = (path) => {
+    const text = modelCoderReadTranscript(path);
+    if (text === null || typeof document === "undefined") {
+        return false;
+    }
+
+    const link = document.createElement("a");
+    link.href = URL.createObjectURL(new Blob([text], { type: "application/x-ndjson" }));
+    link.download = String(path).split("/").pop() || "transcript.jsonl";
+    document.body.appendChild(link);
+    link.click();
+    link.remove();
+    setTimeout(() => URL.revokeObjectURL(link.href), 0);
+    return true;
+};
+
+const modelCoderClearTranscript = (path) => {
+    transcripts.delete(String(path));
+    try {
+        localStorage.removeItem(TRANSCRIPT_STORAGE_PREFIX + String(path));
+    } catch {
+        // Nothing stored.
+    }
+    return true;
+};
+
+// Returned as JSON text so callers can decode it the same way under either codec.
+const modelCoderStats = () => {
+    return JSON.stringify(llmRuntime.stats());
 };
 
 const modelCoderBridge = {
     modelCoderSetStatusListener,
     modelCoderInit,
+    modelCoderWarmup,
     modelCoderSetActiveRunId,
     modelCoderRequest,
     modelCoderResetSession,
     modelCoderHardResetSession,
     modelCoderNextStreamChunk,
+    modelCoderCancelStream,
+    modelCoderAttachStreamRing,
+    modelCoderAppendTranscript,
+    modelCoderReadTranscript,
+    modelCoderDownloadTranscript,
+    modelCoderClearTranscript,
+    modelCoderStats,
 };
 
 function attachBridge(target) {
@@ -816,11 +1350,19 @@ function attachBridge(target) {
     }
     target.modelCoderSetStatusListener = modelCoderSetStatusListener;
     target.modelCoderInit = modelCoderInit;
+    target.modelCoderWarmup = modelCoderWarmup;
     target.modelCoderSetActiveRunId = modelCoderSetActiveRunId;
     target.modelCoderRequest = modelCoderRequest;
     target.modelCoderResetSession = modelCoderResetSession;
     target.modelCoderHardResetSession = modelCoderHardResetSession;
     target.modelCoderNextStreamChunk = modelCoderNextStreamChunk;
+    target.modelCoderCancelStream = modelCoderCancelStream;
+    target.modelCoderAttachStreamRing = modelCoderAttachStreamRing;
+    target.modelCoderAppendTranscript = modelCoderAppendTranscript;
+    target.modelCoderReadTranscript = modelCoderReadTranscript;
+    target.modelCoderDownloadTranscript = modelCoderDownloadTranscript;
+    target.modelCoderClearTranscript = modelCoderClearTranscript;
+    target.modelCoderStats = modelCoderStats;
     target.modelCoderBridge = modelCoderBridge;
 }
 
@@ -1,33 +1,117 @@
 """Minimal OpenAI-compatible wrapper for local browser execution via PyScript."""
 
 import asyncio
+import collections
+import contextlib
+import copy
+import functools
+import importlib
+import itertools
 import json
-from types import SimpleNamespace
-from typing import Any, Dict
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import weakref
+from types import ModuleType, SimpleNamespace
+from typing import Any, Dict, Optional, Tuple
+
+# Browser runtime modules are imported on first use rather than at import time, so
+# loading nopenai at the start of every run stays cheap and works under plain CPython.
+_UNRESOLVED = object()
+_lazy_modules: Dict[Any, Any] = {}
+
+
+def _lazy_import(module_name: str, attr: Optional[str] = None):
+    key = (module_name, attr)
+    value = _lazy_modules.get(key, _UNRESOLVED)
+    if value is _UNRESOLVED:
+        try:
+            value = importlib.import_module(module_name)
+            if attr is not None:
+                value = getattr(value, attr)
+        except Exception:
+            value = None
+        _lazy_modules[key] = value
+    return value
+
+
+def _js():
+    return _lazy_import("js")
 
-import js
 
-try:
-    import pyscript as _pyscript
-except Exception:
-    _pyscript = None
+def _in_browser_runtime() -> bool:
+    return sys.platform == "emscripten"
+
+
+def _on_browser_main_thread() -> bool:
+    """True when Python shares the page's thread, where any blocking call freezes the UI."""
+    if not _in_browser_runtime():
+        return False
+    return not getattr(_lazy_import("pyscript"), "RUNNING_IN_WORKER", False)
 
-try:
-    import pyodide.webloop as _pyodide_webloop
-except Exception:
-    _pyodide_webloop = None
 
-try:
-    from pyscript import window as _pyscript_window
-except Exception:
-    _pyscript_window = None
+def _interpreter_cache() -> Dict[str, Any]:
+    """Plain data that outlives this module object.
+
+    app.js execs a fresh nopenai module for every run, but runs on the main
+    thread share one interpreter, so state kept under `sys.modules` survives
+    between them. Worker runs start a new interpreter and begin empty.
+    """
+    holder = sys.modules.get("_nopenai_interpreter_cache")
+    if holder is None:
+        holder = ModuleType("_nopenai_interpreter_cache")
+        holder.entries = {}
+        sys.modules["_nopenai_interpreter_cache"] = holder
+    return holder.entries
+
 
 _BRIDGE_DEBUG = False
 _EXPECTED_API_KEY = "key123"
-_EXPECTED_MODEL_NAME = "smollm2"
+# Models the lab endpoint serves; llm.js keeps the matching MODEL_REGISTRY with download details.
+_MODEL_REGISTRY = {
+    "smollm2": {"context_window": 2048, "owned_by": "HuggingFaceTB"},
+}
+_DEFAULT_WARMUP_PROMPT = "Hello"
+_MAX_CHOICES = 8
+# Same defaults as the openai package: ten minutes per request, two retries.
+_DEFAULT_TIMEOUT = 600.0
+_DEFAULT_MAX_RETRIES = 2
+_RETRY_INITIAL_DELAY = 0.5
+_RETRY_MAX_DELAY = 8.0
+_RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+_BREAKER_THRESHOLD = 5
+_BREAKER_COOLDOWN = 30.0
+_RUNTIME_CRASH_MARKERS = ("Aborted(", "memory access out of bounds", "Out of memory")
+# Terminal writes cost more than tokens in the browser, so streams there batch deltas by default.
+_DEFAULT_COALESCE_MS = 50
+_DEFAULT_TOOL_TIMEOUT = 30.0
+_LAB_BASE_URL = "http://localwllama"
+_DEFAULT_HTTP_BASE_URL = "http://127.0.0.1:8080/v1"
+_DEFAULT_HTTP_MAX_CONNECTIONS = 8
+_MODERATION_LIST_PATH = os.path.join("moderation", "mod.txt")
+_MODERATION_SAFE_RESPONSE = (
+    "I'm sorry. I can't help with that. Either your system instructions or user input included content that was "
+    "flagged by the moderation system. If you think this was a mistake, please try rephrasing your input or "
+    "instructions and try again."
+)
+_MODERATED_ROLES = {"user", "system", "developer"}
+
+
+class _Verbatim:
+    """Marks a value that `_to_ns` should hand through without converting dicts."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
 
 
 def _to_ns(value: Any) -> Any:
+    if isinstance(value, _Verbatim):
+        return value.value
     if isinstance(value, dict):
         return SimpleNamespace(**{k: _to_ns(v) for k, v in value.items()})
     if isinstance(value, list):
@@ -36,17 +120,19 @@ def _to_ns(value: Any) -> Any:
 
 
 def _run_sync(coro):
-    if _pyodide_webloop is not None:
-        runner = getattr(_pyodide_webloop, "run_until_complete", None)
+    pyodide_webloop = _lazy_import("pyodide.webloop")
+    if pyodide_webloop is not None:
+        runner = getattr(pyodide_webloop, "run_until_complete", None)
         if callable(runner):
             try:
                 return runner(coro)
             except Exception:
                 pass
 
-    if _pyscript is not None:
-        running_in_worker = bool(getattr(_pyscript, "RUNNING_IN_WORKER", False))
-        sync_bridge = getattr(_pyscript, "sync", None)
+    pyscript = _lazy_import("pyscript") if _in_browser_runtime() else None
+    if pyscript is not None:
+        running_in_worker = bool(getattr(pyscript, "RUNNING_IN_WORKER", False))
+        sync_bridge = getattr(pyscript, "sync", None)
 
         if running_in_worker and sync_bridge is not None:
             for method_name in ("run", "await", "wait", "sync", "call"):
@@ -80,15 +166,87 @@ def _run_sync(coro):
         ) from exc
 
 
-async def _request(payload: Dict[str, Any]) -> Dict[str, Any]:
+class _JSONCodec:
+    """Crosses the bridge as JSON text; works with every bridge candidate."""
+
+    name = "json"
+
+    def encode(self, payload: Dict[str, Any]) -> Any:
+        return json.dumps(payload)
+
+    def decode(self, value: Any) -> Dict[str, Any]:
+        return json.loads(str(value))
+
+
+class _ObjectCodec:
+    """Crosses the bridge as native JS objects via Pyodide's `to_js`/`to_py`.
+
+    This skips the stringify/parse pass on both sides of every request and
+    stream chunk. Anything that cannot be converted falls back to JSON text,
+    which llm.js still accepts.
+    """
+
+    name = "object"
+
+    def encode(self, payload: Dict[str, Any]) -> Any:
+        try:
+            from pyodide.ffi import to_js
+
+            return to_js(payload, dict_converter=_js().Object.fromEntries)
+        except Exception:
+            return json.dumps(payload)
+
+    def decode(self, value: Any) -> Dict[str, Any]:
+        if isinstance(value, dict):
+            return value
+        if isinstance(value, str):
+            return json.loads(value)
+
+        to_py = _safe_getattr(value, "to_py")
+        if _is_callable(to_py):
+            converted = to_py()
+            if isinstance(converted, dict) and all(not _is_js_proxy(v) for v in converted.values()):
+                return converted
+
+        return json.loads(str(_js().JSON.stringify(value)))
+
+
+def _is_js_proxy(value: Any) -> bool:
+    try:
+        from pyodide.ffi import JsProxy
+    except Exception:
+        return False
+    return isinstance(value, JsProxy)
+
+
+_CODECS = {
+    "json": _JSONCodec(),
+    "object": _ObjectCodec(),
+}
+
+
+def _resolve_codec(codec=None):
+    if codec is None:
+        return _CODECS["json"]
+    if isinstance(codec, str):
+        try:
+            return _CODECS[codec]
+        except KeyError:
+            raise ValueError(f"Unknown bridge codec: {codec}") from None
+    return codec
+
+
+async def _request(payload: Dict[str, Any], codec=None) -> Dict[str, Any]:
+    codec = _resolve_codec(codec)
     payload["run_id"] = _current_run_id()
-    response_json = await _bridge_call("modelCoderRequest", json.dumps(payload))
-    return json.loads(str(response_json))
+    response = await _bridge_call("modelCoderRequest", codec.encode(payload))
+    return codec.decode(response)
 
 
-async def _next_chunk(stream_id: str) -> Dict[str, Any]:
-    chunk_json = await _bridge_call("modelCoderNextStreamChunk", stream_id, _current_run_id())
-    return json.loads(str(chunk_json))
+async def _next_chunk(stream_id: str, codec=None) -> Dict[str, Any]:
+    codec = _resolve_codec(codec)
+    chunk = await _bridge_call("modelCoderNextStreamChunk", stream_id, _current_run_id(), codec.name)
+    return codec.decode(chunk)
 
 
 def _current_run_id() -> int:
@@ -147,11 +305,13 @@ def _iter_js_bridge_candidates():
 
     candidates = []
 
-    _add(_pyscript_window, "pyscript.window")
+    js = _js()
+    pyscript = _lazy_import("pyscript")
+    _add(_lazy_import("pyscript", "window"), "pyscript.window")
     _add(js, "js")
 
-    if _pyscript is not None:
-        _add(_safe_getattr(_pyscript, "sync"), "pyscript.sync")
+    if pyscript is not None:
+        _add(_safe_getattr(pyscript, "sync"), "pyscript.sync")
 
     for attr in ("globalThis", "window", "self", "parent", "top"):
         _add(_safe_getattr(js, attr), f"js.{attr}")
@@ -159,6 +319,16 @@ def _iter_js_bridge_candidates():
     return candidates
 
 
+def _bridge_function(method_name: str):
+    """Return the first synchronous-callable bridge export named `method_name`, or None."""
+    for _, bridge in _iter_js_bridge_candidates():
+        for owner in (_safe_getattr(bridge, "modelCoderBridge"), bridge):
+            method = _safe_getattr(owner, method_name) if owner is not None else None
+            if method is not None and _is_callable(method):
+                return method
+    return None
+
+
 async def _bridge_call(method_name: str, *args):
     last_error = None
     attempts = []
@@ -218,7 +388,7 @@ async def _bridge_call(method_name: str, *args):
             f"Model bridge call failed for {method_name}: {last_error}"
         ) from last_error
 
-    raise OpenAIError(
+    raise APIConnectionError(
         "Model bridge not available in this Python runtime. "
         "Missing modelCoderRequest/modelCoderNextStreamChunk on available JS globals."
     )
@@ -248,78 +418,2639 @@ class OpenAIError(Exception):
     pass
 
 
-def _validate_client_credentials(base_url: str, api_key: str):
-    if base_url != "http://localwllama":
+class APIConnectionError(OpenAIError):
+    pass
+
+
+class APITimeoutError(APIConnectionError):
+    pass
+
+
+class APIStatusError(OpenAIError):
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _validate_timeout(timeout):
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0):
+        raise ValueError("timeout must be a positive number of seconds or None")
+    return timeout
+
+
+def _deadline(timeout: Optional[float]) -> Optional[float]:
+    return None if timeout is None else time.monotonic() + timeout
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left before `deadline`; raises once it has passed."""
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise APITimeoutError("Request timed out.")
+    return remaining
+
+
+async def _with_deadline(awaitable, timeout: Optional[float]):
+    if timeout is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise APITimeoutError("Request timed out.") from None
+
+
+def _validate_client_credentials(base_url: str, api_key: str, transport=None, options=None):
+    # Runs before the transport is built, so a misconfigured client allocates nothing.
+    lab_endpoint = base_url == _LAB_BASE_URL
+    if not lab_endpoint and not _reaches_other_endpoints(transport, options or {}):
         raise OpenAIError("Endpoint not found.")
 
     if not isinstance(api_key, str) or not api_key.strip():
         raise ValueError("api_key must be a non-empty string")
 
-    if api_key != _EXPECTED_API_KEY:
+    if lab_endpoint and api_key != _EXPECTED_API_KEY:
         raise OpenAIError(f"Incorrect API key provided: {api_key}.")
 
 
+class _Transport:
+    """Carries request payloads to a model runtime and pulls stream chunks back.
+
+    Subclasses provide the async `request(payload, timeout)` and
+    `next_chunk(stream_id, timeout)`, which are the primary interface. The
+    sync variants default to driving those coroutines through `_run_sync`;
+    transports backed by blocking I/O override them to skip the event loop
+    entirely.
+    """
+
+    async def close_stream(self, stream_id: str):
+        return None
+
+    def request_sync(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        return _run_sync(self.request(payload, timeout))
+
+    def next_chunk_sync(self, stream_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        return _run_sync(self.next_chunk(stream_id, timeout))
+
+    def close_stream_sync(self, stream_id: str):
+        return _run_sync(self.close_stream(stream_id))
+
+    async def preload(self, model: str, warmup_prompt: Optional[str]) -> Dict[str, Any]:
+        return {}
+
+    async def list_models(self):
+        return None
+
+    def preload_sync(self, model: str, warmup_prompt: Optional[str]) -> Dict[str, Any]:
+        return _run_sync(self.preload(model, warmup_prompt))
+
+    def list_models_sync(self):
+        return _run_sync(self.list_models())
+
+    async def runtime_stats(self) -> Dict[str, Any]:
+        return {}
+
+    def runtime_stats_sync(self) -> Dict[str, Any]:
+        return _run_sync(self.runtime_stats())
+
+    def close(self):
+        return None
+
+
+class _BridgeTransport(_Transport):
+    """Talks to llm.js through the in-page JS bridge."""
+
+    def __init__(self, codec=None):
+        self.codec = _resolve_codec(codec)
+
+    async def request(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        return await _with_deadline(_request(payload, self.codec), timeout)
+
+    async def next_chunk(self, stream_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        return await _with_deadline(_next_chunk(stream_id, self.codec), timeout)
+
+    async def close_stream(self, stream_id: str):
+        try:
+            await _bridge_call("modelCoderCancelStream", stream_id, _current_run_id())
+        except OpenAIError:
+            # Older llm.js builds have no cancel hook; the stream then runs to completion unread.
+            pass
+
+    async def preload(self, model: str, warmup_prompt: Optional[str]) -> Dict[str, Any]:
+        await _bridge_call("modelCoderInit", 3, model)
+        if not warmup_prompt:
+            return {}
+        warmup_ms = await _bridge_call("modelCoderWarmup", model, warmup_prompt)
+        return {"warmup_ms": float(warmup_ms)}
+
+    async def runtime_stats(self) -> Dict[str, Any]:
+        try:
+            return json.loads(str(await _bridge_call("modelCoderStats")))
+        except OpenAIError:
+            # Older llm.js builds have no stats hook.
+            return {}
+
+
+# Stream ring layout, shared with llm.js (StreamRingWriter): eight int32 header
+# slots, then `capacity` data bytes.
+_RING_MAGIC = 0x31474E52
+_RING_HEADER_BYTES = 32
+_RING_MAGIC_SLOT, _RING_CAPACITY_SLOT, _RING_HEAD_SLOT, _RING_TAIL_SLOT = 0, 1, 2, 3
+_RING_CLOSED_SLOT, _RING_SEQ_SLOT, _RING_READY_SLOT, _RING_ACK_SLOT = 4, 5, 6, 7
+_RING_WRAP_MARKER = 0xFFFFFFFF
+_RING_MASK = 0xFFFFFFFF
+_RING_LENGTH = struct.Struct("<I")
+_DEFAULT_RING_BYTES = 1 << 16
+
+
+def _signed32(value: int) -> int:
+    value &= _RING_MASK
+    return value - (1 << 32) if value >= 1 << 31 else value
+
+
+class _SharedMemoryRingView:
+    """Ring memory over a writable buffer, e.g. a `multiprocessing.shared_memory` block.
+
+    CPython has no atomic operations, so header slots are whole aligned
+    4-byte reads and writes through a memoryview, and waits poll with a
+    short backoff instead of sleeping on a futex. That holds on x86-64 and
+    is what the Linux tests and `bench.py ring` need; the browser reader
+    uses `_SharedArrayBufferRingView`.
+    """
+
+    def __init__(self, buf):
+        self.buf = memoryview(buf)
+        self.slots = self.buf[:_RING_HEADER_BYTES].cast("i")
+
+    def load(self, slot: int) -> int:
+        return self.slots[slot] & _RING_MASK
+
+    def store(self, slot: int, value: int):
+        self.slots[slot] = _signed32(value)
+
+    def add(self, slot: int, value: int):
+        self.slots[slot] = _signed32(self.slots[slot] + value)
+
+    def notify(self, slot: int):
+        pass
+
+    def wait(self, slot: int, value: int, timeout: Optional[float]) -> bool:
+        """Block while `slot` holds `value`; False if `timeout` passed first."""
+        deadline = _deadline(timeout)
+        delay = 0.0
+        while self.load(slot) == value:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            if delay:
+                time.sleep(delay)
+            delay = min(max(delay * 2, 1e-5), 1e-3)
+        return True
+
+    async def wait_async(self, slot: int, value: int, timeout: Optional[float]) -> bool:
+        deadline = _deadline(timeout)
+        delay = 1e-4
+        while self.load(slot) == value:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5e-3)
+        return True
+
+    def read(self, offset: int, length: int) -> bytes:
+        return bytes(self.buf[offset:offset + length])
+
+    def write(self, offset: int, data: bytes):
+        self.buf[offset:offset + len(data)] = data
+
+    def release(self):
+        self.slots.release()
+        self.buf.release()
+
+
+class _SharedArrayBufferRingView:
+    """Ring memory over a JS SharedArrayBuffer, using real `Atomics` (Pyodide worker only)."""
+
+    def __init__(self, buffer):
+        js = _js()
+        self.buffer = buffer
+        self.slots = js.Int32Array.new(buffer, 0, _RING_HEADER_BYTES // 4)
+        self.bytes = js.Uint8Array.new(buffer)
+        self.atomics = js.Atomics
+
+    def load(self, slot: int) -> int:
+        return int(self.atomics.load(self.slots, slot)) & _RING_MASK
+
+    def store(self, slot: int, value: int):
+        self.atomics.store(self.slots, slot, _signed32(value))
+
+    def add(self, slot: int, value: int):
+        self.atomics.add(self.slots, slot, value)
+
+    def notify(self, slot: int):
+        self.atomics.notify(self.slots, slot)
+
+    def wait(self, slot: int, value: int, timeout: Optional[float]) -> bool:
+        limit = float("inf") if timeout is None else timeout * 1000.0
+        return self.atomics.wait(self.slots, slot, _signed32(value), limit) != "timed-out"
+
+    async def wait_async(self, slot: int, value: int, timeout: Optional[float]) -> bool:
+        limit = float("inf") if timeout is None else timeout * 1000.0
+        wait_async = _safe_getattr(self.atomics, "waitAsync")
+        if wait_async is None:
+            # Browsers without Atomics.waitAsync get a short poll instead.
+            await asyncio.sleep(min(0.005, timeout or 0.005))
+            return self.load(slot) != value
+        result = wait_async(self.slots, slot, _signed32(value), limit)
+        outcome = (await result.value) if result.async_ else result.value
+        return outcome != "timed-out"
+
+    def read(self, offset: int, length: int) -> bytes:
+        return self.bytes.subarray(offset, offset + length).to_bytes()
+
+    def write(self, offset: int, data: bytes):
+        self.bytes.set(_lazy_import("pyodide.ffi", "to_js")(data), offset)
+
+    def release(self):
+        pass
+
+
+class _StreamRing:
+    """Single-producer, single-consumer ring of length-prefixed records.
+
+    The same protocol as llm.js's StreamRingWriter. `head` and `tail` count
+    bytes written and read, wrapping at 2**32. Only the producer moves
+    `head` and only the consumer moves `tail`, so neither side takes a lock.
+    A record is a little-endian uint32 length and its payload, padded to 4
+    bytes. A record that would cross the end of the data area is preceded
+    by a wrap marker that sends the reader back to offset 0. The producer
+    bumps `seq` after every record and on close, and that is the slot
+    readers wait on. `ready` and `ack` are the attach handshake with llm.js.
+    """
+
+    def __init__(self, memory):
+        if memory.load(_RING_MAGIC_SLOT) != _RING_MAGIC:
+            raise ValueError("not a stream ring")
+        self.memory = memory
+        self.capacity = memory.load(_RING_CAPACITY_SLOT)
+
+    @classmethod
+    def initialize(cls, memory, capacity: int = _DEFAULT_RING_BYTES) -> "_StreamRing":
+        if capacity < 64 or capacity & (capacity - 1):
+            raise ValueError("ring capacity must be a power of two of at least 64 bytes")
+        for slot in range(_RING_HEADER_BYTES // 4):
+            memory.store(slot, 0)
+        memory.store(_RING_CAPACITY_SLOT, capacity)
+        memory.store(_RING_MAGIC_SLOT, _RING_MAGIC)
+        return cls(memory)
+
+    @staticmethod
+    def create_shared(capacity: int = _DEFAULT_RING_BYTES, name: Optional[str] = None):
+        """Allocate a ring in POSIX shared memory; returns `(ring, SharedMemory)`."""
+        from multiprocessing import shared_memory
+
+        block = shared_memory.SharedMemory(name=name, create=True, size=_RING_HEADER_BYTES + capacity)
+        return _StreamRing.initialize(_SharedMemoryRingView(block.buf), capacity), block
+
+    @staticmethod
+    def attach_shared(name: str):
+        """Open a ring another process created with `create_shared`; returns `(ring, SharedMemory)`."""
+        from multiprocessing import shared_memory
+
+        block = shared_memory.SharedMemory(name=name)
+        return _StreamRing(_SharedMemoryRingView(block.buf)), block
+
+    @property
+    def closed(self) -> bool:
+        return bool(self.memory.load(_RING_CLOSED_SLOT))
+
+    def acknowledge(self) -> bool:
+        """Reader side of the attach handshake; False if llm.js never saw this buffer."""
+        if not self.memory.load(_RING_READY_SLOT):
+            return False
+        self.memory.store(_RING_ACK_SLOT, 1)
+        self.memory.notify(_RING_ACK_SLOT)
+        return True
+
+    # Producer side (llm.js in the browser; Python for tests and benchmarks).
+
+    def _wait_for_space(self, size: int, deadline: Optional[float]) -> bool:
+        while True:
+            tail = self.memory.load(_RING_TAIL_SLOT)
+            if self.capacity - ((self.memory.load(_RING_HEAD_SLOT) - tail) & _RING_MASK) >= size:
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            self.memory.wait(_RING_TAIL_SLOT, tail, remaining)
+
+    def _publish(self, head: int):
+        self.memory.store(_RING_HEAD_SLOT, head)
+        self.memory.add(_RING_SEQ_SLOT, 1)
+        self.memory.notify(_RING_SEQ_SLOT)
+
+    def write(self, payload: bytes, timeout: Optional[float] = None) -> bool:
+        """Append one record, waiting up to `timeout` for space; False if it timed out."""
+        size = 4 + ((len(payload) + 3) & ~3)
+        if size > self.capacity:
+            raise ValueError(f"record of {len(payload)} bytes does not fit a {self.capacity}-byte ring")
+        deadline = _deadline(timeout)
+
+        head = self.memory.load(_RING_HEAD_SLOT)
+        position = head % self.capacity
+        contiguous = self.capacity - position
+        if contiguous < size:
+            if not self._wait_for_space(contiguous, deadline):
+                return False
+            self.memory.write(_RING_HEADER_BYTES + position, _RING_LENGTH.pack(_RING_WRAP_MARKER))
+            head = (head + contiguous) & _RING_MASK
+            self._publish(head)
+            position = 0
+
+        if not self._wait_for_space(size, deadline):
+            return False
+        padding = b"\0" * (size - 4 - len(payload))
+        self.memory.write(_RING_HEADER_BYTES + position, _RING_LENGTH.pack(len(payload)) + payload + padding)
+        self._publish((head + size) & _RING_MASK)
+        return True
+
+    def close(self):
+        self.memory.store(_RING_CLOSED_SLOT, 1)
+        self.memory.add(_RING_SEQ_SLOT, 1)
+        self.memory.notify(_RING_SEQ_SLOT)
+
+    # Consumer side.
+
+    def try_read(self):
+        """Return the next record's bytes, None once closed and drained, or the `seq` value to wait on."""
+        while True:
+            seq = self.memory.load(_RING_SEQ_SLOT)
+            closed = self.memory.load(_RING_CLOSED_SLOT)
+            tail = self.memory.load(_RING_TAIL_SLOT)
+            if self.memory.load(_RING_HEAD_SLOT) == tail:
+                return None if closed else seq
+
+            position = tail % self.capacity
+            (length,) = _RING_LENGTH.unpack(self.memory.read(_RING_HEADER_BYTES + position, 4))
+            if length == _RING_WRAP_MARKER:
+                size = self.capacity - position
+                payload = None
+            else:
+                size = 4 + ((length + 3) & ~3)
+                payload = self.memory.read(_RING_HEADER_BYTES + position + 4, length)
+            self.memory.store(_RING_TAIL_SLOT, (tail + size) & _RING_MASK)
+            self.memory.notify(_RING_TAIL_SLOT)
+            if payload is not None:
+                return payload
+
+    def read(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        """Next record, blocking up to `timeout`; None once the producer closed the ring."""
+        deadline = _deadline(timeout)
+        while True:
+            record = self.try_read()
+            if not isinstance(record, int):
+                return record
+            if not self.memory.wait(_RING_SEQ_SLOT, record, _remaining(deadline)):
+                raise APITimeoutError("Request timed out.")
+
+    async def read_async(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        deadline = _deadline(timeout)
+        while True:
+            record = self.try_read()
+            if not isinstance(record, int):
+                return record
+            if not await self.memory.wait_async(_RING_SEQ_SLOT, record, _remaining(deadline)):
+                raise APITimeoutError("Request timed out.")
+
+
+def _stream_ring_supported() -> bool:
+    """True in a cross-origin-isolated PyScript worker, the only place Python may block in Atomics.wait."""
+    js = _js()
+    if js is None:
+        return False
+    pyscript = _lazy_import("pyscript")
+    if not getattr(pyscript, "RUNNING_IN_WORKER", False):
+        return False
+    return bool(_safe_getattr(js, "crossOriginIsolated")) and _safe_getattr(js, "SharedArrayBuffer") is not None
+
+
+class _RingBridgeTransport(_BridgeTransport):
+    """Bridge transport that reads stream chunks from a shared ring instead of polling llm.js.
+
+    Each stream gets its own `_StreamRing` in a SharedArrayBuffer allocated
+    here, in the worker, and handed to llm.js with `modelCoderAttachStreamRing`.
+    llm.js then writes every chunk into the ring, so reading one costs no
+    bridge call. Sync iteration blocks in `Atomics.wait`. Async iteration
+    awaits `Atomics.waitAsync`. A stream whose ring cannot be attached keeps
+    polling `modelCoderNextStreamChunk`. That happens with main-thread
+    Python, a page that is not cross-origin isolated, an older llm.js, or a
+    buffer that arrived as a copy. A ring that closes without a terminal
+    (`done`) record was detached by llm.js, for instance because a chunk did
+    not fit; the rest of that stream is polled as well.
+    """
+
+    def __init__(self, codec=None, ring_bytes: int = _DEFAULT_RING_BYTES):
+        super().__init__(codec)
+        self.ring_bytes = ring_bytes
+        self._rings = {}
+
+    async def _attach_ring(self, stream_id: str):
+        if not _stream_ring_supported():
+            return
+        buffer = _js().SharedArrayBuffer.new(_RING_HEADER_BYTES + self.ring_bytes)
+        ring = _StreamRing.initialize(_SharedArrayBufferRingView(buffer), self.ring_bytes)
+        try:
+            attached = await _bridge_call("modelCoderAttachStreamRing", stream_id, buffer, _current_run_id())
+        except OpenAIError:
+            return
+        if attached and ring.acknowledge():
+            self._rings[stream_id] = ring
+
+    async def request(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        result = await super().request(payload, timeout)
+        if result.get("stream") and result.get("stream_id"):
+            await self._attach_ring(result["stream_id"])
+        return result
+
+    def _ring_result(self, stream_id: str, record: Optional[bytes]) -> Optional[Dict[str, Any]]:
+        """Decode a ring record; None once the ring was detached and the stream must be polled."""
+        if record is None:
+            self._rings.pop(stream_id, None)
+            return None
+        result = json.loads(record.decode("utf-8"))
+        if result.get("done"):
+            self._rings.pop(stream_id, None)
+        return result
+
+    async def next_chunk(self, stream_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        ring = self._rings.get(stream_id)
+        result = None if ring is None else self._ring_result(stream_id, await ring.read_async(timeout))
+        if result is None:
+            return await super().next_chunk(stream_id, timeout)
+        return result
+
+    def next_chunk_sync(self, stream_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        ring = self._rings.get(stream_id)
+        result = None if ring is None else self._ring_result(stream_id, ring.read(timeout))
+        if result is None:
+            return super().next_chunk_sync(stream_id, timeout)
+        return result
+
+    async def close_stream(self, stream_id: str):
+        self._rings.pop(stream_id, None)
+        await super().close_stream(stream_id)
+
+    async def runtime_stats(self) -> Dict[str, Any]:
+        stats = await super().runtime_stats()
+        stats["worker_rings"] = len(self._rings)
+        return stats
+
+
+class _HTTPConnectionPool:
+    """Bounded LIFO pool of keep-alive connections to one origin.
+
+    `acquire` blocks once `max_connections` are checked out, which is what
+    pushes back on callers that open more streams than the server can serve.
+    The wait is bounded by the request's `timeout`, like the request itself.
+    """
+
+    def __init__(self, base_url: str, max_connections: int = _DEFAULT_HTTP_MAX_CONNECTIONS, timeout=None):
+        import http.client
+        from urllib.parse import urlsplit
+
+        parts = urlsplit(base_url)
+        if parts.scheme not in {"http", "https"} or not parts.hostname:
+            raise ValueError(f"Unsupported base_url for HTTP transport: {base_url}")
+
+        self._connection_class = (
+            http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        )
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path_prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, int(max_connections)))
+        self._closed = False
+
+    def acquire(self, timeout: Optional[float] = None):
+        if not self._slots.acquire(timeout=timeout):
+            raise APITimeoutError("Request timed out waiting for a free connection.")
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def release(self, conn, reusable: bool = True):
+        try:
+            with self._lock:
+                if reusable and not self._closed:
+                    self._idle.append(conn)
+                    return
+            conn.close()
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class _SSEReader:
+    """Incremental server-sent-events parser over a blocking HTTP response.
+
+    Lines are only read when the consumer asks for the next event, so a slow
+    consumer leaves data in the socket and TCP flow control throttles the
+    server instead of buffering the whole stream in memory.
+    """
+
+    def __init__(self, response):
+        self._response = response
+
+    def next_event(self) -> Optional[str]:
+        data_lines = []
+        while True:
+            raw = self._response.readline()
+            if not raw:
+                return "\n".join(data_lines) if data_lines else None
+
+            line = raw.decode("utf-8").rstrip("\r\n")
+            if not line:
+                if data_lines:
+                    return "\n".join(data_lines)
+                continue
+
+            if line.startswith(":"):
+                continue
+
+            field, _, value = line.partition(":")
+            if field == "data":
+                data_lines.append(value[1:] if value.startswith(" ") else value)
+
+
+def _release_abandoned_session(pool: "_HTTPConnectionPool", conn, on_finish):
+    # The unread body makes the socket unusable, but the slot (and async gate) must come back.
+    pool.release(conn, reusable=False)
+    if on_finish is not None:
+        on_finish()
+
+
+class _HTTPStreamSession:
+    def __init__(self, pool: _HTTPConnectionPool, conn, response, on_finish=None):
+        self._pool = pool
+        self._conn = conn
+        self._response = response
+        self._reader = _SSEReader(response)
+        self._lock = threading.Lock()
+        self._on_finish = on_finish
+        self.finished = False
+        self._finalizer = weakref.finalize(self, _release_abandoned_session, pool, conn, on_finish)
+        self._finalizer.atexit = False
+
+    def next_chunk(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        with self._lock:
+            if self.finished:
+                return {"done": True, "chunk": None}
+
+            try:
+                _set_connection_timeout(self._conn, self._pool.timeout if timeout is None else timeout)
+                data = self._reader.next_event()
+            except TimeoutError as exc:
+                self._finish(reusable=False)
+                raise APITimeoutError("Timed out waiting for the next stream chunk.") from exc
+            except Exception as exc:
+                self._finish(reusable=False)
+                return {"done": True, "error": f"Stream read failed: {exc}"}
+
+            if data is None or data == "[DONE]":
+                self._finish(reusable=data is not None and not self._response.will_close)
+                return {"done": True, "chunk": None}
+
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                self._finish(reusable=False)
+                return {"done": True, "error": f"Malformed stream event: {data[:200]}"}
+
+            if isinstance(chunk, dict) and chunk.get("error"):
+                self._finish(reusable=False)
+                return {"done": True, "error": _http_error_message(chunk)}
+
+            return {"done": False, "chunk": chunk}
+
+    def close(self):
+        with self._lock:
+            # An abandoned stream still has unread body bytes, so the socket cannot be reused.
+            self._finish(reusable=False)
+
+    def _finish(self, reusable: bool):
+        if self.finished:
+            return
+        self.finished = True
+        self._finalizer.detach()
+        if reusable:
+            # Drain the terminating chunk so the connection is clean for the next request.
+            try:
+                self._response.read()
+            except Exception:
+                reusable = False
+        self._pool.release(self._conn, reusable=reusable)
+        if self._on_finish is not None:
+            self._on_finish()
+
+
+def _set_connection_timeout(conn, timeout: Optional[float]):
+    # Applies to the next connect as well as to reads on an already-open keep-alive socket.
+    conn.timeout = timeout
+    if conn.sock is not None:
+        conn.sock.settimeout(timeout)
+
+
+def _http_error_message(body: Any) -> str:
+    if isinstance(body, dict):
+        error = body.get("error")
+        if isinstance(error, dict) and error.get("message"):
+            return str(error["message"])
+        if isinstance(error, str):
+            return error
+    return str(body)
+
+
+class _HTTPTransport(_Transport):
+    """Talks to an OpenAI-compatible HTTP endpoint from plain CPython.
+
+    Connections come from a bounded keep-alive pool and streams are parsed
+    incrementally from the response body. Blocking I/O runs on the calling
+    thread for the sync clients and on the default executor for async ones.
+    """
+
+    _ROUTES = {
+        "chat.completions.create": "/chat/completions",
+        "responses.create": "/responses",
+    }
+    _INTERNAL_KEYS = {"type", "run_id"}
+
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        api_key: str = "",
+        model: Optional[str] = None,
+        max_connections: int = _DEFAULT_HTTP_MAX_CONNECTIONS,
+        timeout=None,
+    ):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self._pool = _HTTPConnectionPool(base_url, max_connections=max_connections, timeout=timeout)
+        self._max_connections = max(1, int(max_connections))
+        self._streams = {}
+        self._stream_ids = itertools.count(1)
+        self._streams_lock = threading.Lock()
+        self._async_gates = weakref.WeakKeyDictionary()
+
+    def _send(self, method: str, path: str, body: Optional[bytes] = None, stream: bool = False, timeout=None):
+        import http.client
+
+        headers = {
+            "Accept": "text/event-stream" if stream else "application/json",
+            "Connection": "keep-alive",
+        }
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+
+        url = f"{self._pool.path_prefix}{path}"
+        deadline = _deadline(self._pool.timeout if timeout is None else timeout)
+        while True:
+            conn, reused = self._pool.acquire(_remaining(deadline))
+            try:
+                _set_connection_timeout(conn, _remaining(deadline))
+                conn.request(method, url, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self._pool.release(conn, reusable=False)
+                # An idle keep-alive socket may have been closed by the server; retry once on a fresh one.
+                if not reused:
+                    raise
+            except Exception:
+                self._pool.release(conn, reusable=False)
+                raise
+
+    def _encode_payload(self, payload: Dict[str, Any]) -> bytes:
+        body = {k: v for k, v in payload.items() if k not in self._INTERNAL_KEYS and v is not None}
+        if self.model:
+            body["model"] = self.model
+        return json.dumps(body).encode("utf-8")
+
+    def request_sync(self, payload: Dict[str, Any], timeout: Optional[float] = None, on_release=None) -> Dict[str, Any]:
+        try:
+            result = self._request_blocking(payload, timeout, on_release)
+        except BaseException:
+            if on_release is not None:
+                on_release()
+            raise
+        if on_release is not None and not result.get("stream"):
+            on_release()
+        return result
+
+    def _request_blocking(self, payload: Dict[str, Any], timeout: Optional[float], on_release) -> Dict[str, Any]:
+        path = self._ROUTES.get(payload.get("type"))
+        if path is None:
+            raise OpenAIError(f"Unsupported request type: {payload.get('type')}")
+
+        stream = bool(payload.get("stream"))
+        try:
+            conn, response = self._send("POST", path, self._encode_payload(payload), stream, timeout)
+        except TimeoutError as exc:
+            raise APITimeoutError("Request timed out.") from exc
+        except OSError as exc:
+            raise APIConnectionError(f"Connection error: {exc}") from exc
+
+        if response.status >= 400 or not stream:
+            return self._read_json(conn, response)
+
+        stream_id = f"http_stream_{next(self._stream_ids)}"
+        with self._streams_lock:
+            self._streams[stream_id] = _HTTPStreamSession(self._pool, conn, response, on_release)
+        return {"stream": True, "stream_id": stream_id}
+
+    def _read_json(self, conn, response) -> Any:
+        try:
+            raw = response.read()
+        except TimeoutError as exc:
+            self._pool.release(conn, reusable=False)
+            raise APITimeoutError("Request timed out.") from exc
+        except Exception as exc:
+            self._pool.release(conn, reusable=False)
+            raise APIConnectionError(f"Connection error: {exc}") from exc
+        self._pool.release(conn, reusable=not response.will_close)
+
+        try:
+            body = json.loads(raw.decode("utf-8")) if raw else {}
+        except ValueError:
+            body = raw.decode("utf-8", "replace")
+
+        if response.status >= 400:
+            raise APIStatusError(f"Error code: {response.status} - {_http_error_message(body)}", response.status)
+        return body
+
+    def preload_sync(self, model: str, warmup_prompt: Optional[str]) -> Dict[str, Any]:
+        if not warmup_prompt:
+            return {}
+        started = time.perf_counter()
+        self.request_sync({
+            "type": "chat.completions.create",
+            "model": model,
+            "messages": [{"role": "user", "content": warmup_prompt}],
+            "max_tokens": 1,
+            "stream": False,
+        })
+        return {"warmup_ms": (time.perf_counter() - started) * 1000}
+
+    def list_models_sync(self):
+        try:
+            conn, response = self._send("GET", "/models")
+        except OSError as exc:
+            raise APIConnectionError(f"Connection error: {exc}") from exc
+        body = self._read_json(conn, response)
+        return body.get("data", []) if isinstance(body, dict) else []
+
+    async def _run_gated(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        async with self._async_gate(loop):
+            return await loop.run_in_executor(None, fn, *args)
+
+    async def preload(self, model: str, warmup_prompt: Optional[str]) -> Dict[str, Any]:
+        return await self._run_gated(self.preload_sync, model, warmup_prompt)
+
+    async def list_models(self):
+        return await self._run_gated(self.list_models_sync)
+
+    def next_chunk_sync(self, stream_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        with self._streams_lock:
+            session = self._streams.get(stream_id)
+        if session is None:
+            return {"done": True, "chunk": None}
+
+        result = session.next_chunk(timeout)
+        if result.get("done"):
+            with self._streams_lock:
+                self._streams.pop(stream_id, None)
+        return result
+
+    def close_stream_sync(self, stream_id: str):
+        with self._streams_lock:
+            session = self._streams.pop(stream_id, None)
+        if session is not None:
+            session.close()
+
+    def _async_gate(self, loop) -> asyncio.Semaphore:
+        # Executor threads must never park on the pool semaphore: streams holding every
+        # connection would then starve the reads that free them. Queue on the loop instead.
+        gate = self._async_gates.get(loop)
+        if gate is None:
+            gate = asyncio.Semaphore(self._max_connections)
+            self._async_gates[loop] = gate
+        return gate
+
+    async def request(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        gate = self._async_gate(loop)
+        deadline = _deadline(self._pool.timeout if timeout is None else timeout)
+        try:
+            await _with_deadline(gate.acquire(), _remaining(deadline))
+        except APITimeoutError:
+            raise APITimeoutError("Request timed out waiting for a free connection.") from None
+        try:
+            timeout = _remaining(deadline)
+        except APITimeoutError:
+            gate.release()
+            raise
+
+        def _release():
+            try:
+                loop.call_soon_threadsafe(gate.release)
+            except RuntimeError:
+                # A stream can be finished (or finalized) after its event loop has closed.
+                pass
+
+        return await loop.run_in_executor(None, self.request_sync, payload, timeout, _release)
+
+    async def next_chunk(self, stream_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.next_chunk_sync, stream_id, timeout)
+
+    async def close_stream(self, stream_id: str):
+        return await asyncio.get_running_loop().run_in_executor(None, self.close_stream_sync, stream_id)
+
+    def runtime_stats_sync(self) -> Dict[str, Any]:
+        with self._streams_lock:
+            open_streams = len(self._streams)
+        return {"stream_sessions": open_streams, "idle_connections": len(self._pool._idle)}
+
+    async def runtime_stats(self) -> Dict[str, Any]:
+        return self.runtime_stats_sync()
+
+    def close(self):
+        with self._streams_lock:
+            sessions, self._streams = list(self._streams.values()), {}
+        for session in sessions:
+            session.close()
+        self._pool.close()
+
+
+def _resolve_transport(base_url: str, api_key: str, transport=None, options=None) -> _Transport:
+    options = options or {}
+
+    replay_path = options.get("replay") or os.environ.get("NOPENAI_REPLAY")
+    if replay_path and not isinstance(transport, _Transport):
+        return _ReplayTransport(
+            replay_path,
+            timing=options.get("replay_timing") or os.environ.get("NOPENAI_REPLAY_TIMING") or "fast",
+            session=options.get("replay_session", os.environ.get("NOPENAI_REPLAY_SESSION", -1)),
+            strict=options.get("replay_strict", True),
+        )
+
+    resolved = _base_transport(base_url, api_key, transport, options)
+
+    record_path = options.get("record") or os.environ.get("NOPENAI_RECORD")
+    if record_path:
+        resolved = _RecordingTransport(resolved, record_path)
+    return resolved
+
+
+def _unwrap_transport(transport: _Transport) -> _Transport:
+    while getattr(transport, "inner", None) is not None:
+        transport = transport.inner
+    return transport
+
+
+def _transport_name(transport) -> str:
+    """The transport name `_base_transport` builds for a `transport=` argument that is not an instance."""
+    if transport is None:
+        transport = os.environ.get("NOPENAI_TRANSPORT") or None
+    if transport is None:
+        transport = ("ring" if _stream_ring_supported() else "bridge") if _in_browser_runtime() else "http"
+    return transport
+
+
+def _reaches_other_endpoints(transport, options) -> bool:
+    # Only HTTP and replayed transcripts serve anything but the lab runtime.
+    if isinstance(transport, _Transport):
+        return isinstance(_unwrap_transport(transport), (_HTTPTransport, _ReplayTransport))
+    if options.get("replay") or os.environ.get("NOPENAI_REPLAY"):
+        return True
+    return _transport_name(transport) == "http"
+
+
+def _base_transport(base_url: str, api_key: str, transport, options) -> _Transport:
+    if isinstance(transport, _Transport):
+        return transport
+
+    transport = _transport_name(transport)
+
+    if transport == "bridge":
+        return _BridgeTransport(options.get("codec") or os.environ.get("NOPENAI_CODEC"))
+
+    if transport == "ring":
+        return _RingBridgeTransport(
+            options.get("codec") or os.environ.get("NOPENAI_CODEC"),
+            ring_bytes=options.get("ring_bytes", _DEFAULT_RING_BYTES),
+        )
+
+    if transport == "http":
+        endpoint = base_url
+        model = None
+        if base_url == _LAB_BASE_URL:
+            # Lab scripts keep their browser endpoint and model name; the environment points them at a real server.
+            endpoint = os.environ.get("NOPENAI_HTTP_BASE_URL", _DEFAULT_HTTP_BASE_URL)
+            model = os.environ.get("NOPENAI_HTTP_MODEL") or None
+        return _HTTPTransport(
+            endpoint,
+            api_key=api_key if isinstance(api_key, str) else "",
+            model=model,
+            max_connections=options.get("max_connections", _DEFAULT_HTTP_MAX_CONNECTIONS),
+        )
+
+    raise ValueError(f"Unknown transport: {transport}")
+
+
+_TRANSCRIPT_VERSION = 1
+
+
+def _transcript_copy(value: Any) -> Any:
+    # Round-trip through JSON so recorded payloads are detached from the live dicts.
+    return json.loads(json.dumps(value, default=str))
+
+
+def _comparable_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in _transcript_copy(payload).items() if k != "run_id"}
+
+
+class _TranscriptWriter:
+    """Append-only JSON Lines transcript shared by every recorder on one path.
+
+    Each process writes a header line that starts a new session, then one
+    compact line per bridge exchange: `request`, `chunk`, or `close`, with the
+    offset (`t`) and duration (`ms`) in milliseconds. Every line is flushed
+    as it is written. In the browser every line is also mirrored to
+    `modelCoderAppendTranscript`, because the Pyodide filesystem does not
+    outlive the run.
+
+    Recorders take a reference with `for_path` and give it back with
+    `close`. The file is closed when the last one does, and reopened (in
+    the same session) if a later recorder writes to it.
+    """
+
+    _writers: Dict[str, "_TranscriptWriter"] = {}
+    _writers_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        self.path = path
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._users = 0
+        self._fh = open(path, "a", encoding="utf-8")
+        self._mirror = _bridge_function("modelCoderAppendTranscript") if _in_browser_runtime() else None
+        self._write({"nopenai_transcript": _TRANSCRIPT_VERSION, "created": time.time()})
+
+    @classmethod
+    def for_path(cls, path: str) -> "_TranscriptWriter":
+        key = os.path.abspath(path)
+        with cls._writers_lock:
+            writer = cls._writers.get(key)
+            if writer is None:
+                writer = cls(path)
+                cls._writers[key] = writer
+            writer._users += 1
+            return writer
+
+    def close(self):
+        with self._writers_lock:
+            self._users = max(0, self._users - 1)
+            if self._users:
+                return
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+    def now_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def _write(self, record: Dict[str, Any]):
+        line = json.dumps(record, separators=(",", ":"), default=str)
+        with self._lock:
+            if self._fh is None:
+                self._fh = open(self.path, "a", encoding="utf-8")
+            self._fh.write(line + "\n")
+            self._fh.flush()
+            if self._mirror is not None:
+                try:
+                    self._mirror(self.path, line)
+                except Exception as exc:
+                    _debug_bridge(f"transcript mirror failed, keeping the local file only: {exc}")
+                    self._mirror = None
+
+    def record(self, op: str, started_ms: float, **fields):
+        record = {"op": op, "t": round(started_ms, 3), "ms": round(self.now_ms() - started_ms, 3)}
+        record.update(fields)
+        self._write(record)
+
+
+class _RecordingTransport(_Transport):
+    """Passes every exchange through to `inner` and appends it to a transcript."""
+
+    def __init__(self, inner: _Transport, path: str):
+        self.inner = inner
+        self.writer = _TranscriptWriter.for_path(path)
+        self._closed = False
+
+    def _outcome(self, op: str, started: float, fields: Dict[str, Any], call):
+        try:
+            result = call()
+        except Exception as exc:
+            self.writer.record(op, started, error=str(exc), **fields)
+            raise
+        self.writer.record(op, started, result=_transcript_copy(result), **fields)
+        return result
+
+    async def _async_outcome(self, op: str, started: float, fields: Dict[str, Any], awaitable):
+        try:
+            result = await awaitable
+        except Exception as exc:
+            self.writer.record(op, started, error=str(exc), **fields)
+            raise
+        self.writer.record(op, started, result=_transcript_copy(result), **fields)
+        return result
+
+    def request_sync(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        fields = {"payload": _comparable_payload(payload)}
+        return self._outcome("request", self.writer.now_ms(), fields, lambda: self.inner.request_sync(payload, timeout))
+
+    def next_chunk_sync(self, stream_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        fields = {"stream": stream_id}
+        return self._outcome("chunk", self.writer.now_ms(), fields, lambda: self.inner.next_chunk_sync(stream_id, timeout))
+
+    def close_stream_sync(self, stream_id: str):
+        self.writer.record("close", self.writer.now_ms(), stream=stream_id)
+        return self.inner.close_stream_sync(stream_id)
+
+    async def request(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        fields = {"payload": _comparable_payload(payload)}
+        return await self._async_outcome("request", self.writer.now_ms(), fields, self.inner.request(payload, timeout))
+
+    async def next_chunk(self, stream_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        fields = {"stream": stream_id}
+        return await self._async_outcome("chunk", self.writer.now_ms(), fields, self.inner.next_chunk(stream_id, timeout))
+
+    async def close_stream(self, stream_id: str):
+        self.writer.record("close", self.writer.now_ms(), stream=stream_id)
+        return await self.inner.close_stream(stream_id)
+
+    async def preload(self, model: str, warmup_prompt: Optional[str]) -> Dict[str, Any]:
+        return await self.inner.preload(model, warmup_prompt)
+
+    async def list_models(self):
+        return await self.inner.list_models()
+
+    def preload_sync(self, model: str, warmup_prompt: Optional[str]) -> Dict[str, Any]:
+        return self.inner.preload_sync(model, warmup_prompt)
+
+    def list_models_sync(self):
+        return self.inner.list_models_sync()
+
+    async def runtime_stats(self) -> Dict[str, Any]:
+        return await self.inner.runtime_stats()
+
+    def runtime_stats_sync(self) -> Dict[str, Any]:
+        return self.inner.runtime_stats_sync()
+
+    def close(self):
+        try:
+            self.inner.close()
+        finally:
+            # Clients may close twice (close() and then __exit__); release the writer once.
+            if not self._closed:
+                self._closed = True
+                self.writer.close()
+
+
+def _transcript_lines(path: str) -> list:
+    if os.path.exists(path) or not _in_browser_runtime():
+        with open(path, encoding="utf-8") as fh:
+            return fh.readlines()
+
+    # A transcript recorded by an earlier browser run only survives in the page's mirror.
+    read = _bridge_function("modelCoderReadTranscript")
+    text = read(path) if read is not None else None
+    if text is None:
+        raise OpenAIError(f"Transcript {path} not found in the Pyodide filesystem or the browser transcript store.")
+    return str(text).splitlines()
+
+
+def _load_transcript_session(path: str, session) -> list:
+    sessions = []
+    for line in _transcript_lines(path):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if "nopenai_transcript" in record:
+            sessions.append([])
+        elif sessions:
+            sessions[-1].append(record)
+
+    if not sessions:
+        raise OpenAIError(f"No recorded sessions in transcript {path}.")
+    try:
+        return sessions[int(session)]
+    except (IndexError, ValueError):
+        raise OpenAIError(f"Transcript {path} has no session {session} ({len(sessions)} recorded).") from None
+
+
+class _ReplayTransport(_Transport):
+    """Serves a recorded transcript session back without any model runtime.
+
+    Requests are answered in recorded order and chunks per stream id. With
+    `timing="original"` each answer waits as long as the recorded exchange
+    took; `"fast"` answers immediately. In strict mode a request that does
+    not match the recording raises instead of replaying the wrong answer.
+    """
+
+    def __init__(self, path: str, *, timing: str = "fast", session=-1, strict: bool = True):
+        if timing not in {"fast", "original"}:
+            raise ValueError("replay timing must be 'fast' or 'original'")
+        self.path = path
+        self.timing = timing
+        self.strict = strict
+        self._requests = []
+        self._chunks = {}
+        self._lock = threading.Lock()
+
+        for record in _load_transcript_session(path, session):
+            if record.get("op") == "request":
+                self._requests.append(record)
+            elif record.get("op") == "chunk":
+                self._chunks.setdefault(record.get("stream"), []).append(record)
+        self._requests.reverse()
+        for queue in self._chunks.values():
+            queue.reverse()
+
+    def _delay(self, record: Dict[str, Any]) -> float:
+        return float(record.get("ms") or 0) / 1000 if self.timing == "original" else 0.0
+
+    def _next_request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            if not self._requests:
+                raise OpenAIError(f"Transcript {self.path} has no more recorded requests.")
+            record = self._requests.pop()
+
+        if self.strict and record.get("payload") != _comparable_payload(payload):
+            raise OpenAIError(
+                f"Request does not match transcript {self.path}: expected {record.get('payload')!r}."
+            )
+        return record
+
+    def _next_chunk_record(self, stream_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            queue = self._chunks.get(stream_id)
+            return queue.pop() if queue else None
+
+    @staticmethod
+    def _answer(record: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        if record is None:
+            return {"done": True, "chunk": None}
+        if "error" in record:
+            raise OpenAIError(record["error"])
+        return copy.deepcopy(record["result"])
+
+    def request_sync(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        record = self._next_request(payload)
+        time.sleep(self._delay(record))
+        return self._answer(record)
+
+    def next_chunk_sync(self, stream_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        record = self._next_chunk_record(stream_id)
+        if record is not None:
+            time.sleep(self._delay(record))
+        return self._answer(record)
+
+    def close_stream_sync(self, stream_id: str):
+        with self._lock:
+            self._chunks.pop(stream_id, None)
+
+    async def request(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        record = self._next_request(payload)
+        await asyncio.sleep(self._delay(record))
+        return self._answer(record)
+
+    async def next_chunk(self, stream_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        record = self._next_chunk_record(stream_id)
+        if record is not None:
+            await asyncio.sleep(self._delay(record))
+        return self._answer(record)
+
+    async def close_stream(self, stream_id: str):
+        self.close_stream_sync(stream_id)
+
+    def preload_sync(self, model: str, warmup_prompt: Optional[str]) -> Dict[str, Any]:
+        # Nothing to load: the transcript already holds every answer.
+        return {}
+
+    def list_models_sync(self):
+        return None
+
+
+class _ModerationMatcher:
+    """Aho-Corasick automaton over the moderation terms.
+
+    The tables are kept in `_interpreter_cache()`, so runs that share an
+    interpreter reuse them; `matches` is linear in the input length no
+    matter how many terms the list holds.
+    """
+
+    def __init__(self, terms):
+        self._goto = [{}]
+        self._fail = [0]
+        self._hit = [False]
+
+        for term in terms:
+            state = 0
+            for ch in term:
+                next_state = self._goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][ch] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._hit.append(False)
+                state = next_state
+            self._hit[state] = True
+
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(ch, 0)
+                # A term that ends on the suffix link also ends here.
+                self._hit[next_state] = self._hit[next_state] or self._hit[self._fail[next_state]]
+
+    @classmethod
+    def from_tables(cls, tables) -> "_ModerationMatcher":
+        matcher = cls.__new__(cls)
+        matcher._goto, matcher._fail, matcher._hit = tables
+        return matcher
+
+    @property
+    def tables(self):
+        return self._goto, self._fail, self._hit
+
+    @classmethod
+    def from_text(cls, text: str) -> "_ModerationMatcher":
+        # mod.txt stores each term reversed with every character shifted down by one, as llm.js expects.
+        terms = []
+        for line in text.splitlines():
+            line = line.strip().lower()
+            if line:
+                terms.append("".join(chr(ord(ch) + 1) for ch in reversed(line)))
+        return cls(terms)
+
+    def matches(self, text: str) -> bool:
+        goto, fail, hit = self._goto, self._fail, self._hit
+        state = 0
+        for ch in text.lower():
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if hit[state]:
+                return True
+        return False
+
+
+_moderation_matcher_cache = _UNRESOLVED
+
+
+def _load_moderation_list() -> Optional[str]:
+    injected = globals().get("_MODELCODER_MODERATION_LIST")
+    if isinstance(injected, str):
+        return injected
+
+    candidates = [os.environ.get("NOPENAI_MODERATION_LIST")]
+    module_file = globals().get("__file__")
+    if module_file:
+        candidates.append(os.path.join(os.path.dirname(os.path.abspath(module_file)), _MODERATION_LIST_PATH))
+
+    for path in candidates:
+        if path and os.path.isfile(path):
+            with open(path, encoding="utf-8") as fh:
+                return fh.read()
+    return None
+
+
+def _moderation_matcher() -> Optional[_ModerationMatcher]:
+    global _moderation_matcher_cache
+    if _moderation_matcher_cache is _UNRESOLVED:
+        text = _load_moderation_list()
+        if not text:
+            _moderation_matcher_cache = None
+            return None
+        # Each run execs a fresh copy of this module; the interpreter cache lets
+        # later runs on the same interpreter skip rebuilding the automaton.
+        cache = _interpreter_cache()
+        cached = cache.get("moderation")
+        if cached is not None and cached[0] == text:
+            _moderation_matcher_cache = _ModerationMatcher.from_tables(cached[1])
+        else:
+            _moderation_matcher_cache = _ModerationMatcher.from_text(text)
+            cache["moderation"] = (text, _moderation_matcher_cache.tables)
+    return _moderation_matcher_cache
+
+
+def _content_to_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for block in content:
+            if isinstance(block, str):
+                parts.append(block)
+            elif isinstance(block, dict) and block.get("type") in {"input_text", "output_text", "text"}:
+                parts.append(str(block.get("text") or ""))
+        return "\n".join(part for part in parts if part)
+    if isinstance(content, dict) and content.get("type") in {"input_text", "output_text", "text"}:
+        return str(content.get("text") or "")
+    return "" if content is None else str(content)
+
+
+def _moderated_prompts(payload: Dict[str, Any]):
+    if payload.get("type") == "chat.completions.create":
+        for message in payload.get("messages") or []:
+            if isinstance(message, dict) and message.get("role") in _MODERATED_ROLES:
+                yield _content_to_text(message.get("content"))
+        return
+
+    instructions = payload.get("instructions")
+    if instructions:
+        yield str(instructions)
+
+    source = payload.get("input")
+    if isinstance(source, list):
+        for message in source:
+            if isinstance(message, dict) and (message.get("role") or "user") in _MODERATED_ROLES:
+                yield _content_to_text(message.get("content"))
+    else:
+        yield _content_to_text(source)
+
+
+def _make_id(prefix: str) -> str:
+    return f"{prefix}_{int(time.time() * 1000)}_{random.getrandbits(32):08x}"
+
+
+def _choice_count(payload: Dict[str, Any]) -> int:
+    n = payload.get("n")
+    return 1 if n is None else n
+
+
+def _safe_response(payload: Dict[str, Any]) -> Dict[str, Any]:
+    if payload.get("type") == "chat.completions.create":
+        return {
+            "id": _make_id("chatcmpl"),
+            "object": "chat.completion",
+            "choices": [
+                {
+                    "index": index,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": _MODERATION_SAFE_RESPONSE},
+                }
+                for index in range(_choice_count(payload))
+            ],
+        }
+
+    return {
+        "id": _make_id("resp"),
+        "object": "response",
+        "output_text": _MODERATION_SAFE_RESPONSE,
+        "output": [
+            {
+                "type": "message",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": _MODERATION_SAFE_RESPONSE}],
+            }
+        ],
+    }
+
+
+def _safe_stream_chunks(payload: Dict[str, Any], response_id: str):
+    if payload.get("type") == "chat.completions.create":
+        chunks = []
+        for index in range(_choice_count(payload)):
+            chunks.append({
+                "object": "chat.completion.chunk",
+                "choices": [{"index": index, "delta": {"content": _MODERATION_SAFE_RESPONSE}}],
+            })
+            chunks.append({
+                "object": "chat.completion.chunk",
+                "choices": [{"index": index, "delta": {}, "finish_reason": "stop"}],
+            })
+        return chunks
+
+    return [
+        {"type": "response.output_text.delta", "delta": _MODERATION_SAFE_RESPONSE},
+        {"type": "response.completed", "response": {"id": response_id, "output_text": _MODERATION_SAFE_RESPONSE}},
+    ]
+
+
+class _ModeratedTransport(_Transport):
+    """Answers flagged requests locally before they are serialized for the runtime.
+
+    Flagged requests get the same safe response llm.js would produce; everything
+    else passes through to the wrapped transport untouched. llm.js keeps its own
+    check, so a missing moderation list only loses the early exit.
+    """
+
+    def __init__(self, inner: _Transport):
+        self.inner = inner
+        self._local_streams = {}
+
+    def _intercept(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        matcher = _moderation_matcher()
+        if matcher is None or not any(matcher.matches(prompt) for prompt in _moderated_prompts(payload)):
+            return None
+
+        if not payload.get("stream"):
+            return _safe_response(payload)
+
+        stream_id = _make_id("stream")
+        response_id = _make_id("resp")
+        self._local_streams[stream_id] = _safe_stream_chunks(payload, response_id)
+        return {"stream": True, "stream_id": stream_id, "id": response_id}
+
+    def _next_local_chunk(self, stream_id: str) -> Dict[str, Any]:
+        queue = self._local_streams[stream_id]
+        if queue:
+            return {"done": False, "chunk": queue.pop(0)}
+        del self._local_streams[stream_id]
+        return {"done": True, "chunk": None}
+
+    async def request(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        intercepted = self._intercept(payload)
+        if intercepted is not None:
+            return intercepted
+        return await self.inner.request(payload, timeout)
+
+    async def next_chunk(self, stream_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        if stream_id in self._local_streams:
+            return self._next_local_chunk(stream_id)
+        return await self.inner.next_chunk(stream_id, timeout)
+
+    async def close_stream(self, stream_id: str):
+        if self._local_streams.pop(stream_id, None) is not None:
+            return None
+        return await self.inner.close_stream(stream_id)
+
+    def request_sync(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        intercepted = self._intercept(payload)
+        if intercepted is not None:
+            return intercepted
+        return self.inner.request_sync(payload, timeout)
+
+    def next_chunk_sync(self, stream_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        if stream_id in self._local_streams:
+            return self._next_local_chunk(stream_id)
+        return self.inner.next_chunk_sync(stream_id, timeout)
+
+    def close_stream_sync(self, stream_id: str):
+        if self._local_streams.pop(stream_id, None) is not None:
+            return None
+        return self.inner.close_stream_sync(stream_id)
+
+    async def preload(self, model: str, warmup_prompt: Optional[str]) -> Dict[str, Any]:
+        return await self.inner.preload(model, warmup_prompt)
+
+    async def list_models(self):
+        return await self.inner.list_models()
+
+    def preload_sync(self, model: str, warmup_prompt: Optional[str]) -> Dict[str, Any]:
+        return self.inner.preload_sync(model, warmup_prompt)
+
+    def list_models_sync(self):
+        return self.inner.list_models_sync()
+
+    async def runtime_stats(self) -> Dict[str, Any]:
+        return dict(await self.inner.runtime_stats(), local_streams=len(self._local_streams))
+
+    def runtime_stats_sync(self) -> Dict[str, Any]:
+        return dict(self.inner.runtime_stats_sync(), local_streams=len(self._local_streams))
+
+    def close(self):
+        self._local_streams.clear()
+        self.inner.close()
+
+
+def _is_model_loading(exc: BaseException) -> bool:
+    # llm.js rejects requests while the model is still loading; that clears up on its own.
+    return isinstance(exc, OpenAIError) and "Model is not ready yet" in str(exc)
+
+
+def _is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, APIConnectionError):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code in _RETRYABLE_STATUS_CODES
+    return _is_model_loading(exc)
+
+
+def _is_runtime_crash(exc: BaseException) -> bool:
+    # A trapped or out-of-memory wasm module rejects every later call the same way.
+    message = str(exc)
+    return any(marker in message for marker in _RUNTIME_CRASH_MARKERS)
+
+
+class _CircuitBreaker:
+    """Fails fast once a model runtime has failed `threshold` times in a row.
+
+    While open, calls raise immediately instead of waiting out their timeouts.
+    After `cooldown` seconds one call is let through as a probe; its success
+    closes the breaker and its failure keeps it open for another cooldown.
+    """
+
+    def __init__(self, threshold: int = _BREAKER_THRESHOLD, cooldown: float = _BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def check(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            waited = time.monotonic() - self._opened_at
+            if waited < self.cooldown:
+                raise APIConnectionError(
+                    f"Model runtime unavailable after {self.failures} consecutive failures; "
+                    f"retrying in {self.cooldown - waited:.0f}s."
+                )
+            # Half-open: this caller is the probe; others keep failing fast until it reports back.
+            self._opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+
+# Every bridge client in a page talks to the same llm.js runtime, so they share one breaker.
+_BRIDGE_BREAKER = _CircuitBreaker()
+
+
+class _ResilientTransport(_Transport):
+    """Retries transient request failures with capped exponential backoff.
+
+    A request's `timeout` is a deadline for all of its attempts together;
+    backoff that would overrun it is not attempted. Chunk waits are not
+    retried (a lost chunk cannot be re-read) but still feed the breaker.
+    """
+
+    def __init__(self, inner: _Transport, max_retries: int = _DEFAULT_MAX_RETRIES, breaker: Optional[_CircuitBreaker] = None):
+        self.inner = inner
+        self.max_retries = max(0, int(max_retries))
+        self.breaker = breaker or _CircuitBreaker()
+
+    def _backoff(self, attempt: int, deadline: Optional[float]) -> Optional[float]:
+        if attempt >= self.max_retries:
+            return None
+        delay = min(_RETRY_MAX_DELAY, _RETRY_INITIAL_DELAY * 2 ** attempt) * random.uniform(0.75, 1.0)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    def _failed(self, exc: BaseException, attempt: int, deadline: Optional[float]) -> Optional[float]:
+        """Record a failure and return the delay before the next attempt, or None to give up.
+
+        Only lost connections and crashed runtimes count towards the breaker.
+        A model that is still loading or a retryable HTTP status is retried
+        without touching it, so a slow first load cannot lock the page out.
+        """
+        if isinstance(exc, APIConnectionError) or _is_runtime_crash(exc):
+            self.breaker.record_failure()
+            if self.breaker.is_open:
+                return None
+        elif not _is_transient(exc):
+            # The runtime answered, so it is alive even though the request was rejected.
+            self.breaker.record_success()
+        return self._backoff(attempt, deadline) if _is_transient(exc) else None
+
+    def request_sync(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        if _on_browser_main_thread():
+            # time.sleep would freeze the page; the async path backs off with asyncio.sleep.
+            return _run_sync(self.request(payload, timeout))
+        deadline = _deadline(timeout)
+        for attempt in itertools.count():
+            self.breaker.check()
+            try:
+                result = self.inner.request_sync(payload, _remaining(deadline))
+            except OpenAIError as exc:
+                delay = self._failed(exc, attempt, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def request(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        deadline = _deadline(timeout)
+        for attempt in itertools.count():
+            self.breaker.check()
+            try:
+                result = await self.inner.request(payload, _remaining(deadline))
+            except OpenAIError as exc:
+                delay = self._failed(exc, attempt, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def next_chunk_sync(self, stream_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        try:
+            result = self.inner.next_chunk_sync(stream_id, timeout)
+        except APIConnectionError:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    async def next_chunk(self, stream_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        try:
+            result = await self.inner.next_chunk(stream_id, timeout)
+        except APIConnectionError:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def close_stream_sync(self, stream_id: str):
+        return self.inner.close_stream_sync(stream_id)
+
+    async def close_stream(self, stream_id: str):
+        return await self.inner.close_stream(stream_id)
+
+    async def preload(self, model: str, warmup_prompt: Optional[str]) -> Dict[str, Any]:
+        return await self.inner.preload(model, warmup_prompt)
+
+    async def list_models(self):
+        return await self.inner.list_models()
+
+    def preload_sync(self, model: str, warmup_prompt: Optional[str]) -> Dict[str, Any]:
+        return self.inner.preload_sync(model, warmup_prompt)
+
+    def list_models_sync(self):
+        return self.inner.list_models_sync()
+
+    async def runtime_stats(self) -> Dict[str, Any]:
+        return await self.inner.runtime_stats()
+
+    def runtime_stats_sync(self) -> Dict[str, Any]:
+        return self.inner.runtime_stats_sync()
+
+    def close(self):
+        self.inner.close()
+
+
+_JSON_WHITESPACE = " \t\r\n"
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_JSON_LITERALS = {"true": True, "false": False, "null": None}
+_JSON_NUMBER_CHARS = set("0123456789+-.eE")
+
+
+class _IncrementalJSONParser:
+    """Push parser that builds a JSON object or array as text arrives.
+
+    `root` always holds the value parsed so far, including the partial text of
+    a string still being read. `feed` returns `(path, value)` pairs for every
+    value completed by that piece of text and sets `closed` as soon as the
+    top-level value ends; `consumed` is how much of the last piece belonged to
+    it. Text before the first `{` or `[` (small models like to announce their
+    JSON) is skipped.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.started = False
+        self.closed = False
+        self.consumed = 0
+        self._stack = []
+        self._scalar = None
+        self._scalar_is_key = False
+        self._escape = None
+        self._offset = 0
+
+    def feed(self, text: str):
+        events = []
+        self.consumed = 0
+        for index, ch in enumerate(text):
+            if self.closed:
+                break
+            self._offset += 1
+            if self._scalar is not None and self._feed_scalar(ch, events):
+                continue
+            self._feed_structural(ch, events)
+            if self.closed:
+                self.consumed = index + 1
+                return events
+
+        self.consumed = len(text)
+        if self._scalar is not None and self._scalar[0] == "string" and not self._scalar_is_key:
+            frame = self._stack[-1]
+            frame["container"][frame["slot"]] = "".join(self._scalar[1])
+        return events
+
+    def snapshot(self):
+        """Return a copy of `root` that later `feed` calls will not change.
+
+        `feed` only mutates the containers still open on the stack, so only
+        those are copied (shallowly). Finished values are shared with `root`
+        and the `completed` events, which makes each snapshot cost the size of
+        the open path rather than the whole document.
+        """
+        if not self._stack:
+            return self.root
+        snapshot = parent = None
+        for frame in self._stack:
+            container = frame["container"]
+            duplicate = dict(container) if isinstance(container, dict) else list(container)
+            if parent is None:
+                snapshot = duplicate
+            else:
+                parent[parent_slot] = duplicate
+            parent, parent_slot = duplicate, frame["slot"]
+        return snapshot
+
+    def finish(self):
+        if not self.started:
+            raise ValueError("no JSON object or array found in the output")
+        if not self.closed:
+            raise ValueError(f"output ended at offset {self._offset} before the JSON value was complete")
+
+    def _error(self, ch: str):
+        return ValueError(f"unexpected {ch!r} at offset {self._offset}")
+
+    def _feed_scalar(self, ch: str, events) -> bool:
+        kind, buf = self._scalar
+
+        if kind == "string":
+            if self._escape is not None:
+                if self._escape == "":
+                    if ch == "u":
+                        self._escape = "u"
+                    elif ch in _JSON_ESCAPES:
+                        buf.append(_JSON_ESCAPES[ch])
+                        self._escape = None
+                    else:
+                        raise self._error(ch)
+                    return True
+
+                self._escape += ch
+                if len(self._escape) == 5:
+                    try:
+                        buf.append(chr(int(self._escape[1:], 16)))
+                    except ValueError:
+                        raise self._error(self._escape) from None
+                    self._escape = None
+                return True
+
+            if ch == "\\":
+                self._escape = ""
+                return True
+            if ch == '"':
+                self._scalar = None
+                text = "".join(buf)
+                if any("\ud800" <= c <= "\udfff" for c in text):
+                    text = text.encode("utf-16", "surrogatepass").decode("utf-16")
+                if self._scalar_is_key:
+                    frame = self._stack[-1]
+                    frame["key"] = text
+                    frame["expect"] = "colon"
+                else:
+                    self._complete_value(text, events)
+                return True
+            buf.append(ch)
+            return True
+
+        if kind == "number":
+            if ch in _JSON_NUMBER_CHARS:
+                buf.append(ch)
+                return True
+            self._scalar = None
+            raw = "".join(buf)
+            try:
+                value = float(raw) if any(c in raw for c in ".eE") else int(raw)
+            except ValueError:
+                raise self._error(raw) from None
+            self._complete_value(value, events)
+            return False
+
+        if ch.isalpha():
+            buf.append(ch)
+            word = "".join(buf)
+            if not any(literal.startswith(word) for literal in _JSON_LITERALS):
+                raise self._error(word)
+            return True
+        self._scalar = None
+        word = "".join(buf)
+        if word not in _JSON_LITERALS:
+            raise self._error(word)
+        self._complete_value(_JSON_LITERALS[word], events)
+        return False
+
+    def _feed_structural(self, ch: str, events):
+        if not self.started:
+            if ch in "{[":
+                self.started = True
+                self._open_container(ch)
+            return
+
+        if ch in _JSON_WHITESPACE:
+            return
+
+        frame = self._stack[-1]
+        is_object = isinstance(frame["container"], dict)
+        expect = frame["expect"]
+
+        if expect == "value":
+            if ch == "]" and not is_object and frame["empty"]:
+                self._close_container(events)
+            else:
+                self._start_value(ch)
+        elif expect == "key":
+            if ch == '"':
+                self._scalar = ("string", [])
+                self._scalar_is_key = True
+            elif ch == "}" and frame["empty"]:
+                self._close_container(events)
+            else:
+                raise self._error(ch)
+        elif expect == "colon":
+            if ch != ":":
+                raise self._error(ch)
+            frame["expect"] = "value"
+        elif expect == "next":
+            if ch == ",":
+                frame["expect"] = "key" if is_object else "value"
+            elif ch == ("}" if is_object else "]"):
+                self._close_container(events)
+            else:
+                raise self._error(ch)
+
+    def _open_slot(self):
+        frame = self._stack[-1]
+        container = frame["container"]
+        if isinstance(container, dict):
+            frame["slot"] = frame["key"]
+            container[frame["key"]] = None
+        else:
+            frame["slot"] = len(container)
+            container.append(None)
+
+    def _start_value(self, ch: str):
+        if ch in "{[":
+            self._open_slot()
+            self._open_container(ch)
+            return
+
+        if ch == '"':
+            self._open_slot()
+            frame = self._stack[-1]
+            frame["container"][frame["slot"]] = ""
+            self._scalar = ("string", [])
+            self._scalar_is_key = False
+        elif ch == "-" or ch.isdigit():
+            self._open_slot()
+            self._scalar = ("number", [ch])
+        elif ch in "tfn":
+            self._open_slot()
+            self._scalar = ("literal", [ch])
+        else:
+            raise self._error(ch)
+
+    def _open_container(self, ch: str):
+        container = {} if ch == "{" else []
+        if self._stack:
+            parent = self._stack[-1]
+            parent["container"][parent["slot"]] = container
+            path = parent["path"] + (parent["slot"],)
+        else:
+            self.root = container
+            path = ()
+        self._stack.append({
+            "container": container,
+            "expect": "key" if ch == "{" else "value",
+            "empty": True,
+            "key": None,
+            "slot": None,
+            "path": path,
+        })
+
+    def _close_container(self, events):
+        frame = self._stack.pop()
+        if not self._stack:
+            self.closed = True
+            events.append(((), frame["container"]))
+            return
+        self._complete_value(frame["container"], events)
+
+    def _complete_value(self, value: Any, events):
+        frame = self._stack[-1]
+        frame["container"][frame["slot"]] = value
+        frame["expect"] = "next"
+        frame["empty"] = False
+        events.append((frame["path"] + (frame["slot"],), value))
+
+
+def _wants_json_output(payload: Dict[str, Any]) -> bool:
+    if payload.get("type") == "chat.completions.create":
+        response_format = payload.get("response_format")
+    else:
+        response_format = (payload.get("text") or {}).get("format") if isinstance(payload.get("text"), dict) else None
+    return isinstance(response_format, dict) and response_format.get("type") in {"json_object", "json_schema"}
+
+
+class _StructuredOutputProcessor:
+    """Parses JSON out of a text stream and ends it once the top-level value closes.
+
+    Each text chunk gains `parsed` (a snapshot of the value so far) and
+    `completed` (the `(path, value)` pairs finished by that chunk). Text after
+    the closing bracket is dropped and a final stop chunk is emitted in place
+    of the rest of the generation.
+    """
+
+    def __init__(self, kind: str, response_id: Optional[str] = None):
+        self.kind = kind
+        self.response_id = response_id
+        self.parser = _IncrementalJSONParser()
+        self._text = []
+
+    @property
+    def wants_stop(self) -> bool:
+        return self.parser.closed
+
+    def _delta_holder(self, chunk: Dict[str, Any]):
+        if self.kind == "chat":
+            choices = chunk.get("choices") or []
+            delta = choices[0].get("delta") if choices and isinstance(choices[0], dict) else None
+            if isinstance(delta, dict) and isinstance(delta.get("content"), str):
+                return delta, "content"
+            return None, None
+        if chunk.get("type") == "response.output_text.delta" and isinstance(chunk.get("delta"), str):
+            return chunk, "delta"
+        return None, None
+
+    def process(self, chunk: Dict[str, Any]):
+        if self.parser.closed:
+            return []
+
+        holder, field = self._delta_holder(chunk)
+        if holder is None:
+            return [chunk]
+
+        text = holder[field]
+        try:
+            events = self.parser.feed(text)
+        except ValueError as exc:
+            raise OpenAIError(f"Model output is not valid JSON: {exc}") from exc
+
+        if self.parser.closed:
+            text = text[:self.parser.consumed]
+            holder[field] = text
+        self._text.append(text)
+
+        chunk["parsed"] = _Verbatim(self.parser.snapshot())
+        chunk["completed"] = _Verbatim(events)
+        if not self.parser.closed:
+            return [chunk]
+        return [chunk, self._final_chunk()]
+
+    def finish(self):
+        if self.parser.closed:
+            return []
+        try:
+            self.parser.finish()
+        except ValueError as exc:
+            raise OpenAIError(f"Model output is not valid JSON: {exc}") from exc
+        return []
+
+    def _final_chunk(self) -> Dict[str, Any]:
+        parsed = _Verbatim(self.parser.root)
+        if self.kind == "chat":
+            return {
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                "parsed": parsed,
+            }
+        return {
+            "type": "response.completed",
+            "response": {"id": self.response_id, "output_text": "".join(self._text)},
+            "parsed": parsed,
+        }
+
+
+class _CoalescingProcessor:
+    """Merges consecutive text deltas into one chunk every `interval_ms` or `max_chars`.
+
+    The merged chunk is the first buffered chunk with its text replaced, so it
+    keeps the OpenAI chunk shape. Any other chunk (finish reason, usage,
+    `response.completed`, tool calls) flushes the buffer and passes through
+    unchanged. Limits are checked when a chunk arrives, so buffered text waits
+    at most one token gap past `interval_ms`.
+    """
+
+    wants_stop = False
+
+    def __init__(self, kind: str, interval_ms: float = 0, max_chars: int = 0):
+        self.kind = kind
+        self.interval = interval_ms / 1000.0
+        self.max_chars = max_chars
+        self._head = None
+        self._parts = []
+        self._chars = 0
+        self._started = 0.0
+
+    def _text_key(self, chunk: Dict[str, Any]):
+        """Return a key grouping mergeable text chunks, or None for pass-through chunks."""
+        if self.kind == "chat":
+            choices = chunk.get("choices")
+            if chunk.get("usage") is not None or not isinstance(choices, list) or len(choices) != 1:
+                return None
+            choice = choices[0]
+            if not isinstance(choice, dict) or choice.get("finish_reason") is not None or choice.get("logprobs") is not None:
+                return None
+            delta = choice.get("delta")
+            if not isinstance(delta, dict) or not isinstance(delta.get("content"), str) or set(delta) - {"role", "content"}:
+                return None
+            return ("chat", choice.get("index", 0))
+        if chunk.get("type") == "response.output_text.delta" and isinstance(chunk.get("delta"), str):
+            return ("responses", chunk.get("output_index"), chunk.get("content_index"))
+        return None
+
+    def _flush(self):
+        if self._head is None:
+            return []
+        chunk, self._head = self._head, None
+        text = "".join(self._parts)
+        self._parts, self._chars = [], 0
+        if self.kind == "chat":
+            chunk["choices"][0]["delta"]["content"] = text
+        else:
+            chunk["delta"] = text
+        return [chunk]
+
+    def process(self, chunk: Dict[str, Any]):
+        key = self._text_key(chunk)
+        if key is None:
+            return self._flush() + [chunk]
+
+        out = []
+        if self._head is not None and self._key != key:
+            out = self._flush()
+        text = chunk["choices"][0]["delta"]["content"] if self.kind == "chat" else chunk["delta"]
+        if self._head is None:
+            self._head, self._key, self._started = chunk, key, time.monotonic()
+        self._parts.append(text)
+        self._chars += len(text)
+
+        if (self.max_chars and self._chars >= self.max_chars) or (
+            self.interval and time.monotonic() - self._started >= self.interval
+        ):
+            out.extend(self._flush())
+        return out
+
+    def finish(self):
+        return self._flush()
+
+
+_TOOL_CALL_OPEN = "<tool_call>"
+_TOOL_CALL_CLOSE = "</tool_call>"
+
+
+def _wants_tool_calls(payload: Dict[str, Any]) -> bool:
+    return bool(payload.get("tools")) and payload.get("tool_choice") != "none"
+
+
+def _parse_tool_call_block(body: str):
+    """Return `[(name, arguments JSON)]` for one `<tool_call>` body, or None if it is not a call."""
+    try:
+        value = json.loads(body)
+    except ValueError:
+        return None
+    calls = []
+    for item in value if isinstance(value, list) else [value]:
+        if not isinstance(item, dict) or not isinstance(item.get("name"), str):
+            return None
+        arguments = item.get("arguments", item.get("parameters", {}))
+        calls.append((item["name"], arguments if isinstance(arguments, str) else json.dumps(arguments)))
+    return calls or None
+
+
+def _split_tool_calls(text: str):
+    """Split model text into `(remaining text, [(name, arguments JSON)])`.
+
+    Blocks that do not parse as a call stay in the text, so a malformed call
+    reads as ordinary output instead of disappearing.
+    """
+    parts, calls = [], []
+    position = 0
+    while True:
+        start = text.find(_TOOL_CALL_OPEN, position)
+        end = text.find(_TOOL_CALL_CLOSE, start + len(_TOOL_CALL_OPEN)) if start >= 0 else -1
+        if end < 0:
+            parts.append(text[position:])
+            break
+        parsed = _parse_tool_call_block(text[start + len(_TOOL_CALL_OPEN):end])
+        parts.append(text[position:start] if parsed else text[position:end + len(_TOOL_CALL_CLOSE)])
+        calls.extend(parsed or [])
+        position = end + len(_TOOL_CALL_CLOSE)
+    return "".join(parts), calls
+
+
+def _tool_call_object(kind: str, name: str, arguments: str, index: int = 0) -> Dict[str, Any]:
+    if kind == "chat":
+        return {
+            "index": index,
+            "id": _make_id("call"),
+            "type": "function",
+            "function": {"name": name, "arguments": arguments},
+        }
+    return {
+        "type": "function_call",
+        "id": _make_id("fc"),
+        "call_id": _make_id("call"),
+        "name": name,
+        "arguments": arguments,
+        "status": "completed",
+    }
+
+
+def _responses_output(text: str, calls) -> list:
+    output = [
+        {"type": "message", "role": "assistant", "content": [{"type": "output_text", "text": text}]}
+    ] if text else []
+    return output + list(calls)
+
+
+def _attach_tool_calls(payload: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn `<tool_call>` blocks in a non-streamed result into OpenAI tool calls.
+
+    Results that already carry tool calls (a server with native support) are
+    returned unchanged.
+    """
+    if not _wants_tool_calls(payload):
+        return result
+
+    if payload.get("type") == "chat.completions.create":
+        for choice in result.get("choices") or []:
+            message = choice.get("message") if isinstance(choice, dict) else None
+            if not isinstance(message, dict) or message.get("tool_calls") or not isinstance(message.get("content"), str):
+                continue
+            text, calls = _split_tool_calls(message["content"])
+            if calls:
+                message["content"] = text.strip() or None
+                message["tool_calls"] = [
+                    _tool_call_object("chat", name, arguments, index) for index, (name, arguments) in enumerate(calls)
+                ]
+                choice["finish_reason"] = "tool_calls"
+        return result
+
+    output = result.get("output") or []
+    if any(isinstance(item, dict) and item.get("type") == "function_call" for item in output):
+        return result
+    text, calls = _split_tool_calls(result.get("output_text") or "")
+    if calls:
+        result["output_text"] = text.strip()
+        result["output"] = _responses_output(
+            result["output_text"], [_tool_call_object("responses", name, arguments) for name, arguments in calls]
+        )
+    return result
+
+
+def _partial_tag_length(text: str, tag: str) -> int:
+    """Length of the longest suffix of `text` that could be the start of `tag`."""
+    for size in range(min(len(text), len(tag) - 1), 0, -1):
+        if tag.startswith(text[-size:]):
+            return size
+    return 0
+
+
+class _ToolCallProcessor:
+    """Lifts `<tool_call>` blocks out of a text stream and emits them as tool-call chunks.
+
+    Text that might be the start of a block is held back until it is ruled
+    out, so callers never see tag fragments. Each completed call becomes a
+    chat `delta.tool_calls` chunk or a Responses `response.output_item.done`
+    event; the finish chunk then reports `tool_calls` (chat) and the
+    completed response lists the calls in `output`.
+    """
+
+    wants_stop = False
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._buffer = ""
+        self._inside = False
+        self._trailing = ""
+        self._template = None
+        self._text = []
+        self._calls = []
+
+    def _text_holder(self, chunk: Dict[str, Any]):
+        if self.kind == "chat":
+            choices = chunk.get("choices") or []
+            choice = choices[0] if len(choices) == 1 and isinstance(choices[0], dict) else None
+            delta = choice.get("delta") if choice is not None else None
+            if isinstance(delta, dict) and isinstance(delta.get("content"), str):
+                return delta, "content"
+            return None, None
+        if chunk.get("type") == "response.output_text.delta" and isinstance(chunk.get("delta"), str):
+            return chunk, "delta"
+        return None, None
+
+    def _scan(self, text: str):
+        """Feed `text`; return `(visible text, [(name, arguments JSON)])` completed so far."""
+        self._buffer += text
+        visible, calls = [], []
+        while True:
+            if self._inside:
+                end = self._buffer.find(_TOOL_CALL_CLOSE)
+                if end < 0:
+                    break
+                body = self._buffer[:end]
+                parsed = _parse_tool_call_block(body)
+                if parsed:
+                    calls.extend(parsed)
+                else:
+                    visible.append(_TOOL_CALL_OPEN + body + _TOOL_CALL_CLOSE)
+                self._buffer, self._inside = self._buffer[end + len(_TOOL_CALL_CLOSE):], False
+                continue
+            start = self._buffer.find(_TOOL_CALL_OPEN)
+            if start >= 0:
+                visible.append(self._buffer[:start])
+                self._buffer, self._inside = self._buffer[start + len(_TOOL_CALL_OPEN):], True
+                continue
+            keep = _partial_tag_length(self._buffer, _TOOL_CALL_OPEN)
+            visible.append(self._buffer[:len(self._buffer) - keep])
+            self._buffer = self._buffer[len(self._buffer) - keep:]
+            break
+        return "".join(visible), calls
+
+    def _emit_text(self, text: str) -> str:
+        # Whitespace is held until more text follows, so the gaps around
+        # call blocks do not leak out as content.
+        text = self._trailing + text
+        if not any(self._text):
+            text = text.lstrip()
+        body = text.rstrip()
+        self._trailing = text[len(body):]
+        self._text.append(body)
+        return body
+
+    def _text_chunk(self, text: str) -> Dict[str, Any]:
+        chunk = copy.deepcopy(self._template) if self._template is not None else {}
+        if self.kind == "chat":
+            chunk.setdefault("object", "chat.completion.chunk")
+            chunk["choices"] = [{"index": 0, "delta": {"content": text}}]
+        else:
+            chunk["type"] = "response.output_text.delta"
+            chunk["delta"] = text
+        return chunk
+
+    def _call_chunks(self, calls) -> list:
+        chunks = []
+        for name, arguments in calls:
+            index = len(self._calls)
+            call = _tool_call_object(self.kind, name, arguments, index)
+            self._calls.append(call)
+            if self.kind == "chat":
+                chunk = {key: value for key, value in (self._template or {}).items() if key != "choices"}
+                chunk.setdefault("object", "chat.completion.chunk")
+                chunk["choices"] = [{"index": 0, "delta": {"tool_calls": [call]}}]
+            else:
+                chunk = {"type": "response.output_item.done", "output_index": index, "item": call}
+            chunks.append(chunk)
+        return chunks
+
+    def _flush(self) -> list:
+        leftover = (_TOOL_CALL_OPEN if self._inside else "") + self._buffer
+        self._buffer, self._inside = "", False
+        if self._calls:
+            # Whitespace after the last call is dropped along with the blocks.
+            text = self._emit_text(leftover)
+        else:
+            text, self._trailing = self._trailing + leftover, ""
+            self._text.append(text)
+        return [self._text_chunk(text)] if text else []
+
+    def process(self, chunk: Dict[str, Any]):
+        holder, field = self._text_holder(chunk)
+        if holder is not None:
+            self._template = {key: value for key, value in chunk.items() if key not in ("choices", "delta")}
+            visible, calls = self._scan(holder[field])
+            visible = self._emit_text(visible) if visible else ""
+            out = []
+            if visible:
+                holder[field] = visible
+                out.append(chunk)
+            return out + self._call_chunks(calls)
+
+        out = self._flush()
+        if self.kind == "chat":
+            for choice in chunk.get("choices") or []:
+                if isinstance(choice, dict) and choice.get("finish_reason") == "stop" and self._calls:
+                    choice["finish_reason"] = "tool_calls"
+        elif chunk.get("type") == "response.output_text.done" and "text" in chunk:
+            chunk["text"] = "".join(self._text)
+        elif chunk.get("type") == "response.completed" and isinstance(chunk.get("response"), dict) and self._calls:
+            response = chunk["response"]
+            response["output_text"] = "".join(self._text)
+            response["output"] = _responses_output(response["output_text"], self._calls)
+        return out + [chunk]
+
+    def finish(self):
+        return self._flush()
+
+
+_abandoned_closes = set()
+
+
+def _close_abandoned_stream(transport: _Transport, stream_id: str):
+    """Finalizer for a stream dropped before it ended, e.g. after `break` in its loop.
+
+    It cancels the generation and gives back the stream's connection slot.
+    Inside a running event loop the close is scheduled instead of run, since
+    finalizers cannot await.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    try:
+        if loop is None:
+            transport.close_stream_sync(stream_id)
+        else:
+            task = loop.create_task(transport.close_stream(stream_id))
+            _abandoned_closes.add(task)
+            task.add_done_callback(_abandoned_closes.discard)
+    except Exception as exc:
+        _debug_bridge(f"closing abandoned stream {stream_id} failed: {exc}")
+
+
 class _BaseStream:
-    def __init__(self, stream_id: str):
+    def __init__(self, stream_id: str, transport: Optional[_Transport] = None, *, processors=None, timeout=None):
         self.stream_id = stream_id
+        self._transport = transport or _BridgeTransport()
+        # Bounds each wait for the next chunk, including runtime polls that come back empty.
+        self.timeout = timeout
+        self._processors = list(processors or [])
+        self._pending = []
+        self._finished = False
+        # Called once with the stream when it ends or is closed (memory profiling hooks in here).
+        self._on_finish = None
+        self._finalizer = weakref.finalize(self, _close_abandoned_stream, self._transport, stream_id)
+        self._finalizer.atexit = False
 
     def __iter__(self):
         return self
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _release(self):
+        # The transport has finished or closed the stream, so the finalizer has nothing left to do.
+        self._finalizer.detach()
+        callback, self._on_finish = self._on_finish, None
+        if callback is not None:
+            callback(self)
+
+    def close(self):
+        self._finished = True
+        self._transport.close_stream_sync(self.stream_id)
+        self._release()
+
     def __next__(self):
+        deadline = _deadline(self.timeout)
         while True:
-            result = _run_sync(_next_chunk(self.stream_id))
+            if self._pending:
+                return _to_ns(self._pending.pop(0))
+            if self._finished:
+                raise StopIteration
+
+            try:
+                result = self._transport.next_chunk_sync(self.stream_id, _remaining(deadline))
+            except APITimeoutError:
+                # Cancel the generation so a stalled runtime does not keep the session alive.
+                self.close()
+                raise
             if result.get("error"):
+                self._release()
                 raise OpenAIError(result["error"])
 
             if result.get("done"):
-                raise StopIteration
+                self._finished = True
+                self._release()
+                self._pending.extend(_finish_processors(self._processors))
+                continue
 
             chunk = result.get("chunk")
             if chunk is None:
                 continue
+            deadline = _deadline(self.timeout)
+
+            if not self._processors:
+                return _to_ns(chunk)
 
-            return _to_ns(chunk)
+            try:
+                self._pending.extend(_run_processors(self._processors, chunk))
+            except Exception:
+                # e.g. malformed JSON output: stop the generation and free the stream before raising.
+                self.close()
+                raise
+            if any(processor.wants_stop for processor in self._processors):
+                self._pending.extend(_finish_processors(self._processors))
+                self.close()
 
 
 class _AsyncBaseStream:
-    def __init__(self, stream_id: str):
+    def __init__(self, stream_id: str, transport: Optional[_Transport] = None, *, processors=None, timeout=None):
         self.stream_id = stream_id
+        self._transport = transport or _BridgeTransport()
+        # Bounds each wait for the next chunk, including runtime polls that come back empty.
+        self.timeout = timeout
+        self._processors = list(processors or [])
+        self._pending = []
+        self._finished = False
+        # Called once with the stream when it ends or is closed (memory profiling hooks in here).
+        self._on_finish = None
+        self._finalizer = weakref.finalize(self, _close_abandoned_stream, self._transport, stream_id)
+        self._finalizer.atexit = False
 
     def __aiter__(self):
         return self
 
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _release(self):
+        # The transport has finished or closed the stream, so the finalizer has nothing left to do.
+        self._finalizer.detach()
+        callback, self._on_finish = self._on_finish, None
+        if callback is not None:
+            callback(self)
+
+    async def close(self):
+        self._finished = True
+        await self._transport.close_stream(self.stream_id)
+        self._release()
+
     async def __anext__(self):
+        deadline = _deadline(self.timeout)
         while True:
-            result = await _next_chunk(self.stream_id)
+            if self._pending:
+                return _to_ns(self._pending.pop(0))
+            if self._finished:
+                raise StopAsyncIteration
+
+            try:
+                result = await self._transport.next_chunk(self.stream_id, _remaining(deadline))
+            except APITimeoutError:
+                # Cancel the generation so a stalled runtime does not keep the session alive.
+                await self.close()
+                raise
             if result.get("error"):
+                self._release()
                 raise OpenAIError(result["error"])
 
             if result.get("done"):
-                raise StopAsyncIteration
+                self._finished = True
+                self._release()
+                self._pending.extend(_finish_processors(self._processors))
+                continue
 
             chunk = result.get("chunk")
             if chunk is None:
                 continue
+            deadline = _deadline(self.timeout)
+
+            if not self._processors:
+                return _to_ns(chunk)
+
+            try:
+                self._pending.extend(_run_processors(self._processors, chunk))
+            except Exception:
+                # e.g. malformed JSON output: stop the generation and free the stream before raising.
+                await self.close()
+                raise
+            if any(processor.wants_stop for processor in self._processors):
+                self._pending.extend(_finish_processors(self._processors))
+                await self.close()
 
-            return _to_ns(chunk)
+
+def _run_processors(processors, chunk: Dict[str, Any]):
+    chunks = [chunk]
+    for processor in processors:
+        chunks = [out for item in chunks for out in processor.process(item)]
+    return chunks
+
+
+def _finish_processors(processors):
+    # Chunks flushed by one processor still flow through the ones after it.
+    chunks = []
+    for processor in processors:
+        chunks = [out for item in chunks for out in processor.process(item)] + processor.finish()
+    return chunks
+
+
+def _coalesce_settings(client, kwargs: Dict[str, Any]) -> Optional[Tuple[float, int]]:
+    """Pop per-call coalescing options from `kwargs`, falling back to the client and environment."""
+    options = client.options
+    interval = kwargs.pop("coalesce_ms", options.get("coalesce_ms", os.environ.get("NOPENAI_COALESCE_MS")))
+    max_chars = kwargs.pop("coalesce_chars", options.get("coalesce_chars", os.environ.get("NOPENAI_COALESCE_CHARS")))
+    if interval is None and max_chars is None:
+        interval = _DEFAULT_COALESCE_MS if _in_browser_runtime() else 0
+
+    try:
+        interval, max_chars = float(interval or 0), int(max_chars or 0)
+    except (TypeError, ValueError):
+        raise ValueError("coalesce_ms and coalesce_chars must be non-negative numbers") from None
+    if interval < 0 or max_chars < 0:
+        raise ValueError("coalesce_ms and coalesce_chars must be non-negative numbers")
+    if not interval and not max_chars:
+        return None
+    return interval, max_chars
+
+
+def _stream_processors(kind: str, payload: Dict[str, Any], result: Dict[str, Any], coalesce=None):
+    processors = []
+    # Coalescing runs first so later processors see fewer, larger chunks.
+    if coalesce:
+        processors.append(_CoalescingProcessor(kind, *coalesce))
+    # Tool-call blocks are lifted out before JSON parsing sees the text.
+    if _wants_tool_calls(payload) and _choice_count(payload) == 1:
+        processors.append(_ToolCallProcessor(kind))
+    # Candidates of an n>1 stream arrive one after another; stopping at the first
+    # closing bracket would cut the later ones off, so they stream as plain text.
+    if _wants_json_output(payload) and _choice_count(payload) == 1:
+        processors.append(_StructuredOutputProcessor(kind, result.get("id")))
+    return processors
 
 
 def _validate_message_list(messages):
     if not isinstance(messages, list):
         raise ValueError("messages/input must be a list of role/content objects")
 
-    allowed = {"developer", "system", "user", "assistant"}
+    allowed = {"developer", "system", "user", "assistant", "tool"}
     for msg in messages:
         if not isinstance(msg, dict):
             raise ValueError("each message must be a dict")
+        if msg.get("type") in {"function_call", "function_call_output"} and "role" not in msg:
+            # Responses input items that carry a tool call and its result.
+            if not isinstance(msg.get("call_id"), str):
+                raise ValueError(f"{msg['type']} items must include a call_id string")
+            continue
         role = msg.get("role")
         if role not in allowed:
-            raise ValueError("message role must be one of developer, system, user, assistant")
+            raise ValueError("message role must be one of developer, system, user, assistant, tool")
         if "content" not in msg:
             raise ValueError("each message must include content")
         content = msg.get("content")
-        if isinstance(content, str):
+        if role == "tool" and not isinstance(msg.get("tool_call_id"), str):
+            raise ValueError("tool messages must include a tool_call_id string")
+        if isinstance(content, str) or (content is None and role == "assistant" and msg.get("tool_calls")):
             continue
         if not isinstance(content, list):
             raise ValueError("message content must be a string or a list of content blocks")
@@ -335,11 +3066,162 @@ def _validate_message_list(messages):
                 raise ValueError("text content blocks must include a text string")
 
 
+def _validate_choice_count(n):
+    if n is None:
+        return
+    if isinstance(n, bool) or not isinstance(n, int) or not 1 <= n <= _MAX_CHOICES:
+        raise ValueError(f"n must be an integer between 1 and {_MAX_CHOICES}")
+
+
 def _validate_model_name(model: str):
-    if model != _EXPECTED_MODEL_NAME:
+    if model not in _MODEL_REGISTRY:
         raise OpenAIError(f"model {model} not found.")
 
 
+def _model_object(model: str) -> Dict[str, Any]:
+    info = _MODEL_REGISTRY[model]
+    return {
+        "id": model,
+        "object": "model",
+        "created": 0,
+        "owned_by": info["owned_by"],
+        "context_window": info["context_window"],
+    }
+
+
+def _tool_functions(functions) -> Dict[str, Any]:
+    if isinstance(functions, dict):
+        table = dict(functions)
+    else:
+        table = {getattr(fn, "__name__", None): fn for fn in functions or []}
+    if not table or not all(isinstance(name, str) and callable(fn) for name, fn in table.items()):
+        raise ValueError("functions must map tool names to callables (or be a list of named functions)")
+    return table
+
+
+def _tool_result_content(result: Dict[str, Any]) -> str:
+    if result["error"] is not None:
+        return json.dumps({"error": result["error"]})
+    output = result["output"]
+    return output if isinstance(output, str) else json.dumps(output, default=str)
+
+
+class _ToolRunner:
+    """Executes the tool calls of one model turn concurrently.
+
+    Coroutine functions run on the event loop and plain functions in a thread
+    pool, each bounded by its own `timeout`, so a turn costs about as long as
+    its slowest tool. Errors and timeouts come back as results the model can
+    read, not exceptions. A sync tool that times out keeps its worker thread
+    until it returns; its result is discarded.
+
+    Pyodide has no threads, so there plain functions run inline, one after
+    another, and `timeout` cannot interrupt them; only coroutine tools are
+    concurrent and time-limited in the browser.
+    """
+
+    def __init__(self, functions, timeout: Optional[float] = _DEFAULT_TOOL_TIMEOUT, max_workers: Optional[int] = None):
+        self.functions = _tool_functions(functions)
+        self.timeout = _validate_timeout(timeout)
+        self.max_workers = max_workers
+
+    async def _call(self, call: Dict[str, Any], pool) -> Dict[str, Any]:
+        started = time.monotonic()
+        output, error = None, None
+        try:
+            fn = self.functions.get(call["name"])
+            if fn is None:
+                raise LookupError(f"unknown tool {call['name']!r}")
+            arguments = json.loads(call["arguments"] or "{}")
+            if not isinstance(arguments, dict):
+                raise ValueError("tool arguments must be a JSON object")
+            if asyncio.iscoroutinefunction(fn):
+                output = await asyncio.wait_for(fn(**arguments), self.timeout)
+            elif pool is not None:
+                work = asyncio.get_running_loop().run_in_executor(pool, functools.partial(fn, **arguments))
+                output = await asyncio.wait_for(work, self.timeout)
+            else:
+                # Pyodide: no thread to run it on, so it blocks the loop and is not time-limited.
+                output = fn(**arguments)
+        except asyncio.TimeoutError:
+            error = f"timed out after {self.timeout} seconds"
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+        return {
+            "call_id": call["call_id"],
+            "name": call["name"],
+            "output": output,
+            "error": error,
+            "elapsed": time.monotonic() - started,
+        }
+
+    async def run(self, calls) -> list:
+        pool = None
+        if not _in_browser_runtime() and not all(
+            asyncio.iscoroutinefunction(self.functions.get(call["name"])) for call in calls
+        ):
+            executor = _lazy_import("concurrent.futures", "ThreadPoolExecutor")
+            pool = executor(self.max_workers or len(calls), thread_name_prefix="nopenai-tool")
+        try:
+            return list(await asyncio.gather(*(self._call(call, pool) for call in calls)))
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False)
+
+
+def _chat_tool_calls(completion) -> list:
+    message = completion.choices[0].message
+    return [
+        {"call_id": call.id, "name": call.function.name, "arguments": call.function.arguments}
+        for call in getattr(message, "tool_calls", None) or []
+    ]
+
+
+def _chat_tool_followup(messages, completion, calls, results) -> list:
+    followup = list(messages)
+    followup.append({
+        "role": "assistant",
+        "content": getattr(completion.choices[0].message, "content", None),
+        "tool_calls": [
+            {"id": call["call_id"], "type": "function", "function": {"name": call["name"], "arguments": call["arguments"]}}
+            for call in calls
+        ],
+    })
+    followup.extend(
+        {"role": "tool", "tool_call_id": result["call_id"], "content": _tool_result_content(result)}
+        for result in results
+    )
+    return followup
+
+
+def _responses_tool_calls(response) -> list:
+    return [
+        {"call_id": item.call_id, "name": item.name, "arguments": item.arguments}
+        for item in getattr(response, "output", None) or []
+        if getattr(item, "type", None) == "function_call"
+    ]
+
+
+def _responses_tool_followup(input, calls, results) -> list:
+    followup = list(input) if isinstance(input, list) else [{"role": "user", "content": input}]
+    followup.extend(
+        {"type": "function_call", "call_id": call["call_id"], "name": call["name"], "arguments": call["arguments"]}
+        for call in calls
+    )
+    followup.extend(
+        {"type": "function_call_output", "call_id": result["call_id"], "output": _tool_result_content(result)}
+        for result in results
+    )
+    return followup
+
+
+def _validate_tool_run(kwargs: Dict[str, Any]):
+    if kwargs.get("stream"):
+        raise ValueError("run_tools does not support stream=True")
+    if kwargs.get("n") not in (None, 1):
+        raise ValueError("run_tools does not support n > 1")
+
+
 class ChatCompletionsStream(_BaseStream):
     pass
 
@@ -357,9 +3239,15 @@ class AsyncResponsesStream(_AsyncBaseStream):
 
 
 class _ChatCompletionsAPI:
+    def __init__(self, client):
+        self._client = client
+
     def create(self, *, model: str, messages, stream: bool = False, **kwargs):
-        _validate_model_name(model)
+        self._client._validate_model(model)
+        coalesce = _coalesce_settings(self._client, kwargs)
+        timeout = self._client._call_timeout(kwargs)
         _validate_message_list(messages)
+        _validate_choice_count(kwargs.get("n"))
         payload = {
             "type": "chat.completions.create",
             "model": model,
@@ -368,18 +3256,63 @@ class _ChatCompletionsAPI:
         }
         payload.update(kwargs)
 
-        result = _run_sync(_request(payload))
-        if result.get("stream"):
-            return ChatCompletionsStream(result["stream_id"])
-        return _to_ns(result)
+        transport = self._client._transport
+        with self._client._measure("chat.completions.create"):
+            result = transport.request_sync(payload, timeout)
+            if not result.get("stream"):
+                return _to_ns(_attach_tool_calls(payload, result))
+        stream = ChatCompletionsStream(
+            result["stream_id"],
+            transport,
+            processors=_stream_processors("chat", payload, result, coalesce),
+            timeout=timeout,
+        )
+        return self._client._track_stream(stream, "chat.completions.create stream")
+
+    def run_tools(
+        self,
+        *,
+        model: str,
+        messages,
+        tools,
+        functions,
+        tool_timeout: Optional[float] = _DEFAULT_TOOL_TIMEOUT,
+        max_workers: Optional[int] = None,
+        **kwargs,
+    ):
+        """Run one tool-calling turn: ask, execute every requested call concurrently, then ask once more.
+
+        `functions` maps tool names to callables (sync or async). Each call is
+        bounded by `tool_timeout` seconds and all results go back in a single
+        follow-up request, sent with `tool_choice="none"`. Returns that
+        follow-up completion, or the first one if the model called no tools,
+        with `tool_results` listing each call's output, error and elapsed time.
+        """
+        _validate_tool_run(kwargs)
+        runner = _ToolRunner(functions, tool_timeout, max_workers)
+        completion = self.create(model=model, messages=messages, tools=tools, **kwargs)
+        calls = _chat_tool_calls(completion)
+        if not calls:
+            completion.tool_results = []
+            return completion
+
+        results = _run_sync(runner.run(calls))
+        kwargs["tool_choice"] = "none"
+        followup = _chat_tool_followup(messages, completion, calls, results)
+        final = self.create(model=model, messages=followup, tools=tools, **kwargs)
+        final.tool_results = _to_ns(results)
+        return final
 
 
 class _ChatAPI:
-    def __init__(self):
-        self.completions = _ChatCompletionsAPI()
+    def __init__(self, client):
+        self.completions = _ChatCompletionsAPI(client)
 
 
 class _ResponsesAPI:
+    def __init__(self, client):
+        self._client = client
+
     def create(
         self,
         *,
@@ -390,7 +3323,9 @@ class _ResponsesAPI:
         previous_response_id: str = None,
         **kwargs,
     ):
-        _validate_model_name(model)
+        self._client._validate_model(model)
+        coalesce = _coalesce_settings(self._client, kwargs)
+        timeout = self._client._call_timeout(kwargs)
         if isinstance(input, list):
             _validate_message_list(input)
 
@@ -404,16 +3339,63 @@ class _ResponsesAPI:
         }
         payload.update(kwargs)
 
-        result = _run_sync(_request(payload))
-        if result.get("stream"):
-            return ResponsesStream(result["stream_id"])
-        return _to_ns(result)
+        transport = self._client._transport
+        with self._client._measure("responses.create"):
+            result = transport.request_sync(payload, timeout)
+            if not result.get("stream"):
+                return _to_ns(_attach_tool_calls(payload, result))
+        stream = ResponsesStream(
+            result["stream_id"],
+            transport,
+            processors=_stream_processors("responses", payload, result, coalesce),
+            timeout=timeout,
+        )
+        return self._client._track_stream(stream, "responses.create stream")
+
+    def run_tools(
+        self,
+        *,
+        model: str,
+        input,
+        tools,
+        functions,
+        instructions: str = None,
+        tool_timeout: Optional[float] = _DEFAULT_TOOL_TIMEOUT,
+        max_workers: Optional[int] = None,
+        **kwargs,
+    ):
+        """Responses counterpart of `chat.completions.run_tools`.
+
+        The follow-up resends `input` with the `function_call` items and their
+        `function_call_output` results appended, so it does not depend on the
+        runtime remembering the first response.
+        """
+        _validate_tool_run(kwargs)
+        runner = _ToolRunner(functions, tool_timeout, max_workers)
+        response = self.create(model=model, input=input, instructions=instructions, tools=tools, **kwargs)
+        calls = _responses_tool_calls(response)
+        if not calls:
+            response.tool_results = []
+            return response
+
+        results = _run_sync(runner.run(calls))
+        kwargs["tool_choice"] = "none"
+        followup = _responses_tool_followup(input, calls, results)
+        final = self.create(model=model, input=followup, instructions=instructions, tools=tools, **kwargs)
+        final.tool_results = _to_ns(results)
+        return final
 
 
 class _AsyncChatCompletionsAPI:
+    def __init__(self, client):
+        self._client = client
+
     async def create(self, *, model: str, messages, stream: bool = False, **kwargs):
-        _validate_model_name(model)
+        self._client._validate_model(model)
+        coalesce = _coalesce_settings(self._client, kwargs)
+        timeout = self._client._call_timeout(kwargs)
         _validate_message_list(messages)
+        _validate_choice_count(kwargs.get("n"))
         payload = {
             "type": "chat.completions.create",
             "model": model,
@@ -422,18 +3404,56 @@ class _AsyncChatCompletionsAPI:
         }
         payload.update(kwargs)
 
-        result = await _request(payload)
-        if result.get("stream"):
-            return AsyncChatCompletionsStream(result["stream_id"])
-        return _to_ns(result)
+        transport = self._client._transport
+        with self._client._measure("chat.completions.create"):
+            result = await transport.request(payload, timeout)
+            if not result.get("stream"):
+                return _to_ns(_attach_tool_calls(payload, result))
+        stream = AsyncChatCompletionsStream(
+            result["stream_id"],
+            transport,
+            processors=_stream_processors("chat", payload, result, coalesce),
+            timeout=timeout,
+        )
+        return self._client._track_stream(stream, "chat.completions.create stream")
+
+    async def run_tools(
+        self,
+        *,
+        model: str,
+        messages,
+        tools,
+        functions,
+        tool_timeout: Optional[float] = _DEFAULT_TOOL_TIMEOUT,
+        max_workers: Optional[int] = None,
+        **kwargs,
+    ):
+        """Async counterpart of `chat.completions.run_tools`; async tools share the running loop."""
+        _validate_tool_run(kwargs)
+        runner = _ToolRunner(functions, tool_timeout, max_workers)
+        completion = await self.create(model=model, messages=messages, tools=tools, **kwargs)
+        calls = _chat_tool_calls(completion)
+        if not calls:
+            completion.tool_results = []
+            return completion
+
+        results = await runner.run(calls)
+        kwargs["tool_choice"] = "none"
+        followup = _chat_tool_followup(messages, completion, calls, results)
+        final = await self.create(model=model, messages=followup, tools=tools, **kwargs)
+        final.tool_results = _to_ns(results)
+        return final
 
 
 class _AsyncChatAPI:
-    def __init__(self):
-        self.completions = _AsyncChatCompletionsAPI()
+    def __init__(self, client):
+        self.completions = _AsyncChatCompletionsAPI(client)
 
 
 class _AsyncResponsesAPI:
+    def __init__(self, client):
+        self._client = client
+
     async def create(
         self,
         *,
@@ -444,7 +3464,9 @@ class _AsyncResponsesAPI:
         previous_response_id: str = None,
         **kwargs,
     ):
-        _validate_model_name(model)
+        self._client._validate_model(model)
+        coalesce = _coalesce_settings(self._client, kwargs)
+        timeout = self._client._call_timeout(kwargs)
         if isinstance(input, list):
             _validate_message_list(input)
 
@@ -458,32 +3480,304 @@ class _AsyncResponsesAPI:
         }
         payload.update(kwargs)
 
-        result = await _request(payload)
-        if result.get("stream"):
-            return AsyncResponsesStream(result["stream_id"])
-        return _to_ns(result)
+        transport = self._client._transport
+        with self._client._measure("responses.create"):
+            result = await transport.request(payload, timeout)
+            if not result.get("stream"):
+                return _to_ns(_attach_tool_calls(payload, result))
+        stream = AsyncResponsesStream(
+            result["stream_id"],
+            transport,
+            processors=_stream_processors("responses", payload, result, coalesce),
+            timeout=timeout,
+        )
+        return self._client._track_stream(stream, "responses.create stream")
 
+    async def run_tools(
+        self,
+        *,
+        model: str,
+        input,
+        tools,
+        functions,
+        instructions: str = None,
+        tool_timeout: Optional[float] = _DEFAULT_TOOL_TIMEOUT,
+        max_workers: Optional[int] = None,
+        **kwargs,
+    ):
+        """Async counterpart of `responses.run_tools`; async tools share the running loop."""
+        _validate_tool_run(kwargs)
+        runner = _ToolRunner(functions, tool_timeout, max_workers)
+        response = await self.create(model=model, input=input, instructions=instructions, tools=tools, **kwargs)
+        calls = _responses_tool_calls(response)
+        if not calls:
+            response.tool_results = []
+            return response
+
+        results = await runner.run(calls)
+        kwargs["tool_choice"] = "none"
+        followup = _responses_tool_followup(input, calls, results)
+        final = await self.create(model=model, input=followup, instructions=instructions, tools=tools, **kwargs)
+        final.tool_results = _to_ns(results)
+        return final
+
+
+class _ModelsAPI:
+    def __init__(self, client):
+        self._client = client
+
+    def list(self):
+        data = self._client._lab_models()
+        if data is None:
+            data = self._client._transport.list_models_sync() or []
+        return _to_ns({"object": "list", "data": data})
+
+    def retrieve(self, model: str):
+        for entry in self.list().data:
+            if entry.id == model:
+                return entry
+        raise OpenAIError(f"model {model} not found.")
+
+    def preload(self, model: str, *, warmup_prompt: Optional[str] = _DEFAULT_WARMUP_PROMPT):
+        self._client._validate_model(model)
+        started = time.perf_counter()
+        info = self._client._transport.preload_sync(model, warmup_prompt)
+        return _to_ns(_preload_result(model, info, started))
 
-class OpenAI:
-    def __init__(self, *, base_url: str, api_key: str, **kwargs):
-        _validate_client_credentials(base_url, api_key)
+
+class _AsyncModelsAPI:
+    def __init__(self, client):
+        self._client = client
+
+    async def list(self):
+        data = self._client._lab_models()
+        if data is None:
+            data = await self._client._transport.list_models() or []
+        return _to_ns({"object": "list", "data": data})
+
+    async def retrieve(self, model: str):
+        for entry in (await self.list()).data:
+            if entry.id == model:
+                return entry
+        raise OpenAIError(f"model {model} not found.")
+
+    async def preload(self, model: str, *, warmup_prompt: Optional[str] = _DEFAULT_WARMUP_PROMPT):
+        self._client._validate_model(model)
+        started = time.perf_counter()
+        info = await self._client._transport.preload(model, warmup_prompt)
+        return _to_ns(_preload_result(model, info, started))
+
+
+def _preload_result(model: str, info: Dict[str, Any], started: float) -> Dict[str, Any]:
+    return {
+        "id": model,
+        "object": "model.preload",
+        "ready": True,
+        "warmup_ms": (info or {}).get("warmup_ms"),
+        "elapsed_ms": (time.perf_counter() - started) * 1000,
+    }
+
+
+# tracemalloc is process-wide: profilers count themselves here, and tracing that a
+# profiler started is stopped only when the last profiler closes.
+_TRACEMALLOC_LOCK = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_started = False
+
+
+class _MemoryProfiler:
+    """Brackets requests and streams with tracemalloc snapshots.
+
+    Each finished request or stream adds a record with the bytes it left
+    allocated, the traced peak while it ran and its top allocation sites.
+    The peak is process-wide, so overlapping async requests share it; it is
+    only reset when no other measurement is open.
+    """
+
+    def __init__(self, top: int = 10, history: int = 100):
+        global _tracemalloc_users, _tracemalloc_started
+        self.tracemalloc = importlib.import_module("tracemalloc")
+        self.top = top
+        self.records = collections.deque(maxlen=history)
+        self._open = 0
+        with _TRACEMALLOC_LOCK:
+            if _tracemalloc_users == 0 and not self.tracemalloc.is_tracing():
+                self.tracemalloc.start()
+                _tracemalloc_started = True
+            _tracemalloc_users += 1
+        self._registered = True
+
+    def _snapshot(self):
+        return self.tracemalloc.take_snapshot().filter_traces((
+            self.tracemalloc.Filter(False, self.tracemalloc.__file__),
+            self.tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+    def begin(self, label: str):
+        if self._open == 0 and hasattr(self.tracemalloc, "reset_peak"):
+            self.tracemalloc.reset_peak()
+        self._open += 1
+        current, _ = self.tracemalloc.get_traced_memory()
+        return label, self._snapshot(), current, time.perf_counter()
+
+    def end(self, token, **fields):
+        label, before, base, started = token
+        self._open = max(0, self._open - 1)
+        _, peak = self.tracemalloc.get_traced_memory()
+        stats = self._snapshot().compare_to(before, "lineno")
+        growing = sorted((stat for stat in stats if stat.size_diff > 0), key=lambda stat: stat.size_diff, reverse=True)
+        self.records.append({
+            "label": label,
+            "allocated": sum(stat.size_diff for stat in stats),
+            "peak": max(0, peak - base),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+            "top": [
+                {
+                    "site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    "size": stat.size_diff,
+                    "count": stat.count_diff,
+                }
+                for stat in growing[:self.top]
+            ],
+            **fields,
+        })
+
+    @contextlib.contextmanager
+    def measure(self, label: str):
+        token = self.begin(label)
+        try:
+            yield
+        finally:
+            self.end(token)
+
+    def summary(self) -> Dict[str, Any]:
+        current, peak = self.tracemalloc.get_traced_memory()
+        return {"traced_current": current, "traced_peak": peak, "requests": list(self.records)}
+
+    def close(self):
+        global _tracemalloc_users, _tracemalloc_started
+        with _TRACEMALLOC_LOCK:
+            if not self._registered:
+                return
+            self._registered = False
+            _tracemalloc_users -= 1
+            if _tracemalloc_users == 0 and _tracemalloc_started:
+                # Tracing someone else started (before the first profiler) is left running.
+                if self.tracemalloc.is_tracing():
+                    self.tracemalloc.stop()
+                _tracemalloc_started = False
+
+
+class _BaseClient:
+    def __init__(self, *, base_url: str, api_key: str, transport=None, **kwargs):
+        _validate_client_credentials(base_url, api_key, transport, kwargs)
+        resolved = _resolve_transport(base_url, api_key, transport, kwargs)
 
         self.base_url = base_url
         self.api_key = api_key
         self.options = kwargs
-        self.chat = _ChatAPI()
-        self.responses = _ResponsesAPI()
+        self.timeout = _validate_timeout(kwargs.get("timeout", _DEFAULT_TIMEOUT))
+        self.max_retries = kwargs.get("max_retries", _DEFAULT_MAX_RETRIES)
+        breaker = _BRIDGE_BREAKER if isinstance(_unwrap_transport(resolved), _BridgeTransport) else None
+        self._transport = _ModeratedTransport(_ResilientTransport(resolved, self.max_retries, breaker))
+        self._streams = weakref.WeakSet()
+        profile = kwargs.get("profile_memory", os.environ.get("NOPENAI_PROFILE_MEMORY"))
+        self._profiler = _MemoryProfiler() if profile and profile not in ("0", "false") else None
+
+    def _call_timeout(self, kwargs: Dict[str, Any]) -> Optional[float]:
+        return _validate_timeout(kwargs.pop("timeout", self.timeout))
+
+    def _measure(self, label: str):
+        if self._profiler is None:
+            return contextlib.nullcontext()
+        return self._profiler.measure(label)
+
+    def _track_stream(self, stream, label: str):
+        self._streams.add(stream)
+        if self._profiler is not None:
+            profiler, token = self._profiler, self._profiler.begin(label)
+            stream._on_finish = lambda finished: profiler.end(token, stream_id=finished.stream_id)
+        return stream
+
+    def _memory_report(self, runtime: Dict[str, Any]) -> Dict[str, Any]:
+        report = self._profiler.summary() if self._profiler is not None else {"requests": []}
+        report["profiling"] = self._profiler is not None
+        report["live_streams"] = [
+            {"stream_id": stream.stream_id, "type": type(stream).__name__, "finished": stream._finished}
+            for stream in list(self._streams)
+        ]
+        report["runtime"] = runtime
+        return report
+
+    def _validate_model(self, model: str):
+        # A real endpoint owns its model list; only the lab endpoint pins the model name.
+        if self.base_url == _LAB_BASE_URL:
+            _validate_model_name(model)
+
+    def _lab_models(self):
+        if self.base_url != _LAB_BASE_URL:
+            return None
+        return [_model_object(model) for model in _MODEL_REGISTRY]
+
+    def close(self):
+        self._transport.close()
+        if self._profiler is not None:
+            self._profiler.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 
-class AsyncOpenAI:
+class OpenAI(_BaseClient):
     def __init__(self, *, base_url: str, api_key: str, **kwargs):
-        _validate_client_credentials(base_url, api_key)
+        super().__init__(base_url=base_url, api_key=api_key, **kwargs)
+        self.chat = _ChatAPI(self)
+        self.responses = _ResponsesAPI(self)
+        self.models = _ModelsAPI(self)
 
-        self.base_url = base_url
-        self.api_key = api_key
-        self.options = kwargs
-        self.chat = _AsyncChatAPI()
-        self.responses = _AsyncResponsesAPI()
+    def memory_report(self) -> Dict[str, Any]:
+        """Per-request allocation records (with `profile_memory=True`), live streams and runtime stream sessions."""
+        return self._memory_report(self._transport.runtime_stats_sync())
+
+
+class AsyncOpenAI(_BaseClient):
+    def __init__(self, *, base_url: str, api_key: str, **kwargs):
+        super().__init__(base_url=base_url, api_key=api_key, **kwargs)
+        self.chat = _AsyncChatAPI(self)
+        self.responses = _AsyncResponsesAPI(self)
+        self.models = _AsyncModelsAPI(self)
+
+    async def memory_report(self) -> Dict[str, Any]:
+        """Per-request allocation records (with `profile_memory=True`), live streams and runtime stream sessions."""
+        return self._memory_report(await self._transport.runtime_stats())
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+def download_transcript(path: str) -> bool:
+    """Offer a `record=` transcript as a file download in the browser.
+
+    The mirror kept by the page is used, so this also works for transcripts
+    recorded by earlier runs. Returns False outside the browser or when
+    nothing was recorded at `path`.
+    """
+    download = _bridge_function("modelCoderDownloadTranscript") if _in_browser_runtime() else None
+    return bool(download(path)) if download is not None else False
 
 
-__all__ = ["OpenAI", "AsyncOpenAI", "OpenAIError"]
+__all__ = [
+    "OpenAI",
+    "AsyncOpenAI",
+    "OpenAIError",
+    "APIConnectionError",
+    "APITimeoutError",
+    "APIStatusError",
+    "download_transcript",
+]
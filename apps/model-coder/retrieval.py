@@ -0,0 +1,301 @@
+"""BM25 retrieval over the ask-* knowledge bases (`apps/ask-*/index.json`).
+
+The index is built once from the category/document JSON those apps ship and
+kept in flat `array` columns, so a query only walks the postings of its own
+terms. Built indexes serialize to a compact binary blob; loading one skips
+tokenising the corpus again.
+
+In the Model Coder lab, app.js writes the knowledge bases to
+`knowledge/<name>.json` (ask-andrew, ask-anton, ask-azure) before each run:
+
+    import retrieval
+
+    index = retrieval.load_or_build("knowledge/ask-andrew.json", "knowledge/ask-andrew.bm25")
+    for hit in index.search("what is responsible ai", k=3):
+        print(hit["score"], hit["title"])
+
+    messages = [
+        {"role": "system", "content": index.context("what is responsible ai")},
+        {"role": "user", "content": "What is responsible AI?"},
+    ]
+
+Command line (CPython, from apps/model-coder, where the knowledge bases sit in
+the sibling ask-* folders):
+
+    python retrieval.py build ../ask-andrew/index.json ask-andrew.bm25
+    python retrieval.py query ask-andrew.bm25 "what is responsible ai"
+"""
+
+import hashlib
+import heapq
+import json
+import math
+import re
+import struct
+import sys
+from array import array
+from typing import Any, Dict, Iterable, List, Optional
+
+_MAGIC = b"BM25"
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sHI")
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me of on or so that the this to "
+    "what when where which who why with you your".split()
+)
+# Keywords and titles are curated, so they count more than body text.
+_TITLE_WEIGHT = 2
+_KEYWORD_WEIGHT = 3
+_MAX_TF = 0xFFFF
+
+
+def _tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in _STOPWORDS]
+
+
+def _source_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _documents_from_knowledge_base(categories: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    documents = []
+    for category in categories:
+        for doc in category.get("documents") or []:
+            documents.append({
+                "id": doc.get("id"),
+                "title": str(doc.get("title") or ""),
+                "category": str(category.get("category") or ""),
+                "link": category.get("link"),
+                "keywords": [str(keyword) for keyword in doc.get("keywords") or []],
+                "content": str(doc.get("content") or ""),
+            })
+    return documents
+
+
+def _column_bytes(column: array) -> bytes:
+    if sys.byteorder != "little":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _column_from_bytes(typecode: str, data: bytes) -> array:
+    column = array(typecode)
+    column.frombytes(data)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column
+
+
+class BM25Index:
+    """Okapi BM25 over an in-memory document list.
+
+    Postings are stored term-major in three parallel arrays: `_offsets[t]`
+    to `_offsets[t + 1]` indexes the slice of `_postings` (document numbers)
+    and `_weights` (the BM25 contribution of term `t` to that document).
+    Weights are precomputed at build time, so scoring a query is a sum.
+    """
+
+    def __init__(self, documents: List[Dict[str, Any]], vocabulary: Dict[str, int], offsets: array,
+                 postings: array, weights: array, *, k1: float, b: float, source_digest: Optional[str] = None):
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        self.source_digest = source_digest
+        self._vocabulary = vocabulary
+        self._offsets = offsets
+        self._postings = postings
+        self._weights = weights
+
+    @classmethod
+    def build(cls, documents: List[Dict[str, Any]], *, k1: float = 1.2, b: float = 0.75,
+              source_digest: Optional[str] = None) -> "BM25Index":
+        term_frequencies = []
+        lengths = []
+        for doc in documents:
+            counts: Dict[str, int] = {}
+            tokens = (
+                _tokenize(doc["content"])
+                + _tokenize(doc["title"]) * _TITLE_WEIGHT
+                + _tokenize(" ".join(doc["keywords"])) * _KEYWORD_WEIGHT
+            )
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            term_frequencies.append(counts)
+            lengths.append(len(tokens))
+
+        doc_count = len(documents)
+        average_length = (sum(lengths) / doc_count) if doc_count else 0.0
+
+        by_term: Dict[str, List[int]] = {}
+        for doc_number, counts in enumerate(term_frequencies):
+            for term in counts:
+                by_term.setdefault(term, []).append(doc_number)
+
+        vocabulary = {}
+        offsets = array("I", [0])
+        postings = array("I")
+        weights = array("f")
+        for term_id, term in enumerate(sorted(by_term)):
+            vocabulary[term] = term_id
+            doc_numbers = by_term[term]
+            df = len(doc_numbers)
+            idf = math.log(1.0 + (doc_count - df + 0.5) / (df + 0.5))
+            for doc_number in doc_numbers:
+                tf = min(term_frequencies[doc_number][term], _MAX_TF)
+                norm = k1 * (1.0 - b + b * lengths[doc_number] / average_length) if average_length else k1
+                postings.append(doc_number)
+                weights.append(idf * tf * (k1 + 1.0) / (tf + norm))
+            offsets.append(len(postings))
+
+        return cls(documents, vocabulary, offsets, postings, weights, k1=k1, b=b, source_digest=source_digest)
+
+    @classmethod
+    def from_knowledge_base(cls, path: str, **kwargs) -> "BM25Index":
+        with open(path, "rb") as fh:
+            raw = fh.read()
+        documents = _documents_from_knowledge_base(json.loads(raw.decode("utf-8")))
+        return cls.build(documents, source_digest=_source_digest(raw), **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def scores(self, query: str) -> Dict[int, float]:
+        """Return `{document number: score}` for documents sharing a term with `query`."""
+        offsets, postings, weights = self._offsets, self._postings, self._weights
+        scores: Dict[int, float] = {}
+        for term in set(_tokenize(query)):
+            term_id = self._vocabulary.get(term)
+            if term_id is None:
+                continue
+            for position in range(offsets[term_id], offsets[term_id + 1]):
+                doc_number = postings[position]
+                scores[doc_number] = scores.get(doc_number, 0.0) + weights[position]
+        return scores
+
+    def search(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
+        """Return the top `k` documents for `query`, best first, each with a `score`."""
+        if k <= 0:
+            return []
+        best = heapq.nlargest(k, self.scores(query).items(), key=lambda item: item[1])
+        return [dict(self.documents[doc_number], score=score) for doc_number, score in best]
+
+    def context(self, query: str, k: int = 2, max_chars: int = 1200) -> str:
+        """Format the top hits as grounding text for a system message.
+
+        Returns an empty string when nothing matches, so callers can skip the
+        message. `max_chars` keeps the prompt inside SmolLM2's small context.
+        """
+        sections = []
+        remaining = max_chars
+        for hit in self.search(query, k):
+            section = f"{hit['title']}: {hit['content']}"
+            if len(section) > remaining:
+                section = section[:max(remaining, 0)].rstrip()
+            if section:
+                sections.append(section)
+            remaining -= len(section) + 1
+            if remaining <= 0:
+                break
+        if not sections:
+            return ""
+        return "Use this reference material when it is relevant:\n" + "\n".join(sections)
+
+    def to_bytes(self) -> bytes:
+        terms = sorted(self._vocabulary, key=self._vocabulary.__getitem__)
+        meta = json.dumps({
+            "k1": self.k1,
+            "b": self.b,
+            "source_digest": self.source_digest,
+            "terms": terms,
+            "documents": self.documents,
+        }, separators=(",", ":")).encode("utf-8")
+
+        columns = [_column_bytes(self._offsets), _column_bytes(self._postings), _column_bytes(self._weights)]
+        parts = [_HEADER.pack(_MAGIC, _FORMAT_VERSION, len(meta)), meta]
+        for column in columns:
+            parts.append(struct.pack("<I", len(column)))
+            parts.append(column)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BM25Index":
+        magic, version, meta_length = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC or version != _FORMAT_VERSION:
+            raise ValueError("not a BM25 index blob (or written by an incompatible version)")
+
+        position = _HEADER.size
+        meta = json.loads(data[position:position + meta_length].decode("utf-8"))
+        position += meta_length
+
+        columns = []
+        for typecode in ("I", "I", "f"):
+            (length,) = struct.unpack_from("<I", data, position)
+            position += 4
+            columns.append(_column_from_bytes(typecode, data[position:position + length]))
+            position += length
+
+        vocabulary = {term: term_id for term_id, term in enumerate(meta["terms"])}
+        return cls(meta["documents"], vocabulary, *columns, k1=meta["k1"], b=meta["b"],
+                   source_digest=meta["source_digest"])
+
+    def save(self, path: str):
+        with open(path, "wb") as fh:
+            fh.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, "rb") as fh:
+            return cls.from_bytes(fh.read())
+
+
+def load_or_build(knowledge_base_path: str, cache_path: Optional[str] = None) -> BM25Index:
+    """Load the cached index for `knowledge_base_path`, rebuilding it if the JSON changed."""
+    with open(knowledge_base_path, "rb") as fh:
+        digest = _source_digest(fh.read())
+
+    if cache_path:
+        try:
+            index = BM25Index.load(cache_path)
+        except (OSError, ValueError, KeyError, struct.error):
+            index = None
+        if index is not None and index.source_digest == digest:
+            return index
+
+    index = BM25Index.from_knowledge_base(knowledge_base_path)
+    if cache_path:
+        try:
+            index.save(cache_path)
+        except OSError:
+            pass
+    return index
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="index a knowledge base and write the binary index")
+    build.add_argument("knowledge_base")
+    build.add_argument("output")
+    query = commands.add_parser("query", help="search a binary index")
+    query.add_argument("index")
+    query.add_argument("text")
+    query.add_argument("-k", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        index = BM25Index.from_knowledge_base(args.knowledge_base)
+        index.save(args.output)
+        print(f"{len(index)} documents, {len(index._vocabulary)} terms -> {args.output}")
+        return 0
+
+    for hit in BM25Index.load(args.index).search(args.text, args.k):
+        print(f"{hit['score']:7.3f}  [{hit['category']}] {hit['title']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
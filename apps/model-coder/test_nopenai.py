@@ -0,0 +1,273 @@
+import asyncio
+import gc
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import nopenai
+
+
+class _FlakyTransport(nopenai._Transport):
+    """Raises each queued error in turn, then answers."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def request_sync(self, payload, timeout=None):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"ok": True}
+
+    async def request(self, payload, timeout=None):
+        return self.request_sync(payload, timeout)
+
+
+class _ChunkTransport(nopenai._Transport):
+    """Serves fixed chat text deltas for one stream and records closes."""
+
+    def __init__(self, deltas):
+        self.deltas = list(deltas)
+        self.closed = []
+
+    async def next_chunk(self, stream_id, timeout=None):
+        if not self.deltas:
+            return {"done": True, "chunk": None}
+        return {"done": False, "chunk": {"choices": [{"index": 0, "delta": {"content": self.deltas.pop(0)}}]}}
+
+    async def close_stream(self, stream_id):
+        self.closed.append(stream_id)
+
+
+@mock.patch.object(nopenai, "_RETRY_INITIAL_DELAY", 0.0)
+class ResilientTransportTest(unittest.TestCase):
+    def test_model_loading_is_retried_without_opening_the_breaker(self):
+        breaker = nopenai._CircuitBreaker(threshold=2, cooldown=30)
+        inner = _FlakyTransport([nopenai.OpenAIError("Model is not ready yet.") for _ in range(4)])
+        transport = nopenai._ResilientTransport(inner, max_retries=5, breaker=breaker)
+
+        self.assertEqual(transport.request_sync({}), {"ok": True})
+        self.assertEqual(inner.calls, 5)
+        self.assertFalse(breaker.is_open)
+        self.assertEqual(breaker.failures, 0)
+
+    def test_connection_errors_open_the_breaker(self):
+        breaker = nopenai._CircuitBreaker(threshold=2, cooldown=30)
+        inner = _FlakyTransport([nopenai.APIConnectionError("bridge missing") for _ in range(4)])
+        transport = nopenai._ResilientTransport(inner, max_retries=5, breaker=breaker)
+
+        with self.assertRaises(nopenai.APIConnectionError):
+            transport.request_sync({})
+        self.assertEqual(inner.calls, 2)
+        self.assertTrue(breaker.is_open)
+        with self.assertRaisesRegex(nopenai.APIConnectionError, "unavailable"):
+            transport.request_sync({})
+
+    def test_browser_main_thread_backs_off_without_blocking(self):
+        inner = _FlakyTransport([nopenai.OpenAIError("Model is not ready yet.")])
+        transport = nopenai._ResilientTransport(inner, max_retries=2, breaker=nopenai._CircuitBreaker())
+
+        with mock.patch.object(nopenai, "_on_browser_main_thread", return_value=True), \
+                mock.patch.object(nopenai.time, "sleep", side_effect=AssertionError("blocking sleep")):
+            self.assertEqual(transport.request_sync({}), {"ok": True})
+        self.assertEqual(inner.calls, 2)
+
+
+class _ChatHandler(BaseHTTPRequestHandler):
+    """Minimal /chat/completions endpoint: JSON answers or a short SSE stream."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, data: bytes, content_type: str, chunked: bool = False):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding" if chunked else "Content-Length", "chunked" if chunked else str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.peers.append(self.client_address)
+        if not body.get("stream"):
+            message = {"role": "assistant", "content": "hi"}
+            self._send(json.dumps({"choices": [{"index": 0, "message": message}]}).encode(), "application/json")
+        else:
+            events = [{"choices": [{"index": 0, "delta": {"content": word}}]} for word in ("a", "b", "c")]
+            lines = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+            data = lines.encode()
+            self._send(b"%x\r\n%s\r\n0\r\n\r\n" % (len(data), data), "text/event-stream", chunked=True)
+        if self.server.drop_connections:
+            # Keep-alive was promised, but the socket goes away: the client's pooled connection is stale.
+            self.close_connection = True
+
+
+class _ChatServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _ChatHandler)
+        self.peers = []
+        self.drop_connections = False
+
+    def handle_error(self, request, client_address):
+        pass  # Clients abandoning streams reset their sockets; that is expected here.
+
+
+class HTTPTransportTest(unittest.TestCase):
+    messages = [{"role": "user", "content": "hello"}]
+
+    def setUp(self):
+        self.server = _ChatServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def client(self, cls=nopenai.OpenAI, **options):
+        options.setdefault("timeout", 3)
+        client = cls(base_url=self.base_url, api_key="test", transport="http", coalesce_ms=0, **options)
+        self.addCleanup(client.close)
+        return client
+
+    def create(self, client, **kwargs):
+        return client.chat.completions.create(model="m", messages=self.messages, **kwargs)
+
+    def test_credentials_are_checked_before_the_pool_is_built(self):
+        with mock.patch.object(nopenai, "_HTTPConnectionPool") as pool:
+            with self.assertRaises(ValueError):
+                nopenai.OpenAI(base_url=self.base_url, api_key=" ", transport="http")
+            with self.assertRaises(nopenai.OpenAIError):
+                nopenai.OpenAI(base_url=self.base_url, api_key="test", transport="bridge")
+        pool.assert_not_called()
+
+    def test_keep_alive_connection_is_reused(self):
+        client = self.client(max_connections=1)
+        self.create(client)
+        self.assertEqual("".join(chunk.choices[0].delta.content or "" for chunk in self.create(client, stream=True)), "abc")
+        self.create(client)
+
+        self.assertEqual(len(set(self.server.peers)), 1)
+        self.assertEqual(client.memory_report()["runtime"]["idle_connections"], 1)
+
+    def test_stale_keep_alive_connection_is_retried_on_a_fresh_one(self):
+        client = self.client(max_connections=1, max_retries=0)
+        self.server.drop_connections = True
+        self.create(client)
+        self.assertEqual(self.create(client).choices[0].message.content, "hi")
+        self.assertEqual(len(set(self.server.peers)), 2)
+
+    def test_abandoned_stream_releases_its_slot(self):
+        client = self.client(max_connections=1)
+        for _ in range(3):
+            stream = self.create(client, stream=True)
+            for _chunk in stream:
+                break
+            del stream, _chunk
+            gc.collect()
+        self.assertEqual(self.create(client).choices[0].message.content, "hi")
+
+    def test_abandoned_async_stream_releases_its_slot(self):
+        async def scenario():
+            client = self.client(nopenai.AsyncOpenAI, max_connections=1)
+            for _ in range(3):
+                stream = await self.create(client, stream=True)
+                async for _chunk in stream:
+                    break
+                del stream, _chunk
+                gc.collect()
+            return (await self.create(client)).choices[0].message.content
+
+        self.assertEqual(asyncio.run(scenario()), "hi")
+
+    def test_waiting_for_a_slot_is_bounded_by_the_timeout(self):
+        client = self.client(max_connections=1, max_retries=0, timeout=0.5)
+        held = self.create(client, stream=True)
+        with self.assertRaisesRegex(nopenai.APITimeoutError, "free connection"):
+            self.create(client, stream=True)
+        held.close()
+        self.assertEqual(self.create(client).choices[0].message.content, "hi")
+
+    def test_waiting_for_the_async_gate_is_bounded_by_the_timeout(self):
+        async def scenario():
+            client = self.client(nopenai.AsyncOpenAI, max_connections=1, max_retries=0, timeout=0.5)
+            held = await self.create(client, stream=True)
+            with self.assertRaisesRegex(nopenai.APITimeoutError, "free connection"):
+                await self.create(client, stream=True)
+            await held.close()
+
+        asyncio.run(scenario())
+
+
+class StructuredStreamTest(unittest.TestCase):
+    malformed = ['{"answer": ', "oops", '"}']
+
+    def test_malformed_json_closes_the_stream(self):
+        transport = _ChunkTransport(self.malformed)
+        stream = nopenai._BaseStream("s1", transport, processors=[nopenai._StructuredOutputProcessor("chat")])
+        finished = []
+        stream._on_finish = finished.append
+
+        with self.assertRaisesRegex(nopenai.OpenAIError, "not valid JSON"):
+            list(stream)
+        self.assertEqual(transport.closed, ["s1"])
+        self.assertEqual(finished, [stream])
+        with self.assertRaises(StopIteration):
+            next(stream)
+
+    def test_malformed_json_closes_the_async_stream(self):
+        transport = _ChunkTransport(self.malformed)
+        stream = nopenai._AsyncBaseStream("s1", transport, processors=[nopenai._StructuredOutputProcessor("chat")])
+        finished = []
+        stream._on_finish = finished.append
+
+        async def consume():
+            return [chunk async for chunk in stream]
+
+        with self.assertRaisesRegex(nopenai.OpenAIError, "not valid JSON"):
+            asyncio.run(consume())
+        self.assertEqual(transport.closed, ["s1"])
+        self.assertEqual(finished, [stream])
+
+
+class ToolCallProcessorTest(unittest.TestCase):
+    def test_responses_tool_calls_are_indexed_from_zero(self):
+        processor = nopenai._ToolCallProcessor("responses")
+        text = (
+            '<tool_call>{"name": "a", "arguments": {}}</tool_call>'
+            '<tool_call>{"name": "b", "arguments": {"x": 1}}</tool_call>'
+        )
+        chunks = processor.process({"type": "response.output_text.delta", "delta": text})
+
+        done = [chunk for chunk in chunks if chunk["type"] == "response.output_item.done"]
+        self.assertEqual([chunk["item"]["name"] for chunk in done], ["a", "b"])
+        self.assertEqual(done[0]["output_index"], 0)
+        self.assertEqual([chunk["output_index"] for chunk in done], [0, 1])
+
+
+class TranscriptWriterTest(unittest.TestCase):
+    def test_file_is_closed_when_the_last_recorder_closes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "session.jsonl")
+            first = nopenai._RecordingTransport(_FlakyTransport([]), path)
+            second = nopenai._RecordingTransport(_FlakyTransport([]), path)
+            first.request_sync({"type": "chat.completions.create"})
+            first.close()
+            first.close()
+            self.assertFalse(first.writer._fh.closed)
+
+            second.request_sync({"type": "chat.completions.create"})
+            second.close()
+            self.assertIsNone(second.writer._fh)
+            self.assertEqual(len(nopenai._load_transcript_session(path, -1)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
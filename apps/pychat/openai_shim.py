@@ -1,21 +1,80 @@
-from js import webllmChat
+from js import webllmChat, webllmChatStreamStart, webllmChatStreamNext, webllmChatStreamCancel
 import json
 
+def _encode(value, codec):
+    # The "object" codec hands JS a native object instead of a JSON string
+    if codec == 'object':
+        try:
+            from js import Object
+            from pyodide.ffi import to_js
+            return to_js(value, dict_converter=Object.fromEntries)
+        except Exception:
+            pass
+    return json.dumps(value)
+
+def _decode(value):
+    # JS answers in the same form it was asked in: JSON text or a JS object
+    if isinstance(value, str):
+        return json.loads(value)
+    if hasattr(value, 'to_py'):
+        return value.to_py()
+    return value
+
 class ChatCompletion:
     @staticmethod
-    async def create(model, messages, **kwargs):
-        # Convert messages to JSON string for JS
-        messages_json = json.dumps(messages)
+    async def create(model, messages, stream=False, codec='json', **kwargs):
+        # Convert messages to JSON string (or a JS object) for JS
+        messages_js = _encode(messages, codec)
+
+        if stream:
+            # Start generation in JS and hand back an async iterator over its chunks
+            stream_id = await webllmChatStreamStart(messages_js)
+            return ChatCompletionStream(str(stream_id), codec)
         
         # Call the exposed JS function
-        response_json = await webllmChat(messages_json)
+        response = await webllmChat(messages_js)
         
         # Parse the response back to a dict
-        response_dict = json.loads(response_json)
+        response_dict = _decode(response)
         
         # Wrap in a simple object structure to mimic OpenAI response object
         return OpenAIResponse(response_dict)
 
+class ChatCompletionStream:
+    def __init__(self, stream_id, codec='json'):
+        self.stream_id = stream_id
+        self.codec = codec
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+
+        # Each call waits for the next chunk WebLLM produces
+        result = _decode(await webllmChatStreamNext(self.stream_id, self.codec))
+        if result.get('error'):
+            self.closed = True
+            raise RuntimeError(result['error'])
+        if result.get('done'):
+            self.closed = True
+            raise StopAsyncIteration
+        return ChatCompletionChunk(result.get('chunk', {}))
+
+    async def close(self):
+        # Stop the WebLLM engine if generation is still running
+        if not self.closed:
+            self.closed = True
+            await webllmChatStreamCancel(self.stream_id)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
 class OpenAIResponse:
     def __init__(self, data):
         self.choices = [Choice(c) for c in data.get('choices', [])]
@@ -29,5 +88,20 @@ class Message:
         self.content = data.get('content', '')
         self.role = data.get('role', '')
 
+class ChatCompletionChunk:
+    def __init__(self, data):
+        self.choices = [ChunkChoice(c) for c in data.get('choices', [])]
+
+class ChunkChoice:
+    def __init__(self, data):
+        self.index = data.get('index', 0)
+        self.delta = Delta(data.get('delta') or {})
+        self.finish_reason = data.get('finish_reason')
+
+class Delta:
+    def __init__(self, data):
+        self.content = data.get('content') or ''
+        self.role = data.get('role')
+
 # Export at module level
 ChatCompletion = ChatCompletion
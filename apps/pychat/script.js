@@ -5,6 +5,8 @@ let virtualFiles = {}; // Store virtual files
 let currentFile = 'script.py';
 let pyodideReady = false;
 let pyWorker = null;
+let chatStreams = new Map(); // Active streaming generations keyed by stream id
+let nextStreamId = 1;
 
 // Constants
 const MODEL_ID = "Llama-3.2-1B-Instruct-q4f16_1-MLC";
@@ -59,7 +61,7 @@ function runPythonFile(filename) {
     const fullCode = `
 import json
 import sys
-from js import document, window, webllmChat, prompt as js_prompt
+from js import document, window, webllmChat, webllmChatStreamStart, webllmChatStreamNext, webllmChatStreamCancel, prompt as js_prompt
 
 # Custom print that writes to output div
 def print(*args, **kwargs):
@@ -80,12 +82,46 @@ def input(prompt_text=''):
 # OpenAI shim
 class ChatCompletion:
     @staticmethod
-    async def create(model, messages, **kwargs):
+    async def create(model, messages, stream=False, **kwargs):
         messages_json = json.dumps(messages)
+        if stream:
+            stream_id = await webllmChatStreamStart(messages_json)
+            return ChatCompletionStream(str(stream_id))
         response_json = await webllmChat(messages_json)
         response_dict = json.loads(response_json)
         return OpenAIResponse(response_dict)
 
+class ChatCompletionStream:
+    def __init__(self, stream_id):
+        self.stream_id = stream_id
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        result = json.loads(await webllmChatStreamNext(self.stream_id))
+        if result.get('error'):
+            self.closed = True
+            raise RuntimeError(result['error'])
+        if result.get('done'):
+            self.closed = True
+            raise StopAsyncIteration
+        return ChatCompletionChunk(result.get('chunk', {}))
+
+    async def close(self):
+        if not self.closed:
+            self.closed = True
+            await webllmChatStreamCancel(self.stream_id)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
 class OpenAIResponse:
     def __init__(self, data):
         self.choices = [Choice(c) for c in data.get('choices', [])]
@@ -99,6 +135,21 @@ class Message:
         self.content = data.get('content', '')
         self.role = data.get('role', '')
 
+class ChatCompletionChunk:
+    def __init__(self, data):
+        self.choices = [ChunkChoice(c) for c in data.get('choices', [])]
+
+class ChunkChoice:
+    def __init__(self, data):
+        self.index = data.get('index', 0)
+        self.delta = Delta(data.get('delta') or {})
+        self.finish_reason = data.get('finish_reason')
+
+class Delta:
+    def __init__(self, data):
+        self.content = data.get('content') or ''
+        self.role = data.get('role')
+
 class OpenAIModule:
     ChatCompletion = ChatCompletion
 
@@ -143,17 +194,69 @@ async function initWebLLM() {
 }
 
 // Expose Chat function to Python
-window.webllmChat = async function (messagesJson) {
+// Messages arrive as JSON text or as a native object; the reply is returned in the same form
+window.webllmChat = async function (messagesInput) {
     if (!engine) {
         throw new Error("Model not loaded yet.");
     }
-    const messages = JSON.parse(messagesJson);
+    const isObjectInput = typeof messagesInput === 'object' && messagesInput !== null;
+    const messages = isObjectInput ? messagesInput : JSON.parse(messagesInput);
     const reply = await engine.chat.completions.create({
         messages: messages,
         temperature: 0.7,
         max_tokens: 500
     });
-    return JSON.stringify(reply);
+    return isObjectInput ? reply : JSON.stringify(reply);
+};
+
+// Expose streaming chat to Python: start, pull one chunk at a time, cancel
+window.webllmChatStreamStart = async function (messagesInput) {
+    if (!engine) {
+        throw new Error("Model not loaded yet.");
+    }
+    const isObjectInput = typeof messagesInput === 'object' && messagesInput !== null;
+    const messages = isObjectInput ? messagesInput : JSON.parse(messagesInput);
+    const chunks = await engine.chat.completions.create({
+        messages: messages,
+        temperature: 0.7,
+        max_tokens: 500,
+        stream: true
+    });
+    const streamId = `stream_${nextStreamId++}`;
+    chatStreams.set(streamId, chunks[Symbol.asyncIterator]());
+    return streamId;
+};
+
+window.webllmChatStreamNext = async function (streamId, codec = 'json') {
+    const encode = (result) => (codec === 'object' ? result : JSON.stringify(result));
+    const iterator = chatStreams.get(streamId);
+    if (!iterator) {
+        return encode({ done: true, chunk: null });
+    }
+    try {
+        const next = await iterator.next();
+        if (next.done) {
+            chatStreams.delete(streamId);
+            return encode({ done: true, chunk: null });
+        }
+        return encode({ done: false, chunk: next.value });
+    } catch (error) {
+        chatStreams.delete(streamId);
+        return encode({ done: true, error: String(error.message || error) });
+    }
+};
+
+window.webllmChatStreamCancel = async function (streamId) {
+    const iterator = chatStreams.get(streamId);
+    if (!iterator) {
+        return;
+    }
+    chatStreams.delete(streamId);
+    // Stop token generation in the engine, then release the iterator
+    engine.interruptGenerate();
+    if (typeof iterator.return === 'function') {
+        await iterator.return().catch(() => { });
+    }
 };
 
 // File Management Functions